@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set
+
+from client.client import TalkyClient, ClientDialect, _LidarFrame, _GridFrame
+from client.subscription.aio import AsyncTileSubscriptionService
+from common.constants import *
+from common.observation import LidarObservation, GnssObservation, RawBytesObservation
+from common.timing import TimingService
+from .occupancy.engine import OccupancyEngine, EngineMode
+
+'''
+    asyncio variant of TalkyClient. All coordination (queues between processing steps, tile subscriptions, MQTT
+    network I/O) happens on a single event loop, only CPU-heavy steps (grid matching, graph building, decoding remote
+    scenes) are offloaded to a small thread pool. Sensor callbacks may be invoked from any thread and hand their
+    observations over to the loop. Tasks are created by start() and cancelled by tear_down().
+'''
+
+TIMINGS_INFO_INTERVAL_SEC: float = 5.0
+
+
+def _put_latest(queue: asyncio.Queue, item):
+    # Drop the oldest queued item in favor of the new one
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+class AsyncTalkyClient(TalkyClient):
+    def __init__(self,
+                 loop: asyncio.AbstractEventLoop,
+                 for_subject_id: int,
+                 dialect: ClientDialect = ClientDialect.CARLA,
+                 grid_radius: int = OCCUPANCY_RADIUS_DEFAULT,
+                 engine_mode: EngineMode = EngineMode.IN_PROCESS,
+                 ):
+        self.loop: asyncio.AbstractEventLoop = loop
+        TimingService(threaded=False)  # Before anything else instantiates the singleton
+        self._init_state(for_subject_id, dialect, grid_radius, engine_mode)
+        self.tss: AsyncTileSubscriptionService = AsyncTileSubscriptionService(loop, self._on_remote_graph, client_id=self.ego_id)
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f'talky-{self.ego_id}')
+
+        self.lidar_queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.publish_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_PUBLISH_QUEUE_SIZE)
+        self.position_queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.tasks: List[asyncio.Task] = []
+        self.decode_tasks: Set[asyncio.Task] = set()
+        self.stage_lidar_key: str = f'stage_lidar_{self.ego_id}'  # Timings are shared by all clients on the loop's thread
+        self._info_handle: Optional[asyncio.TimerHandle] = None
+        self._record_handle: Optional[asyncio.TimerHandle] = None
+
+        if engine_mode == EngineMode.WORKER_PROCESS:
+            self.engine = OccupancyEngine(self._on_scene, ego_id=int(self.ego_id), grid_radius=grid_radius, offset_z=LIDAR_Z_OFFSET)
+
+        # Business logic
+        self.outbound.subscribe(OBS_GNSS_PREFIX + ALIAS_EGO, self._on_gnss)
+        self.outbound.subscribe(OBS_LIDAR_POINTS, self._on_lidar)
+        self.outbound.subscribe(OBS_GRAPH_LOCAL, self._on_local_graph)
+
+        logging.info(f'Hi, I\'m {self.ego_id}!')
+
+    def start(self):
+        self.tasks = [
+            self.loop.create_task(self._process_lidar()),
+            self.loop.create_task(self._process_publish()),
+            self.loop.create_task(self._process_position()),
+        ]
+        self._info_handle = self.loop.call_later(TIMINGS_INFO_INTERVAL_SEC, self._log_timings)
+        self._record_handle = self.loop.call_later(self.recorder.interval, self._record)
+
+    async def tear_down(self):
+        logging.info(f'Stopping client in {GRID_TTL_SEC} seconds.')
+        await asyncio.sleep(GRID_TTL_SEC)
+
+        self.alive = False
+        self.recording = False
+
+        for handle in [self._info_handle, self._record_handle]:
+            if handle:
+                handle.cancel()
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        # No more remote scenes come in once unsubscribed, pending ones are decoded before the pool shuts down
+        await self.tss.tear_down()
+        await asyncio.gather(*self.decode_tasks, return_exceptions=True)
+        await self.loop.run_in_executor(None, self.executor.shutdown)
+        self.om.tear_down()
+
+        if self.gm:
+            self.gm.tear_down()
+        if self.engine:
+            self.engine.tear_down()
+        self.timings.tear_down()
+
+        await asyncio.gather(*[self.loop.run_in_executor(None, sink.flush) for sink in [self.remote_grid_sink, self.local_grid_sink] if sink])
+
+    # Sensor callbacks are invoked on the simulator's threads
+
+    def _on_lidar(self, obs: LidarObservation):
+        self.loop.call_soon_threadsafe(_put_latest, self.lidar_queue, obs)
+
+    def _on_gnss(self, obs: GnssObservation):
+        self.loop.call_soon_threadsafe(_put_latest, self.position_queue, (obs.to_quadkey(level=OCCUPANCY_TILE_LEVEL), self._predict_tiles(obs)))
+
+    def _on_scene(self, obs: RawBytesObservation):
+        self.loop.call_soon_threadsafe(_put_latest, self.publish_queue, obs)
+
+    # Decoding remote scenes must not block the loop
+    def _on_remote_scene(self, obs: RawBytesObservation):
+        self.loop.call_soon_threadsafe(self._spawn_decode, obs)
+
+    def _spawn_decode(self, obs: RawBytesObservation):
+        if not self.alive:
+            return
+        task: asyncio.Task = self.loop.create_task(self._decode_remote_scene(obs))
+        self.decode_tasks.add(task)
+        task.add_done_callback(self.decode_tasks.discard)
+
+    async def _decode_remote_scene(self, obs: RawBytesObservation):
+        try:
+            await self.loop.run_in_executor(self.executor, super()._on_remote_scene, obs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f'Failed to decode remote scene: {e}')
+
+    # Lidar -> grid -> graph processing, only the most recent point cloud is waiting to be processed at any time
+    async def _process_lidar(self):
+        while True:
+            obs: LidarObservation = await self.lidar_queue.get()
+            self.timings.start(self.stage_lidar_key)
+
+            try:
+                frame: Optional[_LidarFrame] = self._preprocess_lidar(obs)
+                if not frame:
+                    continue
+
+                if self.engine:
+                    self.engine.submit(frame)
+                    continue
+
+                grid_frame: Optional[_GridFrame] = await self.loop.run_in_executor(self.executor, self._match_grid, frame)
+                if not grid_frame:
+                    continue
+
+                graph_obs: Optional[RawBytesObservation] = await self.loop.run_in_executor(self.executor, self._build_graph, grid_frame)
+                if graph_obs:
+                    _put_latest(self.publish_queue, graph_obs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f'Failed to process point cloud: {e}')
+            finally:
+                self.timings.stop(self.stage_lidar_key)
+
+    async def _process_publish(self):
+        while True:
+            obs: RawBytesObservation = await self.publish_queue.get()
+            self._publish_graph(obs)
+
+    async def _process_position(self):
+        while True:
+            qk, ahead = await self.position_queue.get()
+            await self.tss.update_position(qk, ahead=ahead)
+            self.world.move_to(qk)
+
+    # Pushing to a sink is cheap, writing happens on the sink's own thread
+    def _record(self):
+        self.recorder.snapshot()
+        self._record_handle = self.loop.call_later(self.recorder.interval, self._record)
+
+    def _log_timings(self):
+        self.timings.info()
+        self._info_handle = self.loop.call_later(TIMINGS_INFO_INTERVAL_SEC, self._log_timings)
@@ -4,29 +4,34 @@ from collections import deque
 from datetime import datetime
 from enum import Enum
 from threading import Thread, Lock
-from typing import cast, Dict, Optional, Deque, List
+from typing import Dict, Deque, Tuple, Optional, FrozenSet
 
 from pyquadkey2.quadkey import QuadKey
 
-from client.observation import ObservationManager, LinearObservationTracker
-from client.observation.sink import Sink, PickleObservationSink
+from client.graph import PEMGraphBuilder, GridArrays
+from client.observation import ObservationManager, LinearObservationTracker, DispatchMode, ObservationSynchronizer, interpolate_ego
+from client.observation.recorder import SnapshotRecorder
+from client.observation.sink import Sink, ColumnarObservationSink
+from client.pipeline import Pipeline, QueuePolicy, Stage
 from client.subscription import TileSubscriptionService
-from client.utils import map_pem_actor
+from client.subscription.predictor import TilePredictor
 from common.constants import *
 from common.constants import EVAL2_BASE_KEY
 from common.model import DynamicActor
-from common.observation import CameraRGBObservation, ActorsObservation, PEMTrafficSceneObservation, RawBytesObservation
+from common.observation import Observation, CameraRGBObservation, ActorsObservation, RawBytesObservation
 from common.observation import OccupancyGridObservation, LidarObservation, PositionObservation, \
     GnssObservation
-from common.serialization.schema import GridCellState
-from common.serialization.schema.actor import PEMDynamicActor
-from common.serialization.schema.base import PEMTrafficScene
-from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
-from common.serialization.schema.relation import PEMRelation
+from common.serialization import wire
 from common.timing import TimingService
 from .inbound import InboundController
 from .occupancy import OccupancyGridManager
+from .occupancy.engine import OccupancyEngine, EngineMode
 from .outbound import OutboundController
+from .world import CooperativeWorldModel, SOURCE_LOCAL, SOURCE_REMOTE, decode_grid
+
+
+_LidarFrame = Tuple[LidarObservation, ActorsObservation, ActorsObservation]  # Point cloud, ego, other actors
+_GridFrame = Tuple[OccupancyGridObservation, ActorsObservation, ActorsObservation]  # Matched grid, ego, other actors
 
 
 class ClientDialect(Enum):
@@ -38,27 +43,60 @@ class TalkyClient:
                  for_subject_id: int,
                  dialect: ClientDialect = ClientDialect.CARLA,
                  grid_radius: int = OCCUPANCY_RADIUS_DEFAULT,
+                 engine_mode: EngineMode = EngineMode.IN_PROCESS,
                  ):
+        self._init_state(for_subject_id, dialect, grid_radius, engine_mode)
+        self.tss: TileSubscriptionService = TileSubscriptionService(self._on_remote_graph, client_id=self.ego_id)
+
+        self.recorder.start()
+
+        # Lidar -> grid -> graph processing
+        publisher: Stage = Stage('publish', self._publish_graph, policy=QueuePolicy.FIFO, maxsize=PIPELINE_PUBLISH_QUEUE_SIZE)
+        self.pipeline: Pipeline = Pipeline().add_stage('lidar', self._preprocess_lidar, policy=QueuePolicy.LATEST)
+
+        if engine_mode == EngineMode.IN_PROCESS:
+            self.pipeline \
+                .add_stage('matching', self._match_grid, policy=QueuePolicy.LATEST) \
+                .add_stage('graph', self._build_graph, policy=QueuePolicy.LATEST)
+        else:
+            # Encoded scenes come back asynchronously and are fed into the publishing stage directly
+            self.engine = OccupancyEngine(publisher.put, ego_id=int(self.ego_id), grid_radius=grid_radius, offset_z=LIDAR_Z_OFFSET)
+            self.pipeline.add_stage('engine', self.engine.submit, policy=QueuePolicy.LATEST)
+
+        self.pipeline.add(publisher).start()
+
+        # Business logic
+        self.outbound.subscribe(OBS_GNSS_PREFIX + ALIAS_EGO, self._on_gnss, mode=DispatchMode.EXECUTOR)  # (Re-)subscribing tiles involves network round trips
+        self.outbound.subscribe(OBS_LIDAR_POINTS, self._on_lidar)
+        self.outbound.subscribe(OBS_GRAPH_LOCAL, self._on_local_graph)
+
+        logging.info(f'Hi, I\'m {self.ego_id}!')
+
+    # Sets up everything that does not involve threads, tile subscriptions or the processing pipeline
+    def _init_state(self, for_subject_id: int, dialect: ClientDialect, grid_radius: int, engine_mode: EngineMode):
         self.ego_id: str = str(for_subject_id)
         self.dialect: ClientDialect = dialect
         self.om: ObservationManager = ObservationManager()
         # Please Note: The occupancy grid manager might also be part of the simulation-related code, e.g. as a
         # virtual sensor of the ego vehicle. The current implementation assumes that a vehicle can only deliver
         # low-level fused raw sensor data and does not know about occupancy grids or object lists
-        self.gm: OccupancyGridManager = OccupancyGridManager(OCCUPANCY_TILE_LEVEL, grid_radius)
+        # In worker process mode, grid matching and graph building run in a separate process and the grid itself
+        # is not available locally, i.e. no OBS_GRID_LOCAL observations are published.
+        self.engine_mode: EngineMode = engine_mode
+        self.gm: OccupancyGridManager = OccupancyGridManager(OCCUPANCY_TILE_LEVEL, grid_radius, offset_z=LIDAR_Z_OFFSET) if engine_mode == EngineMode.IN_PROCESS else None
+        self.engine: OccupancyEngine = None
         self.inbound: InboundController = InboundController(self.om, self.gm)
         self.outbound: OutboundController = OutboundController(self.om, self.gm)
-        self.tss: TileSubscriptionService = TileSubscriptionService(self._on_remote_graph, client_id=self.ego_id)
         self.tracker: LinearObservationTracker = LinearObservationTracker(n=10)
+        self.graph_builder: PEMGraphBuilder = PEMGraphBuilder(self.tracker)
+        self.world: CooperativeWorldModel = CooperativeWorldModel()
+        self.predictor: TilePredictor = TilePredictor()
         self.timings: TimingService = TimingService()
-        self.quadint_cache: Dict[str, int] = {}
         self.remote_grid_sink: Sink = None
         self.local_grid_sink: Sink = None
         self.alive: bool = True
         self.recording: bool = False
-
-        self.recording_thread: Thread = Thread(target=self._record, daemon=True)
-        self.recording_thread.start()
+        self.recorder: SnapshotRecorder = SnapshotRecorder(self.om, rate=RECORDING_RATE)
         self.decode_lock: Lock = Lock()
 
         # Type registrations
@@ -66,30 +104,27 @@ class TalkyClient:
         self.om.register_key(OBS_LIDAR_POINTS, LidarObservation)
         self.om.register_key(OBS_CAMERA_RGB_IMAGE, CameraRGBObservation)
         self.om.register_key(OBS_GRID_LOCAL, OccupancyGridObservation)
-        self.om.register_key(OBS_GRAPH_LOCAL, PEMTrafficSceneObservation)
-        self.om.register_key(OBS_GRAPH_REMOTE, RawBytesObservation)
+        self.om.register_key(OBS_GRAPH_LOCAL, RawBytesObservation)
+        self.om.register_key(OBS_GRAPH_REMOTE, RawBytesObservation, ttl=GRID_TTL_SEC)
         self.om.register_key(OBS_ACTOR_EGO, ActorsObservation)
         self.om.register_key(OBS_ACTORS_RAW, ActorsObservation)
         self.om.register_key(OBS_GNSS_PREFIX + self.ego_id, GnssObservation)
 
         self.om.register_alias(OBS_GNSS_PREFIX + self.ego_id, OBS_GNSS_PREFIX + ALIAS_EGO)
 
-        # Miscellaneous
-        self.gm.offset_z = LIDAR_Z_OFFSET
+        # Point clouds are only matched with actor observations taken at about the same time
+        self.sync: ObservationSynchronizer = ObservationSynchronizer(tolerance=SYNC_TOLERANCE_SEC)
+        self.sync.register_stream(OBS_ACTOR_EGO, interpolate=interpolate_ego)
+        self.sync.register_stream(OBS_ACTORS_RAW)
+        self.outbound.subscribe(OBS_ACTOR_EGO, lambda obs: self.sync.push(OBS_ACTOR_EGO, obs))
+        self.outbound.subscribe(OBS_ACTORS_RAW, lambda obs: self.sync.push(OBS_ACTORS_RAW, obs))
 
-        # Business logic
-        self.outbound.subscribe(OBS_GNSS_PREFIX + ALIAS_EGO, self._on_gnss)
-        self.outbound.subscribe(OBS_LIDAR_POINTS, self._on_lidar)
-        self.outbound.subscribe(OBS_GRID_LOCAL, self._on_grid)
-        self.outbound.subscribe(OBS_GRAPH_LOCAL, self._on_local_graph)
+        # Remote scenes are merged into the world model as they arrive, fusion itself happens once per local grid
+        self.outbound.subscribe(OBS_GRAPH_REMOTE, self._on_remote_scene)
 
         # Debugging stuff
         self.last_publish: float = time.monotonic()
-        self.tsdiffhistory1: Deque[float] = deque(maxlen=100)
-        self.tsdiffhistory2: Deque[float] = deque(maxlen=100)
-        self.tsdiffhistory3: Deque[float] = deque(maxlen=100)
-
-        logging.info(f'Hi, I\'m {self.ego_id}!')
+        self.tsdiffhistory: Deque[float] = deque(maxlen=100)
 
     def tear_down(self):
         logging.info(f'Stopping client in {GRID_TTL_SEC} seconds.')
@@ -97,8 +132,14 @@ class TalkyClient:
 
         self.alive = False
         self.recording = False
+        self.recorder.tear_down()
+        self.pipeline.tear_down()
         self.om.tear_down()
-        self.gm.tear_down()
+
+        if self.gm:
+            self.gm.tear_down()
+        if self.engine:
+            self.engine.tear_down()
         self.timings.tear_down()
 
         if self.tss:
@@ -112,22 +153,28 @@ class TalkyClient:
         if not self.recording:
             now: datetime = datetime.now()
 
-            self.local_grid_sink = PickleObservationSink(
+            self.local_grid_sink = ColumnarObservationSink(
                 key=OBS_GRAPH_LOCAL,
                 outpath=os.path.join(
                     self.data_dir, EVAL2_DATA_DIR, 'observed',  # No evaluation-related code is supposed to be here
-                    now.strftime(f'{EVAL2_BASE_KEY}_{FUSION_DECAY_LAMBDA}-decay_%Y-%m-%d_%H-%M-%S_local_ego-{self.ego_id}.pkl')
+                    now.strftime(f'{EVAL2_BASE_KEY}_{FUSION_DECAY_LAMBDA}-decay_%Y-%m-%d_%H-%M-%S_local_ego-{self.ego_id}.tkcol')
                 )
             )
 
-            self.remote_grid_sink = PickleObservationSink(
+            self.remote_grid_sink = ColumnarObservationSink(
                 key=OBS_GRAPH_REMOTE,
                 outpath=os.path.join(
                     self.data_dir, EVAL2_DATA_DIR, 'observed',  # No evaluation-related code is supposed to be here
-                    now.strftime(f'{EVAL2_BASE_KEY}_{FUSION_DECAY_LAMBDA}-decay_%Y-%m-%d_%H-%M-%S_remote_ego-{self.ego_id}.pkl')
+                    now.strftime(f'{EVAL2_BASE_KEY}_{FUSION_DECAY_LAMBDA}-decay_%Y-%m-%d_%H-%M-%S_remote_ego-{self.ego_id}.tkcol')
                 )
             )
 
+            self.recorder.set_sink(OBS_GRAPH_LOCAL, self.local_grid_sink)
+            self.recorder.set_sink(OBS_GRAPH_REMOTE, self.remote_grid_sink)
+        else:
+            for key in [OBS_GRAPH_LOCAL, OBS_GRAPH_REMOTE]:
+                Thread(target=self.recorder.remove_sink(key).flush).start()
+
         self.recording = not self.recording
 
     @property
@@ -135,47 +182,65 @@ class TalkyClient:
         return os.path.normpath(os.path.join(os.path.dirname(__file__), '../../data'))
 
     def _on_lidar(self, obs: LidarObservation):
-        _ts = time.monotonic()
+        self.pipeline.put(obs)
 
-        if self.om.has(OBS_ACTOR_EGO):
-            ego_obs: ActorsObservation = cast(ActorsObservation, self.om.latest(OBS_ACTOR_EGO))
-            ego: DynamicActor = cast(ActorsObservation, ego_obs).value[0]
+    def _on_gnss(self, obs: GnssObservation):
+        qk: QuadKey = obs.to_quadkey(level=OCCUPANCY_TILE_LEVEL)  # Fine-grained for the subscriptions' hysteresis
 
-            actors: List[DynamicActor] = [ego]
-            if self.om.has(OBS_ACTORS_RAW):
-                actors += cast(ActorsObservation, self.om.latest(OBS_ACTORS_RAW)).value
+        # Also called when staying within the same tile, as tiles ahead might have changed
+        self.tss.update_position(qk, ahead=self._predict_tiles(obs))
+        self.world.move_to(qk)
 
-            self.gm.update_actors(actors)
-            self.gm.update_gnss(GnssObservation(timestamp=ego_obs.timestamp, coords=ego.gnss.value.components()))
+    # Remote tiles the ego is going to enter soon, based on its latest known velocity
+    def _predict_tiles(self, obs: GnssObservation) -> FrozenSet[QuadKey]:
+        ego: Optional[ActorsObservation] = self.om.latest(OBS_ACTOR_EGO, max_age=1)
+        if not ego or not ego.value:
+            return frozenset()
 
-        if not self.gm.match_with_lidar(cast(LidarObservation, obs)):
-            return
+        # Carla's y axis points south
+        v = ego.value[0].dynamics.velocity.value
+        return self.predictor.predict(obs.value, (-v.y, v.x, 0))
 
-        grid = self.gm.get_grid()
-        if not grid:
-            return
+    # Pipeline stage 1: Pairs a point cloud with the actor observations it was taken with. Frames that can not be aligned are skipped.
+    def _preprocess_lidar(self, obs: LidarObservation) -> Optional[_LidarFrame]:
+        if obs.value is None or len(obs.value) == 0:
+            return None
 
-        obs = OccupancyGridObservation(obs.timestamp, grid)
-        self.inbound.publish(OBS_GRID_LOCAL, obs)
+        aligned: Optional[Dict[str, Observation]] = self.sync.align(obs.timestamp)
+        if not aligned:
+            return None
 
-        self.tsdiffhistory1.append(time.monotonic() - _ts)
-        # logging.debug(f'LIDAR: {np.mean(self.tsdiffhistory1)}')
+        return obs, aligned[OBS_ACTOR_EGO], aligned[OBS_ACTORS_RAW]
 
-    def _on_gnss(self, obs: GnssObservation):
-        qk: QuadKey = obs.to_quadkey(level=REMOTE_GRID_TILE_LEVEL)
+    # Pipeline stage 2: Matches the point cloud against the current occupancy grid
+    def _match_grid(self, frame: _LidarFrame) -> Optional[_GridFrame]:
+        obs, ego_obs, others_obs = frame
 
-        if qk != self.tss.current_parent:
-            self.tss.update_position(qk)
+        if ego_obs.value:
+            ego: DynamicActor = ego_obs.value[0]
 
-    def _on_grid(self, obs: OccupancyGridObservation):
-        _ts = time.monotonic()
+            self.gm.update_actors([ego] + others_obs.value)
+            self.gm.update_gnss(GnssObservation(timestamp=ego_obs.timestamp, coords=ego.gnss.value.components()))
 
-        ts1, grid = obs.timestamp, obs.value
-        actors_ego_obs = self.om.latest(OBS_ACTOR_EGO)
-        actors_others_obs = self.om.latest(OBS_ACTORS_RAW)
+        if not self.gm.match_with_lidar(obs):
+            return None
 
-        if not grid or not actors_ego_obs or not actors_others_obs or not actors_ego_obs.value or len(actors_ego_obs.value) < 1:
-            return
+        grid = self.gm.get_grid()
+        if not grid:
+            return None
+
+        grid_obs: OccupancyGridObservation = OccupancyGridObservation(obs.timestamp, grid)
+        self.inbound.publish(OBS_GRID_LOCAL, grid_obs)
+
+        return grid_obs, ego_obs, others_obs
+
+    # Pipeline stage 3: Builds the encoded local traffic scene
+    def _build_graph(self, frame: _GridFrame) -> Optional[RawBytesObservation]:
+        grid_obs, actors_ego_obs, actors_others_obs = frame
+        ts1, grid = grid_obs.timestamp, grid_obs.value
+
+        if not grid or not actors_ego_obs.value:
+            return None
 
         ts: float = min([ts1, actors_ego_obs.timestamp, actors_others_obs.timestamp])
 
@@ -189,100 +254,56 @@ class TalkyClient:
         # visible_actors: Dict[str, DynamicActor] = get_occupied_cells_multi_map(actors_others_obs.value + [ego_actor])
         visible_actors: Dict[str, DynamicActor] = {}
 
-        # Generate PEM complex object attributes
-        pem_ego = map_pem_actor(ego_actor)
-        pem_grid = PEMOccupancyGrid(cells=[])
-
-        for cell in grid.cells:
-            group_key = f'cell_occupant_{cell.quad_key.key}'
-
-            state_relation: PEMRelation[GridCellState] = PEMRelation(cell.state.confidence, GridCellState(cell.state.value))
-            occupant_relation: PEMRelation[Optional[PEMDynamicActor]] = PEMRelation(0, None)
-
-            if cell.quad_key.key in visible_actors:
-                actor = visible_actors[cell.quad_key.key]
-                self.tracker.track(group_key, str(actor.id))
-                occupant_relation = PEMRelation(self.tracker.get(group_key, str(actor.id)), map_pem_actor(actor))
-            else:
-                occupant_relation = PEMRelation(cell.state.confidence, None)
-
-            self.tracker.cycle_group(group_key)
-
-            # Consistency between state and occupant presence
-            if occupant_relation.object and state_relation.object != GridCellState.occupied():
-                if occupant_relation.confidence > state_relation.confidence:
-                    state_relation = PEMRelation(occupant_relation.confidence, GridCellState.occupied())
-                else:
-                    occupant_relation = PEMRelation(state_relation.confidence, None)
-
-            pem_grid.cells.append(PEMGridCell(
-                hash=self._get_quadint(cell.quad_key),
-                state=state_relation,
-                occupant=occupant_relation
-            ))
-
+        arrays: GridArrays = self.graph_builder.compute(grid, visible_actors)
         now = time.time()
 
-        # Generate PEM graph
-        graph = PEMTrafficScene(timestamp=ts,
-                                last_timestamp=now,
-                                measured_by=pem_ego,
-                                occupancy_grid=pem_grid)
+        self.world.update(SOURCE_LOCAL, arrays, ts)
+        self.world.fuse(ref_time=now)
 
-        encoded_msg = graph.to_bytes()
+        # Generate PEM graph
+        encoded_msg: bytes = self.graph_builder.encode(arrays, ego_actor, timestamp=ts, last_timestamp=now)
         self.timings.start('d1', custom_time=ts2)
         self.timings.stop('d1')
 
-        obs: PEMTrafficSceneObservation = PEMTrafficSceneObservation(now, graph, meta={'sender': int(self.ego_id)})
-        self.inbound.publish(OBS_GRAPH_LOCAL, obs)
+        return RawBytesObservation(now, encoded_msg, meta={'sender': int(self.ego_id)})
 
-        if self.alive and self.recording and self.local_grid_sink:
-            if OBS_GRAPH_LOCAL not in self.local_grid_sink.accumulator:
-                self.local_grid_sink.push(OBS_GRAPH_LOCAL, [obs])
-            else:
-                self.local_grid_sink.accumulator[OBS_GRAPH_LOCAL].append(obs)
+    # Pipeline stage 4: Hands the encoded scene to local consumers (including the recorder) and the edge nodes
+    def _publish_graph(self, obs: RawBytesObservation):
+        self.inbound.publish(OBS_GRAPH_LOCAL, obs)
 
         if self.tss.active:
-            self.tss.publish_graph(encoded_msg)
+            self.tss.publish_graph(obs.value)
 
             # Debug logging
-            self.tsdiffhistory3.append(time.monotonic() - self.last_publish)
+            self.tsdiffhistory.append(time.monotonic() - self.last_publish)
             self.last_publish = time.monotonic()
-            # logging.debug(f'PUBLISH: {np.mean(self.tsdiffhistory3)}')
+            # logging.debug(f'PUBLISH: {np.mean(self.tsdiffhistory)}')
 
-        self.tsdiffhistory2.append(time.monotonic() - _ts)
-        # logging.debug(f'GRID: {np.mean(self.tsdiffhistory2)}')
+    def _on_local_graph(self, obs: RawBytesObservation):
+        # In worker process mode, the local grid is only available in its encoded form
+        if self.engine_mode == EngineMode.WORKER_PROCESS:
+            arrays, timestamp = decode_grid(obs.value)
+            self.world.update(SOURCE_LOCAL, arrays, timestamp)
+            self.world.fuse()
 
-    def _on_local_graph(self, obs: PEMTrafficSceneObservation):
-        pass
+    def _on_remote_scene(self, obs: RawBytesObservation):
+        arrays, timestamp = decode_grid(obs.value)
+        self.world.update(SOURCE_REMOTE, arrays, timestamp)
 
+    # Remote scenes are only decoded by whoever consumes them, e.g. from OBS_GRAPH_REMOTE, here only timestamps are read
     def _on_remote_graph(self, msg: bytes):
         in_time: float = time.time()
 
         try:
-            scene: PEMTrafficScene = PEMTrafficScene.from_bytes(msg)
-            obs: PEMTrafficSceneObservation = PEMTrafficSceneObservation(time.time(), scene, meta={'sender': int(self.ego_id)})
-
-            if self.alive and self.recording and self.remote_grid_sink:
-                if OBS_GRAPH_REMOTE not in self.remote_grid_sink.accumulator:
-                    self.remote_grid_sink.push(OBS_GRAPH_REMOTE, [obs])
-                else:
-                    self.remote_grid_sink.accumulator[OBS_GRAPH_REMOTE].append(obs)
-
-            self.timings.start('d6', custom_time=in_time)
-            self.timings.stop('d6')
-        except KeyError:
+            _, _, last_timestamp = wire.peek_timestamps(msg)
+        except ValueError:
             return
 
-        self.timings.start('d5', custom_time=scene.last_timestamp)
-        self.timings.stop('d5', custom_time=in_time)
+        obs: RawBytesObservation = RawBytesObservation(in_time, msg, meta={'sender': int(self.ego_id)})
+        self.inbound.publish(OBS_GRAPH_REMOTE, obs)
 
-    def _get_quadint(self, qk: QuadKey) -> int:
-        if qk.key not in self.quadint_cache:
-            self.quadint_cache[qk.key] = qk.to_quadint()
-        return self.quadint_cache[qk.key]
+        self.timings.start('d6', custom_time=in_time)
+        self.timings.stop('d6')
 
-    def _record(self):
-        while True:
-            time.sleep(1 / RECORDING_RATE)
-            pass
+        self.timings.start('d5', custom_time=last_timestamp)
+        self.timings.stop('d5', custom_time=in_time)
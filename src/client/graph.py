@@ -0,0 +1,128 @@
+from typing import Dict, List, Set
+
+import numpy as np
+from pyquadkey2.quadkey import QuadKey
+
+from client.observation import LinearObservationTracker
+from client.utils import map_pem_actor
+from common.model import DynamicActor
+from common.occupancy import Grid, GridCell, GridCellState
+from common.serialization import wire
+from common.serialization.schema.proto import actor_pb2, occupancy_pb2
+
+'''
+    Builds the wire message of a local traffic scene in bulk. Cell states and confidences are taken from the
+    grid as flat arrays, consistency between cell state and occupant presence is established using vector
+    operations and the resulting arrays are encoded without creating any intermediate PEM objects.
+    Only cells with an occupant are handled individually.
+'''
+
+
+class GridArrays:
+    def __init__(self, hashes: np.ndarray, states: np.ndarray, confidences: np.ndarray, occupant_confidences: np.ndarray, occupants: Dict[int, DynamicActor] = None):
+        self.hashes: np.ndarray = hashes  # uint64 quadints
+        self.states: np.ndarray = states  # uint8 GridCellState
+        self.confidences: np.ndarray = confidences  # float32
+        self.occupant_confidences: np.ndarray = occupant_confidences  # float32
+        self.occupants: Dict[int, DynamicActor] = occupants if occupants else {}  # Cell index -> occupant
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+class PEMGraphBuilder:
+    def __init__(self, tracker: LinearObservationTracker, group_prefix: str = 'cell_occupant_'):
+        self.tracker: LinearObservationTracker = tracker
+        self.group_prefix: str = group_prefix
+        self.quadint_cache: Dict[str, int] = {}
+        self.tracked_keys: Set[str] = set()
+
+        # Cell order and quadints only change when the grid itself is replaced
+        self._grid: Grid = None
+        self._cells: List[GridCell] = []
+        self._cell_keys: List[str] = []
+        self._cell_index: Dict[str, int] = {}
+        self._hashes: np.ndarray = np.empty(0, dtype=np.uint64)
+
+    def compute(self, grid: Grid, visible_actors: Dict[str, DynamicActor]) -> GridArrays:
+        if grid is not self._grid or len(grid.cells) != len(self._cells):
+            self._update_grid(grid)
+
+        n: int = len(self._cells)
+        states: np.ndarray = np.fromiter((c.state.value for c in self._cells), dtype=np.uint8, count=n)
+        confidences: np.ndarray = np.fromiter((c.state.confidence for c in self._cells), dtype=np.float32, count=n)
+
+        has_occupant: np.ndarray = np.zeros(n, dtype=np.bool_)
+        occupant_confidences: np.ndarray = confidences.copy()
+        occupants: Dict[int, DynamicActor] = {}
+
+        for key, actor in visible_actors.items():
+            if key not in self._cell_index:
+                continue
+            i: int = self._cell_index[key]
+            group_key: str = self.group_prefix + key
+            self.tracker.track(group_key, str(actor.id))
+            self.tracked_keys.add(key)
+            has_occupant[i] = True
+            occupant_confidences[i] = self.tracker.get(group_key, str(actor.id))
+            occupants[i] = actor
+
+        for key in self.tracked_keys.intersection(self._cell_index.keys()):
+            self.tracker.cycle_group(self.group_prefix + key)
+
+        # Consistency between state and occupant presence
+        conflict: np.ndarray = has_occupant & (states != GridCellState.OCCUPIED)
+        promote: np.ndarray = conflict & (occupant_confidences > confidences)
+        demote: np.ndarray = conflict & ~promote
+
+        states[promote] = GridCellState.OCCUPIED
+        confidences[promote] = occupant_confidences[promote]
+        occupant_confidences[demote] = confidences[demote]
+        for i in np.flatnonzero(demote):
+            del occupants[int(i)]
+
+        return GridArrays(self._hashes, states, confidences, occupant_confidences, occupants)
+
+    @staticmethod
+    def encode(arrays: GridArrays, ego: DynamicActor, timestamp: float, last_timestamp: float) -> bytes:
+        plain: np.ndarray = np.ones(len(arrays), dtype=np.bool_)
+        plain[list(arrays.occupants.keys())] = False
+
+        grid: List[bytes] = [wire.encode_grid_cells(
+            arrays.hashes[plain],
+            arrays.states[plain],
+            arrays.confidences[plain],
+            arrays.occupant_confidences[plain]
+        )]
+
+        actor_msgs: Dict[int, actor_pb2.DynamicActor] = {}
+        for i, actor in arrays.occupants.items():
+            if actor.id not in actor_msgs:
+                actor_msgs[actor.id] = map_pem_actor(actor).to_message()
+
+            grid.append(wire.encode_grid_cell_message(occupancy_pb2.GridCell(
+                hash=int(arrays.hashes[i]),
+                state=occupancy_pb2.GridCellStateRelation(confidence=float(arrays.confidences[i]), object=int(arrays.states[i])),
+                occupant=actor_pb2.DynamicActorRelation(confidence=float(arrays.occupant_confidences[i]), object=actor_msgs[actor.id])
+            ).SerializeToString()))
+
+        return wire.encode_scene(
+            timestamp=timestamp,
+            min_timestamp=last_timestamp,
+            max_timestamp=last_timestamp,
+            last_timestamp=last_timestamp,
+            measured_by=map_pem_actor(ego).to_bytes(),
+            grid=b''.join(grid)
+        )
+
+    def _update_grid(self, grid: Grid):
+        self._grid = grid
+        self._cells = list(grid.cells)
+        self._cell_keys = [c.quad_key.key for c in self._cells]
+        self._cell_index = {k: i for i, k in enumerate(self._cell_keys)}
+        self._hashes = np.array([self._get_quadint(c.quad_key) for c in self._cells], dtype=np.uint64)
+
+    def _get_quadint(self, qk: QuadKey) -> int:
+        if qk.key not in self.quadint_cache:
+            self.quadint_cache[qk.key] = qk.to_quadint()
+        return self.quadint_cache[qk.key]
@@ -1,5 +1,3 @@
-from multiprocessing.pool import ThreadPool
-
 from common.observation import Observation
 from .observation import ObservationManager
 from .occupancy import OccupancyGridManager
@@ -9,7 +7,7 @@ class InboundController:
     def __init__(self, om: ObservationManager, gm: OccupancyGridManager):
         self.om: ObservationManager = om
         self.gm: OccupancyGridManager = gm
-        self.thread_pool: ThreadPool = ThreadPool(6)  # Used for idly waiting for asynchronously running ObservationManager.add()
 
+    # Cheap by design: subscribers are expected to hand heavy work off to the processing pipeline
     def publish(self, key: str, obs: Observation):
-        self.thread_pool.apply_async(self.om.add, (key, obs))
+        self.om.add(key, obs)
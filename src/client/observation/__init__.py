@@ -1,2 +1,3 @@
 from .manager import *
 from .tracker import *
+from .synchronizer import *
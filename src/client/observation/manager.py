@@ -1,39 +1,135 @@
+import itertools
+import logging
 import time
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
 from threading import Lock
-from typing import Callable, Dict, List, Type
+from typing import Callable, Dict, List, Type, Optional, Tuple, Deque, Iterator
 
 from common.observation import Observation
 
 
+class DispatchMode(Enum):
+    SYNC = 0  # Callback runs on the thread that added the observation
+    EXECUTOR = 1  # Callback runs on the manager's dispatch thread, only the latest pending observation is delivered
+
+
+class _RingBuffer:
+    '''
+    Fixed-size store for the observations of one key, written to by any number of threads (e.g. the ingress workers
+    of all bridges for remote graphs). A writer claims a sequence number (a single call to next() on a counter, which
+    holds the GIL), then fills the respective slot with a (sequence number, observation) tuple and advances the head
+    under a lock, so that neither a slot nor the head ever moves backwards, even if a writer got overtaken by others
+    between the two steps. Readers never lock, but check the sequence number of a slot to detect entries that were
+    overwritten in the meantime.
+    '''
+
+    def __init__(self, capacity: int, ttl: float = float('inf')):
+        self.capacity: int = capacity
+        self.ttl: float = ttl
+        self.slots: List[Optional[Tuple[int, Observation]]] = [None] * capacity
+        self.head: int = -1  # Sequence number of the latest published observation
+        self._counter: Iterator[int] = itertools.count()
+        self._lock: Lock = Lock()
+
+    def append(self, observation: Observation):
+        seq: int = next(self._counter)
+        slot: int = seq % self.capacity
+        with self._lock:
+            if self.slots[slot] is None or self.slots[slot][0] < seq:
+                self.slots[slot] = (seq, observation)
+            if seq > self.head:
+                self.head = seq
+
+    def get(self, index: int = -1) -> Optional[Observation]:
+        if index >= 0:
+            index -= len(self)
+
+        seq: int = self.head + 1 + index
+        if seq < 0 or seq <= self.head - self.capacity:
+            return None
+
+        entry: Optional[Tuple[int, Observation]] = self.slots[seq % self.capacity]
+        if entry is None or entry[0] != seq or self._expired(entry[1]):
+            return None
+        return entry[1]
+
+    # Observations from sequence number seq on, the sequence number to continue from next time and the number of
+    # observations that were overwritten before they could be read
+    def since(self, seq: int) -> Tuple[List[Observation], int, int]:
+        head: int = self.head
+        first: int = max(seq, head - self.capacity + 1)
+        n_missed: int = first - seq
+        observations: List[Observation] = []
+
+        for s in range(first, head + 1):
+            entry: Optional[Tuple[int, Observation]] = self.slots[s % self.capacity]
+            if entry is not None and entry[0] < s:
+                return observations, s, n_missed  # Claimed, but not yet written, continue from here next time
+            if entry is None or self._expired(entry[1]):
+                continue  # Evicted
+            if entry[0] > s:
+                n_missed += 1
+                continue
+            observations.append(entry[1])
+
+        return observations, head + 1, n_missed
+
+    def evict(self) -> int:
+        n_evicted: int = 0
+        for i, entry in enumerate(self.slots):
+            if entry is not None and self._expired(entry[1]):
+                self.slots[i] = None
+                n_evicted += 1
+        return n_evicted
+
+    def _expired(self, observation: Observation) -> bool:
+        return time.time() - observation.timestamp > self.ttl
+
+    def __len__(self):
+        return min(self.head + 1, self.capacity)
+
+
+class _Subscription:
+    def __init__(self, callback: Callable, mode: DispatchMode):
+        self.callback: Callable = callback
+        self.mode: DispatchMode = mode
+        self.pending: Deque[Observation] = deque(maxlen=1)
+        self.lock: Lock = Lock()  # Whether a dispatch task is due only depends on pending, see ObservationManager.add()
+
+
 class ObservationManager:
     def __init__(self, keep=10):
         self.default_keep: int = keep
-        self.observations: Dict[str, deque] = {}
+        self.observations: Dict[str, _RingBuffer] = {}
         self.types: Dict[str, Type[Observation]] = {}
         self.last_update: Dict[str, float] = {}
-        self.subscribers: Dict[str, List[Callable]] = {}
-        self.locks: Dict[str, Lock] = {}
+        self.subscribers: Dict[str, List[_Subscription]] = {}
         self.aliases: Dict[str, str] = {}
+        self.drops: Dict[str, Dict[str, int]] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.alive: bool = True
 
     '''
     Optional method to explicitly initialize an observation queue for a specific key upfront.
+    Observations older than ttl seconds are treated as absent and get evicted.
     '''
 
     def register_key(self, key: str, obs_type: Type[Observation], keep: int = 10, ttl: float = float('inf')):
         assert isinstance(key, str)
         assert isinstance(obs_type, type)
 
-        self.observations[key] = deque(maxlen=keep)
+        self.observations[key] = _RingBuffer(keep, ttl)
         self.types[key] = obs_type
-        self.locks[key] = Lock()
         self.last_update[key] = float('inf')
+        self.drops[key] = {'expired': 0, 'superseded': 0, 'failed': 0}
 
     def unregister_key(self, key: str):
         self.observations.pop(key, None)
         del self.types[key]
-        del self.locks[key]
         del self.last_update[key]
+        del self.drops[key]
 
     def register_alias(self, key: str, alias: str):
         if key not in self.observations:
@@ -41,14 +137,17 @@ class ObservationManager:
 
         self.aliases[alias] = key
 
-    def subscribe(self, key: str, callable: Callable):
+    def subscribe(self, key: str, callable: Callable, mode: DispatchMode = DispatchMode.SYNC):
         if key in self.aliases:
             key = self.aliases[key]
 
+        if mode == DispatchMode.EXECUTOR and not self.executor:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='om-dispatch')
+
         if key not in self.subscribers:
-            self.subscribers[key] = [callable]
+            self.subscribers[key] = [_Subscription(callable, mode)]
         else:
-            self.subscribers[key].append(callable)
+            self.subscribers[key].append(_Subscription(callable, mode))
 
     def add(self, key: str, observation: Observation):
         assert isinstance(key, str)
@@ -60,38 +159,84 @@ class ObservationManager:
         if key not in self.observations:
             self.register_key(key, observation.__class__, keep=self.default_keep)
 
-        lock = self.locks[key]
-        if lock.locked():
-            return
-
-        with lock:
-            self.observations[key].append(observation)
-            self.last_update[key] = observation.timestamp
-
-            for f in self.subscribers[key]:
-                f(observation)
+        buffer: _RingBuffer = self.observations[key]
+        buffer.append(observation)
+        self.last_update[key] = observation.timestamp
+
+        if buffer.ttl != float('inf'):
+            self.drops[key]['expired'] += buffer.evict()
+
+        for sub in self.subscribers.get(key, []):
+            if not self.alive:
+                break  # Nothing is dispatched anymore once torn down
+            if sub.mode == DispatchMode.SYNC:
+                sub.callback(observation)
+                continue
+
+            # A pending observation always has a dispatch task waiting for it, so replacing it needs no new one
+            with sub.lock:
+                idle: bool = len(sub.pending) == 0
+                if not idle:
+                    self.drops[key]['superseded'] += 1
+                sub.pending.append(observation)
+            if not idle:
+                continue
+            try:
+                self.executor.submit(self._dispatch, key, sub)
+            except RuntimeError:
+                return  # Torn down concurrently
 
     def has(self, key: str, max_age: float = float('inf')) -> bool:
-        if key in self.aliases:
-            key = self.aliases[key]
-
-        return key in self.observations \
-               and len(self.observations[key]) > 0 \
-               and time.time() - self.last_update[key] <= max_age
+        return self.get(key, max_age=max_age) is not None
 
     def get(self, key: str, index: int = -1, max_age: float = float('inf')):
         if key in self.aliases:
             key = self.aliases[key]
 
-        if key not in self.observations \
-                or len(self.observations[key]) == 0 \
-                or time.time() - self.last_update[key] >= max_age:
+        if key not in self.observations or time.time() - self.last_update[key] >= max_age:
             return None
 
-        return self.observations[key][index]
+        return self.observations[key].get(index)
+
+    # See _RingBuffer.since(), for keys never added to, nothing is returned and seq is passed back
+    def get_since(self, key: str, seq: int) -> Tuple[List[Observation], int, int]:
+        if key in self.aliases:
+            key = self.aliases[key]
+        if key not in self.observations:
+            return [], seq, 0
+        return self.observations[key].since(seq)
+
+    # Sequence number the next observation of the key will get
+    def get_sequence(self, key: str) -> int:
+        if key in self.aliases:
+            key = self.aliases[key]
+        return self.observations[key].head + 1 if key in self.observations else 0
 
     def latest(self, key: str, max_age: float = float('inf')) -> Observation:
         return self.get(key, -1, max_age)
 
+    def evict(self):
+        for key, buffer in list(self.observations.items()):
+            self.drops[key]['expired'] += buffer.evict()
+
+    def get_drops(self, key: str) -> Dict[str, int]:
+        if key in self.aliases:
+            key = self.aliases[key]
+        return dict(self.drops[key])
+
     def tear_down(self):
-        pass
+        self.alive = False
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+    def _dispatch(self, key: str, sub: _Subscription):
+        with sub.lock:
+            if len(sub.pending) == 0:
+                return
+            observation: Observation = sub.pending.popleft()
+
+        try:
+            sub.callback(observation)
+        except Exception as e:
+            logging.warning(f'Subscriber of "{key}" failed: {e}')
+            self.drops[key]['failed'] += 1
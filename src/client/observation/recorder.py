@@ -0,0 +1,86 @@
+import logging
+import time
+from threading import Thread, Event
+from typing import Dict, Any, Optional
+
+from common.constants import RECORDING_RATE
+from common.observation import Observation
+from .manager import ObservationManager
+from .sink import Sink
+
+'''
+    Records observations off the hot path. Instead of having every callback push to a sink, the recorder
+    periodically takes a snapshot of the observation manager: everything added to a recorded key since the
+    previous snapshot is handed to the key's sink. Progress is tracked by the sequence numbers of the key's ring
+    buffer, observations that were overwritten before the snapshot got to them are counted as overruns, i.e. a
+    sign that the rate or the buffer is too small. Observations whose value did not change compared to the
+    previously recorded one are skipped.
+'''
+
+
+class SnapshotRecorder:
+    def __init__(self, om: ObservationManager, rate: float = RECORDING_RATE):
+        self.om: ObservationManager = om
+        self.interval: float = 1 / rate
+        self.sinks: Dict[str, Sink] = {}
+        self.next_seqs: Dict[str, int] = {}  # Sequence number of the next observation to record per key
+        self.last_values: Dict[str, Any] = {}
+
+        self.n_recorded: int = 0
+        self.n_unchanged: int = 0
+        self.n_overruns: int = 0
+
+        self.stop_event: Event = Event()
+        self.thread: Optional[Thread] = None
+
+    def set_sink(self, key: str, sink: Sink):
+        self.sinks[key] = sink
+        self.next_seqs[key] = self.om.get_sequence(key)  # Only record what comes in from now on
+        self.last_values.pop(key, None)
+
+    def remove_sink(self, key: str) -> Optional[Sink]:
+        self.next_seqs.pop(key, None)
+        self.last_values.pop(key, None)
+        return self.sinks.pop(key, None)
+
+    # Takes snapshots on a thread of its own, alternatively, snapshot() can be called at the desired rate by the owner
+    def start(self):
+        self.thread = Thread(target=self._loop, daemon=True, name='recorder')
+        self.thread.start()
+
+    def tear_down(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def snapshot(self):
+        for key, sink in list(self.sinks.items()):
+            observations, self.next_seqs[key], n_missed = self.om.get_since(key, self.next_seqs.get(key, 0))
+            if n_missed > 0:
+                self.n_overruns += n_missed
+                logging.debug(f'Missed {n_missed} observations of {key} while recording.')
+
+            for obs in observations:
+                if self._unchanged(key, obs):
+                    self.n_unchanged += 1
+                    continue
+
+                self.last_values[key] = obs.value
+                sink.push(key, obs)
+                self.n_recorded += 1
+
+    def _unchanged(self, key: str, obs: Observation) -> bool:
+        last: Any = self.last_values.get(key)
+        return last is not None and (last is obs.value or (isinstance(last, bytes) and last == obs.value))
+
+    def _loop(self):
+        next_tick: float = time.monotonic()
+
+        while not self.stop_event.is_set():
+            try:
+                self.snapshot()
+            except Exception as e:
+                logging.warning(f'Failed to take snapshot: {e}')
+
+            next_tick += self.interval
+            self.stop_event.wait(max(0., next_tick - time.monotonic()))
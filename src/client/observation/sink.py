@@ -1,11 +1,17 @@
+import logging
 import pickle
+import time
 import typing
 from abc import ABC, abstractmethod
-from collections import OrderedDict
-from typing import Dict, List, Any, cast
+from collections import OrderedDict, deque
+from enum import Enum
+from threading import Condition, Thread
+from typing import Dict, List, Any, Deque, Union, Optional, cast
 
 from common.constants import *
 from common.observation import OccupancyGridObservation, ActorsObservation
+from common.serialization.columnar import ColumnarWriter, scene_columns
+from common.serialization.container import FrameWriter, SceneFrame
 
 
 class Sink(ABC):
@@ -104,3 +110,165 @@ class PickleObservationSink(Sink, ABC):
             return
 
         pickle.dump(self.accumulator[self.key], self.filehandle)
+
+
+class FsyncPolicy(Enum):
+    NEVER = 0  # Leave it to the OS
+    ON_ROTATE = 1  # Whenever a file is completed
+    INTERVAL = 2  # Every fsync_interval seconds
+    ALWAYS = 3  # After every frame, slow
+
+
+# Supports a single key only. Frames are written to disk by a background thread, so pushing a scene only costs
+# framing it and appending it to a bounded buffer. If the writer can not keep up, the oldest buffered frames are
+# dropped. Output is split into files of at most max_bytes bytes or max_age seconds, named <outpath>_<nnnn>.<ext>.
+class StreamingObservationSink(Sink):
+    def __init__(
+            self,
+            key: str,
+            outpath: str,
+            max_bytes: int = RECORDING_ROTATE_BYTES,
+            max_age: float = RECORDING_ROTATE_SEC,
+            fsync: FsyncPolicy = FsyncPolicy.ON_ROTATE,
+            fsync_interval: float = 1.,
+            max_pending: int = RECORDING_QUEUE_SIZE
+    ):
+        super().__init__([key])
+        self.key: str = key
+        self.outpath: str = outpath
+        self.max_bytes: int = max_bytes
+        self.max_age: float = max_age
+        self.fsync: FsyncPolicy = fsync
+        self.fsync_interval: float = fsync_interval
+        self.pending: Deque[SceneFrame] = deque(maxlen=max_pending)
+        self.appendable = True
+
+        self.paths: List[str] = []
+        self.writer: Union[FrameWriter, ColumnarWriter] = None
+        self.file_bytes: int = 0
+        self.file_started: float = 0
+        self.last_sync: float = time.monotonic()
+
+        self.n_pushed: int = 0
+        self.n_written: int = 0
+        self.n_dropped: int = 0
+        self.n_failed: int = 0
+
+        self.alive: bool = True
+        self.cond: Condition = Condition()
+        self.thread: Thread = Thread(target=self._write_loop, daemon=True, name=f'sink-{key}')
+        self.thread.start()
+
+    # Accumulator is bypassed, every observation is a frame of its own
+    def push(self, key: str, data: Any):
+        frame: SceneFrame = SceneFrame.from_observation(data)
+
+        with self.cond:
+            if not self.alive:
+                return
+            if len(self.pending) == self.pending.maxlen:
+                self.n_dropped += 1
+            self.pending.append(frame)
+            self.n_pushed += 1
+            self.cond.notify()
+
+    # Writes out everything still buffered and closes the current file
+    def flush(self):
+        with self.cond:
+            self.alive = False
+            self.cond.notify()
+        self.thread.join()
+
+    def _dump(self):
+        pass
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                if self.alive and len(self.pending) == 0:
+                    self.cond.wait(timeout=self._wait_time())
+                frames: List[SceneFrame] = list(self.pending)
+                self.pending.clear()
+                alive: bool = self.alive
+
+            # A single bad frame, e.g. one that can not be decoded, must not stop the recording
+            for frame in frames:
+                try:
+                    self._write(frame)
+                except Exception as e:
+                    self.n_failed += 1
+                    logging.warning(f'Failed to write frame to {self.outpath}: {e}')
+
+            try:
+                self._maybe_sync()
+                self._close_expired()
+            except OSError as e:
+                logging.warning(f'Failed to write to {self.outpath}: {e}')
+
+            if not alive:
+                self._close_file()
+                return
+
+    def _write(self, frame: SceneFrame):
+        if self.writer and self.file_bytes >= self.max_bytes:
+            self._close_file()
+        self._close_expired()
+        if not self.writer:
+            self._open_file()
+
+        self.file_bytes += self._append(frame)
+        self.n_written += 1
+
+        if self.fsync == FsyncPolicy.ALWAYS:
+            self.writer.flush(sync=True)
+
+    def _maybe_sync(self):
+        if self.writer and self.fsync == FsyncPolicy.INTERVAL and time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.writer.flush(sync=True)
+            self.last_sync = time.monotonic()
+
+    # Until the next sync or the current file expiring, whichever comes first, None if neither is due
+    def _wait_time(self) -> Optional[float]:
+        timeouts: List[float] = [self.fsync_interval] if self.fsync == FsyncPolicy.INTERVAL else []
+        if self.writer:
+            timeouts.append(max(0., self.max_age - (time.monotonic() - self.file_started)))
+        return min(timeouts) if timeouts else None
+
+    # Files are completed once too old, even if nothing is written to them anymore
+    def _close_expired(self):
+        if self.writer and time.monotonic() - self.file_started >= self.max_age:
+            self._close_file()
+
+    def _open_file(self):
+        root, ext = os.path.splitext(self.outpath)
+        path: str = f'{root}_{len(self.paths):04d}{ext}'
+        self.writer = self._create_writer(path)
+        self.paths.append(path)
+        self.file_bytes = 0
+        self.file_started = time.monotonic()
+
+    def _close_file(self):
+        if not self.writer:
+            return
+        writer, self.writer = self.writer, None  # Given up on even if closing fails, so that the next frame opens a new file
+        writer.flush(sync=self.fsync != FsyncPolicy.NEVER)
+        writer.close()
+
+    def _create_writer(self, path: str) -> FrameWriter:
+        return FrameWriter(path)
+
+    # Returns the number of bytes written
+    def _append(self, frame: SceneFrame) -> int:
+        self.writer.append(frame)
+        return len(frame)
+
+
+# Same as StreamingObservationSink, but scenes are decoded (on the writer thread) and stored in columnar format,
+# i.e. every output "file" is a directory of memory-mappable arrays.
+class ColumnarObservationSink(StreamingObservationSink):
+    def _create_writer(self, path: str) -> ColumnarWriter:
+        return ColumnarWriter(path)
+
+    def _append(self, frame: SceneFrame) -> int:
+        scene_timestamps, (quadints, states, confidences) = scene_columns(frame.payload)
+        return self.writer.append(frame.timestamp, quadints, states, confidences, sender=frame.sender, scene_timestamps=scene_timestamps)
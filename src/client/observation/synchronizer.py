@@ -0,0 +1,115 @@
+import bisect
+from collections import deque
+from threading import Lock
+from typing import Callable, Dict, Deque, List, Optional
+
+from common.model import DynamicActor, UncertainProperty, Point3D
+from common.observation import Observation, ActorsObservation
+
+'''
+    Joins several observation streams on a common timestamp. Every stream is buffered for a short while, so that
+    for a reference observation (e.g. a point cloud) the observations of all other streams taken at (approximately)
+    the same time can be looked up. Streams with an interpolation function are linearly interpolated between the two
+    observations that enclose the reference timestamp, all others resolve to their closest observation. Buffers are
+    kept sorted by timestamp, even if observations of a stream arrive out of order, e.g. from different threads.
+'''
+
+_Interpolator = Callable[[Observation, Observation, float, float], Observation]  # before, after, timestamp, weight
+
+
+class ObservationSynchronizer:
+    def __init__(self, tolerance: float, keep: int = 20):
+        self.tolerance: float = tolerance
+        self.keep: int = keep
+        self.buffers: Dict[str, Deque[Observation]] = {}
+        self.interpolators: Dict[str, Optional[_Interpolator]] = {}
+        self.n_aligned: int = 0
+        self.n_skipped: Dict[str, int] = {}
+        self.n_late: Dict[str, int] = {}  # Older than everything in a full buffer
+        self.lock: Lock = Lock()
+
+    def register_stream(self, key: str, interpolate: _Interpolator = None):
+        self.buffers[key] = deque(maxlen=self.keep)
+        self.interpolators[key] = interpolate
+        self.n_skipped[key] = 0
+        self.n_late[key] = 0
+
+    def push(self, key: str, obs: Observation):
+        with self.lock:
+            buffer: Deque[Observation] = self.buffers[key]
+
+            # Usually appended, otherwise inserted behind the last observation that is not newer
+            i: int = len(buffer)
+            while i > 0 and buffer[i - 1].timestamp > obs.timestamp:
+                i -= 1
+
+            if len(buffer) == buffer.maxlen:
+                if i == 0:
+                    self.n_late[key] += 1
+                    return
+                buffer.popleft()
+                i -= 1
+            buffer.insert(i, obs)
+
+    # Returns one observation per stream, all within tolerance of the given timestamp, or None if any stream can not be aligned
+    def align(self, timestamp: float) -> Optional[Dict[str, Observation]]:
+        result: Dict[str, Observation] = {}
+
+        for key, buffer in self.buffers.items():
+            with self.lock:
+                snapshot: List[Observation] = list(buffer)
+            obs: Optional[Observation] = self._align_stream(key, snapshot, timestamp)
+            if obs is None:
+                self.n_skipped[key] += 1
+                return None
+            result[key] = obs
+
+        self.n_aligned += 1
+        return result
+
+    def _align_stream(self, key: str, buffer: List[Observation], timestamp: float) -> Optional[Observation]:
+        if len(buffer) == 0:
+            return None
+
+        # Sorted by timestamp, see push()
+        timestamps: List[float] = [o.timestamp for o in buffer]
+        i: int = bisect.bisect_left(timestamps, timestamp)
+        before: Optional[Observation] = buffer[i - 1] if i > 0 else None
+        after: Optional[Observation] = buffer[i] if i < len(buffer) else None
+
+        interpolate: Optional[_Interpolator] = self.interpolators[key]
+        if interpolate and before and after \
+                and timestamp - before.timestamp <= self.tolerance and after.timestamp - timestamp <= self.tolerance:
+            span: float = after.timestamp - before.timestamp
+            return interpolate(before, after, timestamp, (timestamp - before.timestamp) / span if span > 0 else 0)
+
+        closest: Observation = min([o for o in [before, after] if o], key=lambda o: abs(o.timestamp - timestamp))
+        return closest if abs(closest.timestamp - timestamp) <= self.tolerance else None
+
+
+def interpolate_point(a: UncertainProperty[Point3D], b: UncertainProperty[Point3D], w: float) -> UncertainProperty[Point3D]:
+    if not a or not b:
+        return a if a else b
+    return UncertainProperty(
+        min(a.confidence, b.confidence),
+        Point3D(*[u + (v - u) * w for u, v in zip(a.value.components(), b.value.components())])
+    )
+
+
+# Interpolates the pose of the first (ego) actor, everything else is taken from the closer observation
+def interpolate_ego(before: ActorsObservation, after: ActorsObservation, timestamp: float, w: float) -> ActorsObservation:
+    if not before.value or not after.value:
+        return before if w < .5 else after
+
+    a, b = before.value[0], after.value[0]
+    closer: DynamicActor = a if w < .5 else b
+
+    return ActorsObservation(timestamp, actors=[DynamicActor(
+        id=closer.id,
+        type=closer.type,
+        type_id=closer.type_id,
+        location=interpolate_point(a.location, b.location, w),
+        gnss=interpolate_point(a.gnss, b.gnss, w),
+        dynamics=closer.dynamics,
+        props=closer.props
+    )], meta=before.meta)
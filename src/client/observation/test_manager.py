@@ -0,0 +1,145 @@
+import sys
+import time
+from threading import Event, Thread
+from typing import List, Set
+
+from client.observation.manager import ObservationManager, DispatchMode, _RingBuffer
+from common.observation import RawBytesObservation, Observation
+
+
+def _obs(i: int, timestamp: float = None) -> RawBytesObservation:
+    return RawBytesObservation(timestamp if timestamp is not None else time.time(), bytes([i]))
+
+
+def test_ring_buffer_wraparound():
+    buffer: _RingBuffer = _RingBuffer(capacity=3)
+    assert len(buffer) == 0 and buffer.get() is None
+
+    for i in range(5):
+        buffer.append(_obs(i))
+
+    assert len(buffer) == 3
+    assert [buffer.get(i).value for i in range(3)] == [bytes([2]), bytes([3]), bytes([4])]
+    assert [buffer.get(i).value for i in [-1, -2, -3]] == [bytes([4]), bytes([3]), bytes([2])]
+    assert buffer.get(-4) is None  # Overwritten
+
+    # A slot overwritten after a reader computed its sequence number is detected by the stored one
+    buffer.slots[4 % 3] = (7, _obs(7))
+    assert buffer.get(-1) is None
+
+    observations, next_seq, n_missed = buffer.since(0)
+    assert [o.value for o in observations] == [bytes([2]), bytes([3])] and next_seq == 5 and n_missed == 3
+
+
+def test_ttl_eviction():
+    om: ObservationManager = ObservationManager()
+    om.register_key('k', RawBytesObservation, ttl=1.)
+
+    om.add('k', _obs(0, timestamp=time.time() - 2))
+    assert om.latest('k') is None  # Expired observations count as absent, even before being evicted
+    om.add('k', _obs(1))
+    assert om.latest('k').value == bytes([1]) and om.get('k', -2) is None
+    assert om.get_drops('k')['expired'] == 1
+
+    om.observations['k'].ttl = 0
+    om.evict()
+    assert om.get_drops('k')['expired'] == 2
+
+
+def test_drop_counters():
+    om: ObservationManager = ObservationManager()
+    received: List[Observation] = []
+    started, release = Event(), Event()
+
+    def slow(obs: Observation):
+        started.set()
+        release.wait()
+        received.append(obs)
+
+    om.subscribe('k', slow, mode=DispatchMode.EXECUTOR)
+    om.subscribe('k', lambda obs: 1 / 0, mode=DispatchMode.EXECUTOR)
+
+    # While the first one blocks the dispatch thread, every following one replaces its subscriber's pending predecessor
+    om.add('k', _obs(0))
+    assert started.wait(timeout=2.)
+    for i in range(1, 4):
+        om.add('k', _obs(i))
+    release.set()
+
+    deadline: float = time.monotonic() + 2
+    while (om.get_drops('k')['failed'] < 1 or len(received) < 2) and time.monotonic() < deadline:
+        time.sleep(.01)
+
+    assert [o.value for o in received] == [bytes([0]), bytes([3])]
+    assert om.get_drops('k') == {'expired': 0, 'superseded': 5, 'failed': 1}
+
+    # Adding after tearing down neither raises nor dispatches
+    om.tear_down()
+    om.add('k', _obs(4))
+    assert om.latest('k').value == bytes([4]) and len(received) == 2
+
+
+def test_concurrent_writers():
+    buffer: _RingBuffer = _RingBuffer(capacity=64)
+    n_writers, n_per_writer = 4, 2000
+    done: Event = Event()
+    seen: Set[bytes] = set()
+    errors: List[str] = []
+
+    def write(w: int):
+        for i in range(n_per_writer):
+            buffer.append(RawBytesObservation(1., f'{w}-{i}'.encode()))
+
+    # Reads along while writing, the head must never move backwards and nothing must be read twice
+    def read():
+        seq, last_head, n_missed = 0, -1, 0
+        while True:
+            finished: bool = done.is_set()
+            if buffer.head < last_head:
+                errors.append(f'head moved back from {last_head} to {buffer.head}')
+            last_head = buffer.head
+
+            observations, seq, missed = buffer.since(seq)
+            n_missed += missed
+            for o in observations:
+                if o.value in seen:
+                    errors.append(f'{o.value} read twice')
+                seen.add(o.value)
+            if finished:
+                observations, seq, missed = buffer.since(seq)
+                seen.update(o.value for o in observations)
+                n_missed += missed
+                if len(seen) + n_missed != n_writers * n_per_writer:
+                    errors.append(f'{len(seen)} read and {n_missed} missed of {n_writers * n_per_writer}')
+                return
+
+    # Switch threads as often as possible, so that writers get overtaken in between claiming and filling slots
+    interval: float = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        reader: Thread = Thread(target=read)
+        writers: List[Thread] = [Thread(target=write, args=(w,)) for w in range(n_writers)]
+        reader.start()
+        for t in writers:
+            t.start()
+        for t in writers:
+            t.join()
+        done.set()
+        reader.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    assert buffer.head == n_writers * n_per_writer - 1
+
+    # Slots that lost against a newer observation are missing, all others are the latest ones
+    latest: List[RawBytesObservation] = [buffer.get(i) for i in range(-1, -65, -1)]
+    assert latest[0] is not None
+    assert len({o.value for o in latest if o}) == len([o for o in latest if o])
+
+
+if __name__ == '__main__':
+    test_ring_buffer_wraparound()
+    test_ttl_eviction()
+    test_drop_counters()
+    test_concurrent_writers()
@@ -0,0 +1,49 @@
+import time
+from typing import List
+
+from client.observation.manager import ObservationManager
+from client.observation.recorder import SnapshotRecorder
+from client.observation.sink import Sink
+from common.observation import RawBytesObservation, Observation
+
+
+class _ListSink(Sink):
+    def __init__(self):
+        super().__init__(['k'])
+        self.received: List[Observation] = []
+
+    def push(self, key: str, data: Observation):
+        self.received.append(data)
+
+    def _dump(self):
+        pass
+
+
+def test_overruns():
+    om: ObservationManager = ObservationManager()
+    om.register_key('k', RawBytesObservation, keep=4)
+    om.add('k', RawBytesObservation(time.time(), b'before'))
+
+    recorder: SnapshotRecorder = SnapshotRecorder(om)
+    sink: _ListSink = _ListSink()
+    recorder.set_sink('k', sink)
+
+    for i in range(3):
+        om.add('k', RawBytesObservation(time.time(), bytes([i])))
+    recorder.snapshot()
+    assert [o.value for o in sink.received] == [bytes([0]), bytes([1]), bytes([2])]
+
+    # More than the buffer holds in between two snapshots, timestamps do not matter
+    for i in range(3, 10):
+        om.add('k', RawBytesObservation(1., bytes([i])))
+    recorder.snapshot()
+    assert [o.value for o in sink.received[3:]] == [bytes([i]) for i in range(6, 10)]
+    assert recorder.n_overruns == 3 and recorder.n_recorded == 7
+
+    # Nothing new, nothing recorded twice
+    recorder.snapshot()
+    assert recorder.n_recorded == 7
+
+
+if __name__ == '__main__':
+    test_overruns()
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import time
+from threading import Event
+from typing import List
+
+from client.observation.sink import StreamingObservationSink, FsyncPolicy
+from common.observation import RawBytesObservation
+from common.serialization.container import FrameWriter, FrameReader, SceneFrame
+
+REF_TIME_1: float = 1573220495.8997931
+
+
+def _wait_for(condition, timeout: float = 2.) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.005)
+    return True
+
+
+def _obs(i: int) -> RawBytesObservation:
+    return RawBytesObservation(REF_TIME_1 + i, bytes([i]) * 100)
+
+
+def _payloads(path: str) -> List[bytes]:
+    return [bytes(f.payload) for f in FrameReader(path).read_stream()]
+
+
+class _CountingWriter(FrameWriter):
+    # Counts syncs to disk and, if given an event, blocks on the first frame until it is set
+    def __init__(self, outpath: str, syncs: List[str], release: Event = None):
+        super().__init__(outpath)
+        self.syncs: List[str] = syncs
+        self.release: Event = release
+        self.started: Event = Event()
+
+    def append(self, frame: SceneFrame):
+        self.started.set()
+        if self.release:
+            self.release.wait()
+        super().append(frame)
+
+    def flush(self, sync: bool = False):
+        super().flush(sync)
+        if sync:
+            self.syncs.append(self.outpath)
+
+
+class _CountingSink(StreamingObservationSink):
+    def __init__(self, *args, release: Event = None, **kwargs):
+        self.syncs: List[str] = []
+        self.release: Event = release
+        self.writers: List[_CountingWriter] = []
+        super().__init__(*args, **kwargs)
+
+    def _create_writer(self, path: str) -> FrameWriter:
+        self.writers.append(_CountingWriter(path, self.syncs, self.release))
+        return self.writers[-1]
+
+
+def test_rotation():
+    frame_size: int = len(SceneFrame.from_observation(_obs(0)))
+
+    with tempfile.TemporaryDirectory() as d:
+        sink: StreamingObservationSink = StreamingObservationSink('k', os.path.join(d, 'scenes.tkc'), max_bytes=2 * frame_size)
+        for i in range(5):
+            sink.push('k', _obs(i))
+        sink.flush()
+
+        # Two frames per file at most, numbered consecutively
+        assert sink.paths == [os.path.join(d, f'scenes_{i:04d}.tkc') for i in range(3)]
+        assert sorted(os.listdir(d)) == [f'scenes_{i:04d}.tkc' for i in range(3)]
+        assert [_payloads(p) for p in sink.paths] == [[_obs(0).value, _obs(1).value], [_obs(2).value, _obs(3).value], [_obs(4).value]]
+        assert sink.n_pushed == sink.n_written == 5 and sink.n_dropped == 0
+
+        # Nothing is recorded after flushing
+        sink.push('k', _obs(5))
+        assert sink.n_pushed == 5
+
+
+def test_max_age():
+    with tempfile.TemporaryDirectory() as d:
+        sink: _CountingSink = _CountingSink('k', os.path.join(d, 'scenes.tkc'), max_age=.1)
+        sink.push('k', _obs(0))
+
+        # Completed once expired, even though nothing follows
+        assert _wait_for(lambda: len(sink.writers) == 1 and sink.writers[0].closed)
+        assert sink.syncs == [sink.paths[0]] and _payloads(sink.paths[0]) == [_obs(0).value]
+
+        sink.push('k', _obs(1))
+        sink.flush()
+        assert len(sink.paths) == 2 and _payloads(sink.paths[1]) == [_obs(1).value]
+
+
+def test_fsync_policies():
+    with tempfile.TemporaryDirectory() as d:
+        frame_size: int = len(SceneFrame.from_observation(_obs(0)))
+
+        for policy, expected in [(FsyncPolicy.NEVER, 0), (FsyncPolicy.ON_ROTATE, 2), (FsyncPolicy.ALWAYS, 2 + 4)]:
+            sink: _CountingSink = _CountingSink('k', os.path.join(d, f'{policy.name}.tkc'), max_bytes=2 * frame_size, fsync=policy)
+            for i in range(4):
+                sink.push('k', _obs(i))
+            sink.flush()
+            assert len(sink.paths) == 2 and len(sink.syncs) == expected, policy
+
+        # Synced while idle
+        sink = _CountingSink('k', os.path.join(d, 'interval.tkc'), fsync=FsyncPolicy.INTERVAL, fsync_interval=.05)
+        sink.push('k', _obs(0))
+        assert _wait_for(lambda: len(sink.syncs) >= 1)
+        assert not sink.writers[0].closed
+        sink.flush()
+
+
+def test_overflow():
+    with tempfile.TemporaryDirectory() as d:
+        release: Event = Event()
+        sink: _CountingSink = _CountingSink('k', os.path.join(d, 'scenes.tkc'), max_pending=2, release=release)
+
+        # While the writer is stuck on the first frame, only the two latest ones of the following are kept
+        sink.push('k', _obs(0))
+        assert _wait_for(lambda: len(sink.writers) == 1 and sink.writers[0].started.is_set())
+        for i in range(1, 5):
+            sink.push('k', _obs(i))
+        assert sink.n_dropped == 2
+
+        release.set()
+        sink.flush()
+        assert sink.n_pushed == 5 and sink.n_written == 3
+        assert _payloads(sink.paths[0]) == [_obs(i).value for i in [0, 3, 4]]
+
+
+if __name__ == '__main__':
+    test_rotation()
+    test_max_age()
+    test_fsync_policies()
+    test_overflow()
@@ -0,0 +1,89 @@
+from typing import Dict, Optional
+
+from client.observation.synchronizer import ObservationSynchronizer, interpolate_ego
+from common.model import DynamicActor, UncertainProperty, Point3D
+from common.observation import ActorsObservation, Observation
+
+
+def _ego(timestamp: float, x: float) -> ActorsObservation:
+    return ActorsObservation(timestamp, actors=[DynamicActor(
+        id=1,
+        type=None,
+        location=UncertainProperty(.9, Point3D(x, 0, 0)),
+        gnss=UncertainProperty(.8, Point3D(49., 8. + x, 0))
+    )])
+
+
+def _others(timestamp: float) -> ActorsObservation:
+    return ActorsObservation(timestamp, actors=[])
+
+
+def test_align():
+    sync: ObservationSynchronizer = ObservationSynchronizer(tolerance=.1)
+    sync.register_stream('ego', interpolate=interpolate_ego)
+    sync.register_stream('others')
+
+    # Out of order, e.g. from different threads
+    for t in [1., 1.2, 1.1]:
+        sync.push('ego', _ego(t, x=t * 10))
+    for t in [1.12, 1.02]:
+        sync.push('others', _others(t))
+    assert [o.timestamp for o in sync.buffers['ego']] == [1., 1.1, 1.2]
+
+    result: Optional[Dict[str, Observation]] = sync.align(1.03)
+    assert result is not None
+    assert result['others'].timestamp == 1.02  # Closest one
+    assert result['ego'].timestamp == 1.03  # Interpolated between 1.0 and 1.1, see test_interpolate_ego
+    assert sync.n_aligned == 1
+
+
+def test_tolerance():
+    sync: ObservationSynchronizer = ObservationSynchronizer(tolerance=.05)
+    sync.register_stream('ego', interpolate=interpolate_ego)
+    sync.register_stream('others')
+    sync.push('ego', _ego(1., x=0))
+    sync.push('ego', _ego(2., x=10))
+    sync.push('others', _others(1.5))
+
+    # Neither enclosing ego observation is within tolerance, so no interpolation either
+    assert sync.align(1.5) is None
+    assert sync.n_skipped['ego'] == 1
+
+    # Closest ego observation within tolerance, but the other stream is too far off
+    assert sync.align(1.96) is None
+    assert sync.n_skipped['others'] == 1
+
+    sync.push('others', _others(1.99))
+    result: Optional[Dict[str, Observation]] = sync.align(1.96)
+    assert result['ego'].timestamp == 2. and result['others'].timestamp == 1.99
+
+
+def test_late_observations():
+    sync: ObservationSynchronizer = ObservationSynchronizer(tolerance=.05, keep=3)
+    sync.register_stream('others')
+    for t in [1., 2., 3., 2.5, .5]:
+        sync.push('others', _others(t))
+
+    # Oldest one is evicted for the out-of-order one, older than everything buffered is dropped
+    assert [o.timestamp for o in sync.buffers['others']] == [2., 2.5, 3.]
+    assert sync.n_late['others'] == 1
+
+
+def test_interpolate_ego():
+    before, after = _ego(1., x=0), _ego(1.1, x=10)
+
+    obs: ActorsObservation = interpolate_ego(before, after, 1.03, .3)
+    assert obs.timestamp == 1.03
+    assert abs(obs.value[0].location.value.x - 3) < 1e-9
+    assert abs(obs.value[0].gnss.value.y - 11) < 1e-9
+    assert obs.value[0].location.confidence == .9
+
+    # Without actors, the closer observation is taken as is
+    assert interpolate_ego(_others(1.), _others(1.1), 1.08, .8).timestamp == 1.1
+
+
+if __name__ == '__main__':
+    test_align()
+    test_tolerance()
+    test_late_observations()
+    test_interpolate_ego()
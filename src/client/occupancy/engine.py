@@ -0,0 +1,240 @@
+import logging
+import multiprocessing as mp
+import time
+from enum import Enum
+from multiprocessing.connection import Connection
+from threading import Thread
+from typing import List, Dict, Callable, Tuple, Optional
+
+import numpy as np
+
+from client.graph import PEMGraphBuilder
+from client.observation import LinearObservationTracker
+from common.constants import *
+from common.model import DynamicActor, UncertainProperty, Point3D, Point2D, ActorDynamics, ActorProperties, ActorType
+from common.observation import LidarObservation, ActorsObservation, RawBytesObservation, GnssObservation
+from .manager import OccupancyGridManager
+
+'''
+    Runs lidar matching, grid building and scene encoding in a dedicated worker process, so that none of it competes
+    with the simulator's sensor callbacks for the GIL. Point clouds and actor lists are passed through ring buffers in
+    shared memory (RawArray, as multiprocessing.shared_memory requires Python 3.8), only a small frame descriptor is
+    sent through a pipe. The worker always processes the most recent frame and skips older ones. Encoded scenes are
+    sent back and delivered to a callback on a receiver thread. Slots are sized for the lidar's configuration with
+    ample headroom, point clouds or actor lists that do not fit anyway are truncated, counted and logged.
+'''
+
+MAX_POINTS: int = 8192  # Per point cloud, the lidar yields about 4000 points / sec at 30 Hz, see simulation.sensors.lidar
+MAX_ACTORS: int = 512  # Per actor list, including the ego
+N_SLOTS: int = 4
+
+_ACTOR_TYPES: List[ActorType] = [ActorType.VEHICLE, ActorType.PEDESTRIAN, ActorType.UNKNOWN]
+
+# Layout of a packed actor
+_F_ID, _F_TYPE = 0, 1  # id, (confidence, type index)
+_F_LOCATION, _F_GNSS, _F_VELOCITY, _F_ACCELERATION, _F_EXTENT = 3, 7, 11, 15, 19  # (x, y, z, confidence) each
+_F_COLOR, _F_BBOX = 23, 24  # confidence, (confidence, 4 x (x, y))
+ACTOR_FIELDS: int = 33
+
+
+class EngineMode(Enum):
+    IN_PROCESS = 0  # Easier to debug and profile
+    WORKER_PROCESS = 1
+
+
+class SharedRing:
+    '''
+    Fixed number of equally-sized array slots in shared memory with a single writer. A slot's header holds the
+    sequence number of the frame it contains or -1 while it is being written, so that a reader can detect
+    slots that were (partially) overwritten while copying from them.
+    '''
+
+    def __init__(self, n_slots: int, slot_shape: Tuple[int, ...], dtype: np.dtype):
+        self.n_slots: int = n_slots
+        self.slot_shape: Tuple[int, ...] = slot_shape
+        self.dtype: np.dtype = np.dtype(dtype)
+
+        slot_size: int = int(np.prod(slot_shape)) * self.dtype.itemsize
+        self._data = mp.RawArray('b', n_slots * slot_size)
+        self._headers = mp.RawArray('q', [-1] * n_slots)
+
+    def write(self, seq: int, array: np.ndarray):
+        slot: int = seq % self.n_slots
+        self._headers[slot] = -1
+        self._view()[slot, :len(array)] = array
+        self._headers[slot] = seq
+
+    def read(self, seq: int, n: int) -> Optional[np.ndarray]:
+        slot: int = seq % self.n_slots
+        if self._headers[slot] != seq:
+            return None
+        array: np.ndarray = self._view()[slot, :n].copy()
+        return array if self._headers[slot] == seq else None
+
+    # Views are created lazily, because numpy arrays do not survive being passed to another process
+    def _view(self) -> np.ndarray:
+        return np.frombuffer(self._data, dtype=self.dtype).reshape((self.n_slots,) + self.slot_shape)
+
+
+def pack_actors(actors: List[DynamicActor]) -> np.ndarray:
+    packed: np.ndarray = np.zeros((len(actors), ACTOR_FIELDS), dtype=np.float64)
+
+    for i, a in enumerate(actors):
+        packed[i, _F_ID] = a.id
+        packed[i, _F_TYPE:_F_TYPE + 2] = a.type.confidence, _ACTOR_TYPES.index(a.type.value)
+        for f, p in [(_F_LOCATION, a.location), (_F_GNSS, a.gnss), (_F_VELOCITY, a.dynamics.velocity), (_F_ACCELERATION, a.dynamics.acceleration), (_F_EXTENT, a.props.extent)]:
+            packed[i, f:f + 4] = p.value.components() + (p.confidence,)
+        packed[i, _F_COLOR] = a.props.color.confidence
+        packed[i, _F_BBOX] = a.props.bbox.confidence
+        packed[i, _F_BBOX + 1:_F_BBOX + 9] = [c for corner in a.props.bbox.value for c in corner.components()]
+
+    return packed
+
+
+def unpack_actors(packed: np.ndarray, colors: Dict[int, str]) -> List[DynamicActor]:
+    def point(row: np.ndarray, f: int) -> UncertainProperty[Point3D]:
+        return UncertainProperty(float(row[f + 3]), Point3D(*row[f:f + 3].tolist()))
+
+    actors: List[DynamicActor] = []
+
+    for row in packed:
+        actor_id: int = int(row[_F_ID])
+        bbox: Tuple[Point2D, ...] = tuple(Point2D(*row[j:j + 2].tolist()) for j in range(_F_BBOX + 1, _F_BBOX + 9, 2))
+
+        actors.append(DynamicActor(
+            id=actor_id,
+            type=UncertainProperty(float(row[_F_TYPE]), _ACTOR_TYPES[int(row[_F_TYPE + 1])]),
+            location=point(row, _F_LOCATION),
+            gnss=point(row, _F_GNSS),
+            dynamics=ActorDynamics(velocity=point(row, _F_VELOCITY), acceleration=point(row, _F_ACCELERATION)),
+            props=ActorProperties(
+                color=UncertainProperty(float(row[_F_COLOR]), colors.get(actor_id)),
+                extent=point(row, _F_EXTENT),
+                bbox=UncertainProperty(float(row[_F_BBOX]), bbox)
+            )
+        ))
+
+    return actors
+
+
+class OccupancyEngine:
+    def __init__(self, on_scene: Callable[[RawBytesObservation], None], ego_id: int, grid_radius: int, offset_z: float = 0):
+        self.on_scene: Callable[[RawBytesObservation], None] = on_scene
+        self.ego_id: int = ego_id
+        self.points: SharedRing = SharedRing(N_SLOTS, (MAX_POINTS, 3), np.float32)
+        self.actors: SharedRing = SharedRing(N_SLOTS, (MAX_ACTORS, ACTOR_FIELDS), np.float64)
+        self.seq: int = 0
+        self.n_submitted: int = 0
+        self.n_received: int = 0
+        self.n_truncated: Dict[str, int] = {'points': 0, 'actors': 0}  # Frames that did not fit into a slot
+        self.sent_colors: Dict[int, str] = {}
+
+        # Frame descriptors: sequence number, timestamp, number of points, number of actors, newly seen actor colors
+        frames_reader, self._frames_writer = mp.Pipe(duplex=False)
+        self._scenes_reader, scenes_writer = mp.Pipe(duplex=False)
+
+        # Not a daemon, because the occupancy grid manager spawns a process pool itself
+        self.process: mp.Process = mp.Process(
+            target=_run_worker,
+            args=(self.points, self.actors, frames_reader, scenes_writer, grid_radius, offset_z),
+            name='occupancy-engine'
+        )
+        self.process.start()
+        frames_reader.close()
+        scenes_writer.close()
+
+        self.receiver: Thread = Thread(target=self._receive_loop, daemon=True, name='occupancy-engine-receiver')
+        self.receiver.start()
+
+    # Never blocks for longer than it takes to copy the frame into shared memory
+    def submit(self, frame: Tuple[LidarObservation, ActorsObservation, ActorsObservation]):
+        obs, ego_obs, others_obs = frame
+        actors: List[DynamicActor] = self._truncate('actors', ego_obs.value + others_obs.value, MAX_ACTORS)
+        points: np.ndarray = self._truncate('points', obs.value, MAX_POINTS)
+
+        new_colors: Dict[int, str] = {a.id: a.props.color.value for a in actors if self.sent_colors.get(a.id) != a.props.color.value}
+        self.sent_colors.update(new_colors)
+
+        self.points.write(self.seq, points)
+        self.actors.write(self.seq, pack_actors(actors))
+        self._frames_writer.send((self.seq, min([obs.timestamp, ego_obs.timestamp, others_obs.timestamp]), len(points), len(actors), new_colors))
+        self.seq += 1
+        self.n_submitted += 1
+
+    def tear_down(self):
+        try:
+            self._frames_writer.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=GRID_TTL_SEC)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def _truncate(self, kind: str, values, limit: int):
+        if len(values) <= limit:
+            return values
+
+        self.n_truncated[kind] += 1
+        if self.n_truncated[kind] == 1 or self.n_truncated[kind] % 100 == 0:
+            logging.warning(f'Truncated {kind} of {self.n_truncated[kind]} frames so far, got {len(values)}, but only {limit} fit.')
+        return values[:limit]
+
+    def _receive_loop(self):
+        while True:
+            try:
+                last_timestamp, encoded_msg = self._scenes_reader.recv()
+            except (EOFError, OSError):
+                return
+
+            self.n_received += 1
+            self.on_scene(RawBytesObservation(last_timestamp, encoded_msg, meta={'sender': self.ego_id}))
+
+
+def _run_worker(points: SharedRing, actors: SharedRing, frames: Connection, scenes: Connection, grid_radius: int, offset_z: float):
+    gm: OccupancyGridManager = OccupancyGridManager(OCCUPANCY_TILE_LEVEL, grid_radius, offset_z=offset_z)
+    graph_builder: PEMGraphBuilder = PEMGraphBuilder(LinearObservationTracker(n=10))
+    colors: Dict[int, str] = {}
+    n_skipped: int = 0
+
+    while True:
+        try:
+            msg = frames.recv()
+            # Skip to the most recent frame, older ones are superseded
+            while msg is not None and frames.poll():
+                colors.update(msg[4])
+                msg = frames.recv()
+                n_skipped += 1
+        except EOFError:
+            break
+
+        if msg is None:
+            break
+
+        seq, timestamp, n_points, n_actors, new_colors = msg
+        colors.update(new_colors)
+
+        frame_points: Optional[np.ndarray] = points.read(seq, n_points)
+        frame_actors: Optional[np.ndarray] = actors.read(seq, n_actors)
+        if frame_points is None or frame_actors is None or n_actors < 1:
+            n_skipped += 1
+            continue
+
+        all_actors: List[DynamicActor] = unpack_actors(frame_actors, colors)
+        ego: DynamicActor = all_actors[0]
+
+        gm.update_actors(all_actors)
+        gm.update_gnss(GnssObservation(timestamp=timestamp, coords=ego.gnss.value.components()))
+        if not gm.match_with_lidar(LidarObservation(timestamp, frame_points)):
+            continue
+
+        grid = gm.get_grid()
+        if not grid:
+            continue
+
+        now: float = time.time()
+        encoded_msg: bytes = graph_builder.encode(graph_builder.compute(grid, {}), ego, timestamp=timestamp, last_timestamp=now)
+        scenes.send((now, encoded_msg))
+
+    logging.info(f'Occupancy engine stopped, skipped {n_skipped} frames.')
+    gm.tear_down()
+    scenes.close()
@@ -0,0 +1,64 @@
+from typing import List
+
+import numpy as np
+
+from client.occupancy.engine import SharedRing, pack_actors, unpack_actors, ACTOR_FIELDS
+from common.model import DynamicActor, UncertainProperty, Point3D, Point2D, ActorDynamics, ActorProperties, ActorType
+
+
+def _actor(actor_id: int, actor_type: ActorType, color: str) -> DynamicActor:
+    return DynamicActor(
+        id=actor_id,
+        type=UncertainProperty(.9, actor_type),
+        location=UncertainProperty(.8, Point3D(1., 2., 3.)),
+        gnss=UncertainProperty(.7, Point3D(49., 8., 110.)),
+        dynamics=ActorDynamics(velocity=UncertainProperty(.6, Point3D(4., 5., 0.)), acceleration=UncertainProperty(.5, Point3D(.1, .2, 0.))),
+        props=ActorProperties(
+            color=UncertainProperty(.4, color),
+            extent=UncertainProperty(.3, Point3D(2.2, 1.1, .8)),
+            bbox=UncertainProperty(.2, (Point2D(0, 0), Point2D(1, 0), Point2D(1, 1), Point2D(0, 1)))
+        )
+    )
+
+
+def test_pack_actors():
+    actors: List[DynamicActor] = [_actor(1, ActorType.VEHICLE, 'red'), _actor(2, ActorType.PEDESTRIAN, 'blue')]
+    packed: np.ndarray = pack_actors(actors)
+    assert packed.shape == (2, ACTOR_FIELDS)
+
+    # Colors are not packed, but sent once per actor
+    unpacked: List[DynamicActor] = unpack_actors(packed, {1: 'red'})
+    for a, b in zip(actors, unpacked):
+        assert b.id == a.id and b.type.value == a.type.value and b.type.confidence == a.type.confidence
+        for p, q in [(a.location, b.location), (a.gnss, b.gnss), (a.dynamics.velocity, b.dynamics.velocity),
+                     (a.dynamics.acceleration, b.dynamics.acceleration), (a.props.extent, b.props.extent)]:
+            assert q.value.components() == p.value.components() and q.confidence == p.confidence
+        assert [c.components() for c in b.props.bbox.value] == [c.components() for c in a.props.bbox.value]
+        assert b.props.bbox.confidence == a.props.bbox.confidence and b.props.color.confidence == a.props.color.confidence
+
+    assert unpacked[0].props.color.value == 'red' and unpacked[1].props.color.value is None
+    assert unpack_actors(pack_actors([]), {}) == []
+
+
+def test_shared_ring():
+    ring: SharedRing = SharedRing(2, (4, 3), np.float32)
+    points: np.ndarray = np.arange(9, dtype=np.float32).reshape((3, 3))
+
+    ring.write(0, points)
+    assert np.array_equal(ring.read(0, 3), points)
+    assert ring.read(1, 3) is None  # Never written
+
+    # Same slot, newer frame
+    ring.write(2, points + 1)
+    assert ring.read(0, 3) is None
+    assert np.array_equal(ring.read(2, 2), points[:2] + 1)
+
+    # Being written
+    ring.write(3, points)
+    ring._headers[1] = -1
+    assert ring.read(3, 3) is None
+
+
+if __name__ == '__main__':
+    test_pack_actors()
+    test_shared_ring()
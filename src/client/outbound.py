@@ -1,6 +1,6 @@
 from typing import Callable
 
-from .observation import ObservationManager
+from .observation import ObservationManager, DispatchMode
 from .occupancy import OccupancyGridManager
 
 
@@ -9,5 +9,5 @@ class OutboundController:
         self.om = om
         self.gm = gm
 
-    def subscribe(self, key: str, callback: Callable):
-        return self.om.subscribe(key, callback)
+    def subscribe(self, key: str, callback: Callable, mode: DispatchMode = DispatchMode.SYNC):
+        return self.om.subscribe(key, callback, mode)
@@ -0,0 +1,109 @@
+import logging
+from collections import deque
+from enum import Enum
+from threading import Thread, Condition
+from typing import Callable, Any, Deque, Dict, List
+
+from common.timing import TimingService
+
+'''
+    Explicit processing pipeline. Every stage runs on its own thread and consumes items from a bounded queue.
+    Whenever a queue is full, its oldest item is dropped deliberately, so that, under load, work is shed at
+    well-defined points instead of whichever frame happened to race a lock. A stage's return value is passed on
+    to the next stage, None ends processing of the respective item.
+'''
+
+
+class QueuePolicy(Enum):
+    LATEST = 0  # Only the most recent item is kept, everything older is superseded
+    FIFO = 1  # Items are processed in order, the oldest one is dropped on overflow
+
+
+class Stage:
+    def __init__(self, name: str, target: Callable[[Any], Any], policy: QueuePolicy = QueuePolicy.FIFO, maxsize: int = 4):
+        self.name: str = name
+        self.target: Callable[[Any], Any] = target
+        self.policy: QueuePolicy = policy
+        self.queue: Deque[Any] = deque(maxlen=1 if policy == QueuePolicy.LATEST else maxsize)
+        self.next: 'Stage' = None
+        self.timings: TimingService = TimingService()
+        self.timing_key: str = f'stage_{name}'
+
+        self.n_in: int = 0
+        self.n_dropped: int = 0
+        self.n_failed: int = 0
+
+        self.alive: bool = False
+        self.cond: Condition = Condition()
+        self.thread: Thread = Thread(target=self._loop, daemon=True, name=f'stage-{name}')
+
+    def start(self):
+        self.alive = True
+        self.thread.start()
+
+    def put(self, item: Any):
+        with self.cond:
+            if len(self.queue) == self.queue.maxlen:
+                self.n_dropped += 1  # deque evicts the oldest item on its own
+            self.queue.append(item)
+            self.n_in += 1
+            self.cond.notify()
+
+    def tear_down(self):
+        with self.cond:
+            self.alive = False
+            self.queue.clear()
+            self.cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        return {'in': self.n_in, 'dropped': self.n_dropped, 'failed': self.n_failed, 'queued': len(self.queue)}
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while self.alive and len(self.queue) == 0:
+                    self.cond.wait()
+                if not self.alive:
+                    return
+                item: Any = self.queue.popleft()
+
+            self.timings.start(self.timing_key)
+            try:
+                result: Any = self.target(item)
+            except Exception as e:
+                logging.warning(f'Stage "{self.name}" failed: {e}')
+                self.n_failed += 1
+                result = None
+            finally:
+                self.timings.stop(self.timing_key)
+
+            if result is not None and self.next:
+                self.next.put(result)
+
+
+class Pipeline:
+    def __init__(self):
+        self.stages: List[Stage] = []
+
+    def add_stage(self, name: str, target: Callable[[Any], Any], policy: QueuePolicy = QueuePolicy.FIFO, maxsize: int = 4) -> 'Pipeline':
+        return self.add(Stage(name, target, policy, maxsize))
+
+    def add(self, stage: Stage) -> 'Pipeline':
+        if len(self.stages) > 0:
+            self.stages[-1].next = stage
+        self.stages.append(stage)
+        return self
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def put(self, item: Any):
+        self.stages[0].put(item)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {s.name: s.stats() for s in self.stages}
+
+    def tear_down(self):
+        for stage in self.stages:
+            stage.tear_down()
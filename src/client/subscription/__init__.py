@@ -1,11 +1,19 @@
 import logging
-from typing import Dict, Tuple, Callable, Set, FrozenSet
+import time
+from typing import Dict, Tuple, Callable, Set, FrozenSet, List, Iterable, Union, Optional
 
 from pyquadkey2 import quadkey
-from pyquadkey2.quadkey import QuadKey
+from pyquadkey2.quadkey import QuadKey, TileAnchor
 
 from common.bridge import MqttBridge
+from common.bridge.metrics import Dropped, DROP_DECODE, DROP_STALE, DROP_UNWANTED
+from common.bridge.pool import BridgePool, BridgeLease, shared_pool
+from common.bridge.topics import tile_filter, tile_from_topic
+from common import routing
 from common.constants import *
+from common.serialization import container, wire
+from common.serialization.container import SceneFrame
+from common.util import geo
 
 '''
     In practice there is going to be multiple edge nodes with a separate MQTT broker alongside each.
@@ -26,6 +34,10 @@ from common.constants import *
 '''
 
 
+def _prefix_to_key(prefix: int, level: int) -> str:
+    return ''.join(str((prefix >> (2 * (level - 1 - i))) & 3) for i in range(level))
+
+
 class TileSubscriptionService:
     def __init__(
             self,
@@ -35,30 +47,59 @@ class TileSubscriptionService:
             topic_prefix: str = TOPIC_PREFIX_GRAPH_FUSED_OUT,
             edge_node_level: int = EDGE_DISTRIBUTION_TILE_LEVEL,
             remote_tile_level: int = REMOTE_GRID_TILE_LEVEL,
+            release_after: float = SUBSCRIPTION_RELEASE_SEC,
+            hysteresis: float = SUBSCRIPTION_HYSTERESIS_M,
+            min_dwell: float = SUBSCRIPTION_MIN_DWELL_SEC,
+            pool: Optional[BridgePool] = shared_pool,
+            hierarchical_topics: bool = TOPIC_HIERARCHICAL,
+            wildcard_level: int = SUBSCRIPTION_WILDCARD_LEVEL
     ):
         self.client_id: str = client_id
-        self.active_bridges: Dict[str, MqttBridge] = {}
-        self.active_subscriptions: Set[str] = set()
+        # Connections are leased from the pool, shared with all other services of the process, unless pool is None
+        self.pool: Optional[BridgePool] = pool
+        self.active_bridges: Dict[str, Union[MqttBridge, BridgeLease]] = {}
+        self.active_subscriptions: Set[str] = set()  # Remote tiles or, with hierarchical topics, their ancestors
+        self.active_tiles: FrozenSet[str] = frozenset()  # Remote tiles covered by the active subscriptions
         self.current_parent: QuadKey = None
         self.on_graph_cb = on_graph_cb
         self.manual_mode: bool = manual_mode
         self.edge_node_level: int = edge_node_level
         self.remote_tile_level: int = remote_tile_level
         self.topic_prefix: str = topic_prefix
-
-    def update_position(self, qk: QuadKey) -> bool:
-        parent = quadkey.from_str(qk.key[:self.remote_tile_level])
-
-        if self.manual_mode or (self.current_parent and parent and self.current_parent == parent):
+        # With hierarchical topics, tiles are subscribed to by one wildcard per ancestor of wildcard_level
+        self.hierarchical_topics: bool = hierarchical_topics
+        self.wildcard_level: int = wildcard_level
+        self.n_unwanted: int = 0  # Scenes of tiles matched by a wildcard, but not needed
+        self.tile_callbacks: Dict[str, Callable] = {}
+        self.last_applied: Dict[str, float] = {}  # Timestamp of the newest scene passed on per remote tile
+        self.n_stale: int = 0
+        self.ahead: FrozenSet[str] = frozenset()  # Remote tiles the ego is predicted to enter
+        self.release_after: float = release_after
+        self.unneeded_since: Dict[str, float] = {}  # Subscribed remote tiles pending release
+
+        # Debouncing of tile border crossings, see _debounce()
+        self.hysteresis: float = hysteresis
+        self.min_dwell: float = min_dwell
+        self.candidate_parent: QuadKey = None
+        self.candidate_since: float = 0
+        self.churn: Dict[str, int] = {k: 0 for k in ['parent_changes', 'suppressed', 'subscribes', 'unsubscribes', 'connects', 'disconnects']}
+
+    # The finer the given quadkey, the more precise the hysteresis. Optionally, tiles to subscribe to ahead of time
+    # can be passed, see TilePredictor.
+    def update_position(self, qk: QuadKey, ahead: Iterable[QuadKey] = None) -> bool:
+        parent = self._debounce(qk)
+        self._update_ahead(parent, ahead)
+
+        if self.manual_mode:
             return False
 
-        logging.debug(f'Subscription-relevant tile changed from {self.current_parent} to {parent}.')
-
-        sub_tiles = frozenset(parent.nearby(1))
-        # sub_tiles = frozenset([parent.key])
-        node_tiles = frozenset([key[:self.edge_node_level] for key in sub_tiles])
+        # Computed once per update, as it also tracks when tiles stopped being needed
+        tiles, node_tiles = self._get_tiles(parent)
+        if not self._subscriptions_changed(parent, tiles):
+            return False
 
-        if self.update_subscriptions(sub_tiles, node_tiles):
+        if self.update_subscriptions(tiles, node_tiles):
+            self.churn['parent_changes'] += self.current_parent != parent
             self.current_parent = parent
             return True
 
@@ -72,15 +113,18 @@ class TileSubscriptionService:
 
             self.active_bridges[node_key].disconnect()
             del self.active_bridges[node_key]
+            self.churn['disconnects'] += 1
 
         # Handle connections: init new
         for node_key in node_tiles.difference(set(self.active_bridges.keys())):
             logging.debug(f'Connecting to {node_key}')
 
-            bridge = MqttBridge(
+            bridge = self.pool.acquire(*self._resolve_mqtt_geodns(quadkey.from_str(node_key))) if self.pool else MqttBridge(
                 *self._resolve_mqtt_geodns(quadkey.from_str(node_key)),
                 client_id=f'{self.client_id}_{node_key}',
-                discard_when_busy=True
+                discard_when_busy=True,
+                n_workers=MQTT_INGRESS_WORKERS,
+                async_publish=True
             )
             try:
                 bridge.listen(block=False)
@@ -88,9 +132,119 @@ class TileSubscriptionService:
                 logging.warning(f'Failed to connect to MQTT bridge at {bridge.broker_config}')
                 return False
             self.active_bridges[node_key] = bridge
+            self.churn['connects'] += 1
+
+        self._update_topic_subscriptions(tiles)
+        return True
+
+    # Maybe move graph generation logic into here?
+    # Close to the border of a node tile, scenes are split, so that every edge node only receives the cells it owns
+    def publish_graph(self, encoded_msg: bytes):
+        if not self._near_node_border():
+            bridge = self._get_publish_bridge()
+            if bridge:
+                bridge.publish(TOPIC_GRAPH_RAW_IN, encoded_msg)
+            return
+
+        try:
+            parts: Dict[int, bytes] = wire.split_scene(encoded_msg, self.edge_node_level)
+        except ValueError:
+            logging.warning('Tried to publish malformed graph.')
+            return
+
+        for prefix, part in parts.items():
+            bridge = self._try_get_bridge(_prefix_to_key(prefix, self.edge_node_level))
+            if bridge:
+                bridge.publish(TOPIC_GRAPH_RAW_IN, part)
+
+    # Publishes a burst of graphs as one framed container message
+    def publish_graphs(self, encoded_msgs: List[bytes], sender: int = REMOTE_PSEUDO_ID):
+        bridge = self._get_publish_bridge()
+        if bridge:
+            now: float = time.time()
+            bridge.publish(TOPIC_GRAPH_RAW_IN_BATCH, container.pack([SceneFrame(m, sender=sender, timestamp=now) for m in encoded_msgs]))
+
+    @property
+    def active(self) -> bool:
+        return len(self.active_bridges) > 0 and all(list(map(lambda b: b.connected, self.active_bridges.values())))
+
+    def tear_down(self):
+        for b in self.active_bridges.values():
+            b.disconnect()
+
+    # Counts of parent tile changes, border crossings held back and (un-)subscriptions and (dis-)connections
+    def get_churn(self) -> Dict[str, int]:
+        return dict(self.churn)
+
+    # Driving along a tile border must not make subscriptions flap. A new parent tile is only adopted once the
+    # position is at least self.hysteresis metres inside of it and has stayed within it for self.min_dwell seconds.
+    def _debounce(self, qk: QuadKey) -> QuadKey:
+        parent = quadkey.from_str(qk.key[:self.remote_tile_level])
+        if not self.current_parent or parent == self.current_parent:
+            self.candidate_parent = None
+            return parent
+
+        now: float = time.monotonic()
+        if parent != self.candidate_parent:
+            self.candidate_parent, self.candidate_since = parent, now
+
+        if now - self.candidate_since >= self.min_dwell and self._depth_in_tile(qk, parent) >= self.hysteresis:
+            self.candidate_parent = None
+            return parent
+
+        self.churn['suppressed'] += 1
+        return self.current_parent
+
+    # Distance in metres between the center of qk and the closest border of tile
+    @staticmethod
+    def _depth_in_tile(qk: QuadKey, tile: QuadKey) -> float:
+        center: Tuple[float, float] = qk.to_geo(TileAnchor.ANCHOR_CENTER)
+        north, west = geo.gnss_delta_meters(center, tile.to_geo(TileAnchor.ANCHOR_NW))
+        south, east = geo.gnss_delta_meters(center, tile.to_geo(TileAnchor.ANCHOR_SE))
+        return min(north, -west, -south, east)
+
+    def _position_changed(self, parent: QuadKey) -> bool:
+        if self.manual_mode or (self.current_parent and parent and self.current_parent == parent):
+            return False
+
+        logging.debug(f'Subscription-relevant tile changed from {self.current_parent} to {parent}.')
+        return True
+
+    def _update_ahead(self, parent: QuadKey, ahead: Iterable[QuadKey] = None):
+        if ahead is not None:
+            self.ahead = frozenset(k.key[:self.remote_tile_level] for k in ahead).difference({parent.key})
+
+    # Besides moving, predicted tiles might have changed or tiles pending release might be due
+    def _subscriptions_changed(self, parent: QuadKey, tiles: FrozenSet[str]) -> bool:
+        return self._position_changed(parent) or tiles != self.active_tiles
+
+    # Remote tiles to subscribe to and the node tiles they belong to
+    def _get_tiles(self, parent: QuadKey) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+        needed: Set[str] = set(parent.nearby(1))
+        for key in self.ahead:
+            needed.update(quadkey.from_str(key).nearby(1))
+
+        # Tiles left behind are released lazily, in case the ego turns back or the prediction was off
+        now: float = time.monotonic()
+        lingering: Set[str] = set()
+        for key in self.active_tiles.difference(needed):
+            if now - self.unneeded_since.setdefault(key, now) < self.release_after:
+                lingering.add(key)
+        for key in needed:
+            self.unneeded_since.pop(key, None)
+
+        sub_tiles = frozenset(needed | lingering)
+        node_tiles = frozenset([key[:self.edge_node_level] for key in sub_tiles])
+        return sub_tiles, node_tiles
+
+    def _subscription_key(self, tile: str) -> str:
+        return tile[:self.wildcard_level] if self.hierarchical_topics else tile
+
+    def _update_topic_subscriptions(self, tiles: FrozenSet[str]):
+        sub_keys: FrozenSet[str] = frozenset(self._subscription_key(t) for t in tiles)
 
         # Handle subscriptions: clean up old
-        for sub_key in self.active_subscriptions.difference(tiles):
+        for sub_key in self.active_subscriptions.difference(sub_keys):
             self.active_subscriptions.remove(sub_key)
             node_key = sub_key[:self.edge_node_level]
             if node_key not in self.active_bridges:
@@ -99,10 +253,13 @@ class TileSubscriptionService:
             logging.debug(f'Removing subscription for {sub_key} at {node_key}')
 
             bridge = self.active_bridges[node_key]
-            bridge.unsubscribe(f'{self.topic_prefix}/{sub_key}', self.on_graph_cb)
+            bridge.unsubscribe(tile_filter(self.topic_prefix, sub_key, self.hierarchical_topics), self.tile_callbacks.pop(sub_key, None))
+            for tile in [t for t in self.last_applied if t.startswith(sub_key)]:
+                del self.last_applied[tile]
+            self.churn['unsubscribes'] += 1
 
         # Handle subscriptions: init new
-        for sub_key in tiles.difference(self.active_subscriptions):
+        for sub_key in sub_keys.difference(self.active_subscriptions):
             node_key = sub_key[:self.edge_node_level]
 
             logging.debug(f'Attempting to subscribe to {sub_key} at {node_key}')
@@ -113,34 +270,63 @@ class TileSubscriptionService:
                 logging.debug('Failed.')
                 continue
 
-            bridge.subscribe(f'{self.topic_prefix}/{sub_key}', self.on_graph_cb)
+            if self.hierarchical_topics:
+                self.tile_callbacks[sub_key] = self._on_region_graph
+                bridge.subscribe(tile_filter(self.topic_prefix, sub_key, True), self.tile_callbacks[sub_key], pass_topic=True)
+            else:
+                self.tile_callbacks[sub_key] = self._make_tile_callback(sub_key)
+                bridge.subscribe(tile_filter(self.topic_prefix, sub_key, False), self.tile_callbacks[sub_key])
             self.active_subscriptions.add(sub_key)
+            self.churn['subscribes'] += 1
+
+        self.active_tiles = frozenset(t for t in tiles if self._subscription_key(t) in self.active_subscriptions)
+        for key in [k for k in self.unneeded_since if k not in self.active_tiles]:
+            del self.unneeded_since[key]
+
+    def _make_tile_callback(self, tile: str) -> Callable:
+        return lambda msg: self._on_tile_graph(tile, msg)
+
+    # Wildcard subscriptions also match tiles around the ones needed, which are dropped right away
+    def _on_region_graph(self, topic: str, msg: bytes):
+        tile: str = tile_from_topic(self.topic_prefix, topic)
+        if tile not in self.active_tiles:
+            self.n_unwanted += 1
+            return Dropped(DROP_UNWANTED)
+        return self._on_tile_graph(tile, msg)
+
+    # Scenes that are not newer than the last one passed on for the same tile are dropped before anyone decodes them.
+    # Drops are reported back to the bridge, see common.bridge.metrics.
+    def _on_tile_graph(self, tile: str, msg: bytes):
+        try:
+            timestamp, _, last_timestamp = wire.peek_timestamps(msg)
+        except ValueError:
+            logging.warning(f'Dropping malformed scene for {tile}.')
+            return Dropped(DROP_DECODE)
+
+        timestamp = timestamp or last_timestamp
+        if timestamp and timestamp <= self.last_applied.get(tile, 0):
+            self.n_stale += 1
+            return Dropped(DROP_STALE)
+
+        self.last_applied[tile] = timestamp
+        return self.on_graph_cb(msg)
+
+    # Whether the ego's surroundings, and thus its grid, might stretch across more than one node tile
+    def _near_node_border(self) -> bool:
+        if not self.current_parent:
+            return False
+        return len(set(k[:self.edge_node_level] for k in self.current_parent.nearby(1))) > 1
 
-        return True
-
-    # Maybe move graph generation logic into here?
-    def publish_graph(self, encoded_msg: bytes):
+    def _get_publish_bridge(self) -> MqttBridge:
         if not self.current_parent:
             logging.warning('Tried to publish graph, but no current parent is set')
-            return
+            return None
 
-        # TODO: Publish to multiple bridges in case my observed grid stretches
-        #  among more than one EDGE_DISTRIBUTION_TILE_LEVEL tiles
         bridge = self._try_get_bridge(self.current_parent.key)
 
         if not bridge:
             logging.warning('Tried to publish graph, but no bridge was found')
-            return
-
-        bridge.publish(TOPIC_GRAPH_RAW_IN, encoded_msg)
-
-    @property
-    def active(self) -> bool:
-        return len(self.active_bridges) > 0 and all(list(map(lambda b: b.connected, self.active_bridges.values())))
-
-    def tear_down(self):
-        for b in self.active_bridges.values():
-            b.disconnect()
+        return bridge
 
     def _try_get_bridge(self, for_key: str) -> MqttBridge:
         for_key = for_key[:self.edge_node_level]
@@ -150,9 +336,10 @@ class TileSubscriptionService:
         return self.active_bridges[for_key]
 
     '''
-        Mocks an actual DNS-like type of system to resolve quad keys of node tiles to broker addresses.
+        DNS-like resolution of quad keys of node tiles to broker addresses, see common.routing. Only the node tile's
+        key is resolved, so routes deeper than edge_node_level never match.
     '''
 
     @staticmethod
     def _resolve_mqtt_geodns(for_tile: QuadKey) -> Tuple[str, int]:
-        return MQTT_BASE_HOSTNAME, 1883
+        return routing.default_table.resolve(for_tile.key)
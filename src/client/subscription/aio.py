@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Dict, FrozenSet, Callable, Iterable
+
+from pyquadkey2 import quadkey
+from pyquadkey2.quadkey import QuadKey
+
+from common.bridge.aio import AsyncMqttBridge
+from common.constants import *
+from . import TileSubscriptionService
+
+'''
+    asyncio counterpart to TileSubscriptionService. Tile and subscription bookkeeping is shared with the threaded
+    variant, only connection handling differs: bridges are AsyncMqttBridges bound to the given event loop and
+    (dis-)connecting them is awaited instead of blocking a thread.
+'''
+
+
+class AsyncTileSubscriptionService(TileSubscriptionService):
+    def __init__(self, loop: asyncio.AbstractEventLoop, on_graph_cb: Callable, **kwargs):
+        super().__init__(on_graph_cb, **kwargs)
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.active_bridges: Dict[str, AsyncMqttBridge] = {}
+
+    async def update_position(self, qk: QuadKey, ahead: Iterable[QuadKey] = None) -> bool:
+        parent = self._debounce(qk)
+        self._update_ahead(parent, ahead)
+
+        if self.manual_mode:
+            return False
+
+        tiles, node_tiles = self._get_tiles(parent)
+        if not self._subscriptions_changed(parent, tiles):
+            return False
+
+        if await self.update_subscriptions(tiles, node_tiles):
+            self.churn['parent_changes'] += self.current_parent != parent
+            self.current_parent = parent
+            return True
+
+        logging.warning(f'Failed to update position to {qk}.')
+        return False
+
+    async def update_subscriptions(self, tiles: FrozenSet[str], node_tiles: FrozenSet[str]) -> bool:
+        # Handle connections: clean up old
+        for node_key in set(self.active_bridges.keys()).difference(node_tiles):
+            logging.debug(f'Tearing down connection for {node_key}')
+
+            await self.active_bridges.pop(node_key).disconnect()
+            self.churn['disconnects'] += 1
+
+        # Handle connections: init new
+        for node_key in node_tiles.difference(set(self.active_bridges.keys())):
+            logging.debug(f'Connecting to {node_key}')
+
+            bridge = AsyncMqttBridge(
+                self.loop,
+                *self._resolve_mqtt_geodns(quadkey.from_str(node_key)),
+                client_id=f'{self.client_id}_{node_key}',
+                discard_when_busy=True
+            )
+            try:
+                await bridge.connect()
+            except (OSError, asyncio.TimeoutError):
+                logging.warning(f'Failed to connect to MQTT bridge at {bridge.broker_config}')
+                return False
+            self.active_bridges[node_key] = bridge
+            self.churn['connects'] += 1
+
+        self._update_topic_subscriptions(tiles)
+        return True
+
+    async def tear_down(self):
+        await asyncio.gather(*[b.disconnect() for b in self.active_bridges.values()], return_exceptions=True)
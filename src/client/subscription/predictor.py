@@ -0,0 +1,42 @@
+import math
+from typing import FrozenSet, Tuple
+
+from pyquadkey2 import quadkey
+from pyquadkey2.quadkey import QuadKey
+
+from common.constants import REMOTE_GRID_TILE_LEVEL, SUBSCRIPTION_HORIZON_SEC
+from common.util import geo
+
+'''
+    Predicts the remote grid tiles the ego is going to enter within a time horizon by extrapolating its current
+    position linearly along its velocity. Positions are sampled at most every RESOLUTION metres, which is well below
+    the edge length of a level 19 tile (~ 76 m at the equator), so no tile along the way is skipped, except for corners
+    the path only clips. Those are neighbours of predicted tiles and thus subscribed to anyway.
+'''
+
+_Vec3 = Tuple[float, float, float]
+
+RESOLUTION: float = 10  # m
+MIN_SPEED: float = .5  # m/s, standing still or creeping along does not warrant subscribing ahead
+
+
+class TilePredictor:
+    def __init__(self, horizon: float = SUBSCRIPTION_HORIZON_SEC, level: int = REMOTE_GRID_TILE_LEVEL):
+        self.horizon: float = horizon
+        self.level: int = level
+
+    # Coordinates are (lat, lon, alt), velocity is (north, east, up) in metres per second
+    def predict(self, coords: _Vec3, velocity: _Vec3) -> FrozenSet[QuadKey]:
+        speed: float = math.hypot(velocity[0], velocity[1])
+        if speed < MIN_SPEED:
+            return frozenset()
+
+        current: QuadKey = quadkey.from_geo(coords[:2], self.level)
+        n_samples: int = max(1, math.ceil(speed * self.horizon / RESOLUTION))
+
+        tiles = set()
+        for i in range(1, n_samples + 1):
+            pos: _Vec3 = geo.gnss_add_meters(coords, velocity, delta_factor=self.horizon * i / n_samples)
+            tiles.add(quadkey.from_geo(pos[:2], self.level))
+
+        return frozenset(tiles - {current})
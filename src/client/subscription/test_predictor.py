@@ -0,0 +1,51 @@
+from typing import FrozenSet, Set, Tuple
+
+from pyquadkey2 import quadkey
+from pyquadkey2.quadkey import QuadKey
+
+from client.subscription.predictor import TilePredictor, MIN_SPEED
+from common.util import geo
+
+REF_COORDS_1: Tuple[float, float, float] = (49.01, 8.41, 110.)
+
+
+# Tiles along the way, sampled every metre
+def _tiles_along(predictor: TilePredictor, coords: Tuple[float, float, float], velocity: Tuple[float, float, float]) -> Set[QuadKey]:
+    distance: float = (velocity[0] ** 2 + velocity[1] ** 2) ** .5 * predictor.horizon
+    n: int = int(distance) + 1
+    return {quadkey.from_geo(geo.gnss_add_meters(coords, velocity, delta_factor=predictor.horizon * i / n)[:2], predictor.level) for i in range(n + 1)}
+
+
+def test_predict_along_velocity():
+    predictor: TilePredictor = TilePredictor(horizon=3., level=19)
+    current: QuadKey = quadkey.from_geo(REF_COORDS_1[:2], 19)
+
+    # ~ 90 m to the east, i.e. more than one tile ahead, none skipped, the current one excluded
+    east: FrozenSet[QuadKey] = predictor.predict(REF_COORDS_1, (0., 30., 0.))
+    assert len(east) >= 2 and current not in east
+    assert east == _tiles_along(predictor, REF_COORDS_1, (0., 30., 0.)) - {current}
+    assert all(abs(geo.gnss_delta_meters(REF_COORDS_1, k.to_geo())[0]) < 76 for k in east)  # Same row
+
+    # Diagonally, corners the path only clips may be skipped, but are among the neighbours subscribed to along with it
+    diagonal: FrozenSet[QuadKey] = predictor.predict(REF_COORDS_1, (-40., 40., 0.))
+    covered: Set[str] = {n for k in diagonal | {current} for n in k.nearby(1)}
+    assert len(diagonal) >= 3 and current not in diagonal
+    assert diagonal <= _tiles_along(predictor, REF_COORDS_1, (-40., 40., 0.))
+    assert all(k.key in covered for k in _tiles_along(predictor, REF_COORDS_1, (-40., 40., 0.)))
+
+    # Slowly, at most the tile 3 m ahead
+    assert predictor.predict(REF_COORDS_1, (0., 1., 0.)) <= {quadkey.from_geo(geo.gnss_add_meters(REF_COORDS_1, (0., 3., 0.))[:2], 19)}
+
+
+def test_min_speed():
+    predictor: TilePredictor = TilePredictor(horizon=1000., level=19)
+
+    # Creeping along would leave the tile within the (long) horizon, but is not predicted, vertical speed does not count
+    assert predictor.predict(REF_COORDS_1, (0., MIN_SPEED * .9, 0.)) == frozenset()
+    assert predictor.predict(REF_COORDS_1, (0., 0., 10.)) == frozenset()
+    assert len(predictor.predict(REF_COORDS_1, (0., MIN_SPEED, 0.))) > 0
+
+
+if __name__ == '__main__':
+    test_predict_along_velocity()
+    test_min_speed()
@@ -0,0 +1,167 @@
+import time
+from typing import Dict, FrozenSet, List, Set
+
+from pyquadkey2 import quadkey
+from pyquadkey2.quadkey import QuadKey
+
+from client.subscription import TileSubscriptionService
+from common.bridge import MqttBridge
+from common.bridge.loopback import LoopbackBroker, set_broker, get_broker
+from common.bridge.pool import BridgePool
+from common.constants import MQTT_LOOPBACK_HOST, TOPIC_GRAPH_RAW_IN, EDGE_DISTRIBUTION_TILE_LEVEL
+from common.routing import RoutingTable
+from common.serialization.schema import GridCellState
+from common.serialization.schema.actor import PEMDynamicActor
+from common.serialization.schema.base import PEMTrafficScene
+from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
+from common.serialization.schema.relation import PEMRelation
+
+REF_PARENT_1: QuadKey = quadkey.from_str('1202032332303131012')
+REF_EAST_1: QuadKey = quadkey.from_str('1202032332303131013')
+REF_NODE_1: str = REF_PARENT_1.key[:EDGE_DISTRIBUTION_TILE_LEVEL]
+
+
+def _wait_for(condition, timeout: float = 2.) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.005)
+    return True
+
+
+# Service whose node tiles are routed to in-process brokers
+def _service(routes: Dict[str, int], **kwargs) -> TileSubscriptionService:
+    table: RoutingTable = RoutingTable({prefix: f'{MQTT_LOOPBACK_HOST}:{port}' for prefix, port in routes.items()})
+    for port in routes.values():
+        set_broker(port, LoopbackBroker())
+
+    tss: TileSubscriptionService = TileSubscriptionService(lambda msg: None, pool=BridgePool(), **kwargs)
+    tss._resolve_mqtt_geodns = lambda tile: table.resolve(tile.key)
+    return tss
+
+
+def _tear_down(tss: TileSubscriptionService, routes: Dict[str, int]):
+    tss.tear_down()
+    for port in routes.values():
+        get_broker(port).tear_down()
+
+
+def test_lazy_release():
+    routes: Dict[str, int] = {'': 50021}
+    tss: TileSubscriptionService = _service(routes, release_after=.2, hysteresis=0, min_dwell=0)
+
+    assert tss.update_position(quadkey.from_str(REF_PARENT_1.key + '00000'))
+    assert tss.active_tiles == frozenset(REF_PARENT_1.nearby(1))
+
+    # One tile to the east, the column left behind lingers
+    west: FrozenSet[str] = frozenset(REF_PARENT_1.nearby(1)).difference(REF_EAST_1.nearby(1))
+    assert len(west) == 3
+    assert tss.update_position(quadkey.from_str(REF_EAST_1.key + '00000'))
+    assert tss.current_parent == REF_EAST_1
+    assert tss.active_tiles == frozenset(REF_EAST_1.nearby(1)) | west and set(tss.unneeded_since) == west
+    assert not tss.update_position(quadkey.from_str(REF_EAST_1.key + '00000'))
+    assert tss.get_churn()['unsubscribes'] == 0
+
+    # ... until released
+    time.sleep(.25)
+    assert tss.update_position(quadkey.from_str(REF_EAST_1.key + '00000'))
+    assert tss.active_tiles == frozenset(REF_EAST_1.nearby(1)) and tss.unneeded_since == {}
+    assert tss.get_churn()['unsubscribes'] == 3
+
+    # Turning back before the release, lingering tiles are needed again and kept without resubscribing
+    n_subscribes: int = tss.get_churn()['subscribes']
+    east: FrozenSet[str] = frozenset(REF_EAST_1.nearby(1)).difference(REF_PARENT_1.nearby(1))
+    assert tss.update_position(quadkey.from_str(REF_PARENT_1.key + '00000'))
+    assert tss.get_churn()['subscribes'] == n_subscribes + 3 and set(tss.unneeded_since) == east
+    assert tss.update_position(quadkey.from_str(REF_EAST_1.key + '00000'))
+    assert tss.get_churn()['subscribes'] == n_subscribes + 3 and set(tss.unneeded_since) == west
+    assert tss.get_churn()['unsubscribes'] == 3
+
+    _tear_down(tss, routes)
+
+
+def test_debounce():
+    tss: TileSubscriptionService = TileSubscriptionService(lambda msg: None, pool=None, hysteresis=5., min_dwell=.1)
+    tss.current_parent = REF_PARENT_1
+    border: QuadKey = quadkey.from_str(REF_EAST_1.key + '00000')  # Right behind the border to the east
+    inside: QuadKey = quadkey.from_str(REF_EAST_1.key + '03333')  # Close to the center
+
+    assert TileSubscriptionService._depth_in_tile(border, REF_EAST_1) < 1.5
+    assert TileSubscriptionService._depth_in_tile(inside, REF_EAST_1) > 20
+    assert TileSubscriptionService._depth_in_tile(border, REF_PARENT_1) < 0
+
+    # Staying within the current parent is never suppressed
+    assert tss._debounce(quadkey.from_str(REF_PARENT_1.key + '33333')) == REF_PARENT_1
+    assert tss.get_churn()['suppressed'] == 0
+
+    # Crossing the border is held back, however long the ego stays close to it ...
+    assert tss._debounce(border) == REF_PARENT_1
+    time.sleep(.15)
+    assert tss._debounce(border) == REF_PARENT_1
+    assert tss.get_churn()['suppressed'] == 2
+
+    # ... or until it dwelled inside long enough, counted from the first crossing
+    assert tss._debounce(inside) == REF_EAST_1
+    assert tss.candidate_parent is None and tss.get_churn()['suppressed'] == 2
+
+    # Unless adopted by the caller, the next crossing starts over. Returning to the current parent restarts the dwell time
+    assert tss._debounce(inside) == REF_PARENT_1 and tss.candidate_parent == REF_EAST_1
+    time.sleep(.15)
+    assert tss._debounce(quadkey.from_str(REF_PARENT_1.key + '33333')) == REF_PARENT_1
+    assert tss._debounce(inside) == REF_PARENT_1
+    assert tss.get_churn()['suppressed'] == 4
+
+
+def test_publish_split():
+    # At the eastern border of a node tile, the surroundings stretch into the neighbouring one
+    parent: QuadKey = quadkey.from_str(REF_NODE_1 + '1313')
+    node_keys: List[str] = sorted({k[:EDGE_DISTRIBUTION_TILE_LEVEL] for k in parent.nearby(1)})
+    assert len(node_keys) == 2 and REF_NODE_1 in node_keys
+
+    routes: Dict[str, int] = {node_keys[0]: 50031, node_keys[1]: 50032}
+    tss: TileSubscriptionService = _service(routes, hysteresis=0, min_dwell=0)
+    assert tss.update_position(quadkey.from_str(parent.key + '00000'))
+    assert tss._near_node_border() and set(tss.active_bridges) == set(node_keys)
+    assert _wait_for(lambda: tss.active)
+
+    # Edge nodes listening on either broker
+    received: Dict[str, List[PEMTrafficScene]] = {k: [] for k in node_keys}
+    edges: List[MqttBridge] = []
+    for node_key, port in routes.items():
+        edge: MqttBridge = MqttBridge(MQTT_LOOPBACK_HOST, port, client_id=f'edge_{node_key}')
+        edge.listen(block=False)
+        assert _wait_for(lambda: edge.connected)
+        edge.subscribe(TOPIC_GRAPH_RAW_IN, lambda msg, k=node_key: received[k].append(PEMTrafficScene.from_bytes(msg)))
+        edges.append(edge)
+
+    cells: List[str] = [parent.key + '00000', parent.key + '33333'] + [k + '00000' for k in parent.nearby(1) if not k.startswith(REF_NODE_1)]
+    scene: PEMTrafficScene = PEMTrafficScene(
+        timestamp=time.time(),
+        measured_by=PEMDynamicActor(id=1),
+        occupancy_grid=PEMOccupancyGrid(cells=[PEMGridCell(hash=quadkey.from_str(k).to_quadint(), state=PEMRelation(.5, GridCellState(1))) for k in cells])
+    )
+    tss.publish_graph(scene.to_bytes())
+
+    # Each one only receives the cells it owns
+    assert _wait_for(lambda: all(len(r) == 1 for r in received.values()))
+    for node_key in node_keys:
+        owned: Set[int] = {quadkey.from_str(k).to_quadint() for k in cells if k.startswith(node_key)}
+        part: PEMTrafficScene = received[node_key][0]
+        assert len(owned) > 0 and {c.hash for c in part.occupancy_grid.cells} == owned
+        assert part.measured_by.id == 1 and part.timestamp == scene.timestamp
+
+    # Malformed graphs are neither published nor raise
+    tss.publish_graph(scene.to_bytes()[:-1])
+    time.sleep(.1)
+    assert all(len(r) == 1 for r in received.values())
+
+    for edge in edges:
+        edge.disconnect()
+    _tear_down(tss, routes)
+
+
+if __name__ == '__main__':
+    test_lazy_release()
+    test_debounce()
+    test_publish_split()
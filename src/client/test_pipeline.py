@@ -0,0 +1,91 @@
+import time
+from threading import Event
+from typing import List, Any
+
+from client.pipeline import Pipeline, Stage, QueuePolicy
+
+
+def _wait_for(condition, timeout: float = 2.) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.005)
+    return True
+
+
+def test_overflow():
+    latest_out: List[int] = []
+    fifo_out: List[int] = []
+    latest: Stage = Stage('latest', latest_out.append, policy=QueuePolicy.LATEST, maxsize=4)
+    fifo: Stage = Stage('fifo', fifo_out.append, policy=QueuePolicy.FIFO, maxsize=2)
+
+    # Queued before starting, so that nothing is consumed in between
+    for i in range(4):
+        latest.put(i)
+        fifo.put(i)
+    assert latest.stats() == {'in': 4, 'dropped': 3, 'failed': 0, 'queued': 1}
+    assert fifo.stats() == {'in': 4, 'dropped': 2, 'failed': 0, 'queued': 2}
+
+    latest.start()
+    fifo.start()
+    assert _wait_for(lambda: len(latest_out) == 1 and len(fifo_out) == 2)
+    assert latest_out == [3] and fifo_out == [2, 3]
+
+    latest.tear_down()
+    fifo.tear_down()
+
+
+def test_failures_and_none():
+    out: List[Any] = []
+
+    def parse(i: int) -> Any:
+        if i % 3 == 0:
+            raise ValueError(f'bad item {i}')
+        return None if i % 3 == 1 else i
+
+    pipeline: Pipeline = Pipeline().add_stage('parse', parse, maxsize=16).add_stage('collect', out.append, maxsize=16)
+    pipeline.start()
+
+    # Failing items as well as those resulting in None end there, the stage keeps running
+    for i in range(9):
+        pipeline.put(i)
+    assert _wait_for(lambda: len(out) == 3)
+    assert out == [2, 5, 8]
+
+    stats = pipeline.stats()
+    assert stats['parse'] == {'in': 9, 'dropped': 0, 'failed': 3, 'queued': 0}
+    assert stats['collect']['in'] == 3
+
+    pipeline.tear_down()
+
+
+def test_tear_down():
+    started, release = Event(), Event()
+    out: List[int] = []
+
+    def slow(i: int) -> int:
+        started.set()
+        release.wait()
+        return i
+
+    pipeline: Pipeline = Pipeline().add_stage('slow', slow).add_stage('collect', out.append)
+    pipeline.start()
+    pipeline.put(0)
+    assert started.wait(timeout=2.)
+    pipeline.put(1)
+
+    # Queued items are discarded, the item in progress is passed on, but not processed anymore
+    pipeline.tear_down()
+    assert pipeline.stats()['slow']['queued'] == 0
+    release.set()
+    for stage in pipeline.stages:
+        stage.thread.join(timeout=2.)
+        assert not stage.thread.is_alive()
+    assert out == []
+
+
+if __name__ == '__main__':
+    test_overflow()
+    test_failures_and_none()
+    test_tear_down()
@@ -0,0 +1,154 @@
+import random
+import time
+from typing import List, Dict
+
+import numpy as np
+from pyquadkey2 import quadkey
+from pyquadkey2.quadkey import QuadKey
+
+from client.graph import GridArrays
+from client.world import CooperativeWorldModel, SOURCE_LOCAL, SOURCE_REMOTE
+from common.observation import PEMTrafficSceneObservation
+from common.occupancy import GridCellState as Gss
+from common.serialization.schema import GridCellState
+from common.serialization.schema.base import PEMTrafficScene
+from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
+from common.serialization.schema.relation import PEMRelation
+from evaluation.perception.grid_evaluator import GridEvaluator
+
+REF_TIME_1: float = 1573220495.8997931
+REF_PARENT_1: QuadKey = quadkey.from_str('1202032332303131012')
+
+
+def _arrays(keys: List[str], states: List[int], confidences: List[float]) -> GridArrays:
+    return GridArrays(
+        hashes=np.array([quadkey.from_str(k).to_quadint() for k in keys], dtype=np.uint64),
+        states=np.array(states, dtype=np.uint8),
+        confidences=np.array(confidences, dtype=np.float32),
+        occupant_confidences=np.zeros(len(keys), dtype=np.float32)
+    )
+
+
+def _observation(arrays: GridArrays, timestamp: float) -> PEMTrafficSceneObservation:
+    return PEMTrafficSceneObservation(
+        timestamp=timestamp,
+        scene=PEMTrafficScene(
+            timestamp=timestamp,
+            min_timestamp=timestamp,
+            max_timestamp=timestamp,
+            occupancy_grid=PEMOccupancyGrid(cells=[
+                PEMGridCell(hash=q, state=PEMRelation(c, GridCellState(Gss(s))))
+                for q, s, c in zip(arrays.hashes.tolist(), arrays.states.tolist(), arrays.confidences.tolist())
+            ])
+        ),
+        meta={'parent': REF_PARENT_1}
+    )
+
+
+def _random_arrays(n: int) -> GridArrays:
+    keys: List[str] = sorted({REF_PARENT_1.key + '00' + ''.join(random.choice('0123') for _ in range(3)) for _ in range(n)})  # Drawn from 64 cells, so that they overlap
+    return _arrays(keys, [random.randint(0, 2) for _ in keys], [random.uniform(.1, 1) for _ in keys])
+
+
+def _states(world: CooperativeWorldModel, tile: str) -> np.ndarray:
+    world.fuse(REF_TIME_1)
+    return world.query(quadkey.from_str(tile)).states
+
+
+def test_fuse_parity():
+    random.seed(1)
+
+    for _ in range(10):
+        ts_local, ts_remote = REF_TIME_1 - random.uniform(0, 1), REF_TIME_1 - random.uniform(0, 1)
+        local, remote = _random_arrays(40), _random_arrays(40)
+
+        world: CooperativeWorldModel = CooperativeWorldModel()
+        world.move_to(REF_PARENT_1)
+        world.update(SOURCE_LOCAL, local, ts_local)
+        world.update(SOURCE_REMOTE, remote, ts_remote)
+        world.fuse(REF_TIME_1)
+        fused: GridArrays = world.query(REF_PARENT_1)
+        by_hash: Dict[int, int] = {h: i for i, h in enumerate(fused.hashes.tolist())}
+
+        expected: PEMTrafficSceneObservation = GridEvaluator.fuse(_observation(local, ts_local), _observation(remote, ts_remote), REF_TIME_1)
+        assert len(expected.value.occupancy_grid.cells) == len(set(local.hashes.tolist()) | set(remote.hashes.tolist()))
+
+        for cell in expected.value.occupancy_grid.cells:
+            i: int = by_hash[cell.hash]
+            assert fused.states[i] == cell.state.object.value
+            assert abs(fused.confidences[i] - cell.state.confidence) < 1e-5
+
+
+def test_move_keeps_overlap():
+    world: CooperativeWorldModel = CooperativeWorldModel()
+    world.move_to(REF_PARENT_1)
+
+    # Cells of a tile that is still within the surrounding tiles after moving one tile to the east
+    tile: str = REF_PARENT_1.key
+    east: QuadKey = quadkey.from_str(tile[:-1] + '3')
+    assert tile in east.nearby(1)
+    world.update(SOURCE_LOCAL, _arrays([tile + '00000', tile + '00001'], [Gss.OCCUPIED, Gss.FREE], [.9, .8]), REF_TIME_1)
+
+    assert world.move_to(east)
+    assert not world.move_to(east)
+    assert list(_states(world, tile + '0000')) == [Gss.OCCUPIED, Gss.FREE, Gss.UNKNOWN, Gss.UNKNOWN]
+
+    # Nothing is kept of the local source once out of range
+    far: QuadKey = quadkey.from_str(tile[:-3] + '333')
+    world.move_to(far)
+    assert len(world.query(quadkey.from_str(tile)).hashes) == 0
+    world.move_to(REF_PARENT_1)
+    assert np.all(_states(world, tile) == Gss.UNKNOWN)
+
+
+def test_update_rejects_older():
+    world: CooperativeWorldModel = CooperativeWorldModel()
+    world.move_to(REF_PARENT_1)
+    cell: str = REF_PARENT_1.key + '00000'
+
+    assert world.update(SOURCE_REMOTE, _arrays([cell], [Gss.OCCUPIED], [.9]), REF_TIME_1) == 1
+    assert world.update(SOURCE_REMOTE, _arrays([cell], [Gss.FREE], [.9]), REF_TIME_1 - 1) == 0
+    assert _states(world, cell)[0] == Gss.OCCUPIED
+
+    # Same or newer timestamps do, other sources are independent
+    assert world.update(SOURCE_LOCAL, _arrays([cell], [Gss.FREE], [.5]), REF_TIME_1 - 1) == 1
+    assert world.update(SOURCE_REMOTE, _arrays([cell], [Gss.FREE], [.9]), REF_TIME_1) == 1
+    assert _states(world, cell)[0] == Gss.FREE
+
+    # Cells outside of the surrounding tiles are ignored
+    assert world.update(SOURCE_REMOTE, _arrays([REF_PARENT_1.key[:-3] + '333' + '00000'], [Gss.FREE], [.9]), REF_TIME_1 + 1) == 0
+
+
+def test_cache():
+    world: CooperativeWorldModel = CooperativeWorldModel(cache_ttl=1.)
+    world.move_to(REF_PARENT_1)
+    tile: str = REF_PARENT_1.key
+    far: QuadKey = quadkey.from_str(tile[:-3] + '333')
+    now: float = time.time()
+
+    # One remote cell fresh enough to survive the cache, one not, the local one is not cached at all
+    world.update(SOURCE_REMOTE, _arrays([tile + '00000'], [Gss.OCCUPIED], [.9]), now - .5)
+    world.update(SOURCE_REMOTE, _arrays([tile + '00001'], [Gss.OCCUPIED], [.9]), now - 1.5)
+    world.update(SOURCE_LOCAL, _arrays([tile + '00002'], [Gss.FREE], [.9]), now)
+
+    world.move_to(far)
+    assert tile in world.cache
+    world.move_to(REF_PARENT_1)
+    world.fuse(now)
+    assert list(world.query(quadkey.from_str(tile + '0000')).states) == [Gss.OCCUPIED, Gss.UNKNOWN, Gss.UNKNOWN, Gss.UNKNOWN]
+    assert world.get_cache_hits() == 1 and tile not in world.cache
+
+    # Left for longer than the TTL, nothing is restored
+    world.move_to(far)
+    world.cache_ttl = .1
+    time.sleep(.2)
+    world.move_to(REF_PARENT_1)
+    assert np.all(_states(world, tile) == Gss.UNKNOWN)
+    assert world.get_cache_hits() == 1 and len(world.cache) == 0
+
+
+if __name__ == '__main__':
+    test_fuse_parity()
+    test_move_keeps_overlap()
+    test_update_rejects_older()
+    test_cache()
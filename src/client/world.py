@@ -0,0 +1,224 @@
+import time
+from threading import Lock
+from typing import Tuple, Optional, Dict, Set
+
+import numpy as np
+from pyquadkey2 import quadkey
+from pyquadkey2.quadkey import QuadKey
+
+from client.graph import GridArrays
+from common.constants import *
+from common.occupancy import GridCellState
+from common.serialization.schema.proto import base_pb2
+
+'''
+    Online counterpart to GridEvaluator.fuse(). The model covers all cells (of OCCUPANCY_TILE_LEVEL) within the
+    remote grid tiles around the ego, i.e. the ones it is subscribed to. Cells are kept in flat arrays sorted by their
+    quadints, one row per source (the ego's own grid and the remote scenes). Because quadints of all cells within a tile
+    form a contiguous range, updates are vectorized lookups and queries are slices.
+    Fusion weighs every source's state confidence by how recent its observation is, known states override unknown.
+    Remote cells of tiles the ego moves away from are kept in a cache for cache_ttl seconds, so that they are known
+    right away when the ego turns back, instead of only once the edge node publishes the tile again.
+'''
+
+N_SOURCES: int = 2
+SOURCE_LOCAL, SOURCE_REMOTE = 0, 1
+
+_QUADINT_LEVEL_BITS: int = 5
+_QUADINT_LEVEL_MASK: np.uint64 = np.uint64((1 << _QUADINT_LEVEL_BITS) - 1)
+
+_CachedTile = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]  # Hashes, states, confidences, timestamps of remote cells
+
+
+def quadint_range(tile: QuadKey, cell_level: int) -> Tuple[int, int]:
+    # Inclusive bounds of the quadints of all cells of the given level within a tile
+    base: int = tile.to_quadint() & ~int(_QUADINT_LEVEL_MASK)
+    n_children_bits: int = 2 * (cell_level - tile.level)
+    return base | cell_level, base | (((1 << n_children_bits) - 1) << (64 - 2 * cell_level)) | cell_level
+
+
+def tile_quadints(tile: QuadKey, cell_level: int) -> np.ndarray:
+    lo, _ = quadint_range(tile, cell_level)
+    children: np.ndarray = np.arange(4 ** (cell_level - tile.level), dtype=np.uint64)
+    return np.uint64(lo) | (children << np.uint64(64 - 2 * cell_level))
+
+
+def decay(timestamps: np.ndarray, ref_time: float, decay_lambda: float = FUSION_DECAY_LAMBDA) -> np.ndarray:
+    return np.exp(-(ref_time - timestamps) * 10 * decay_lambda)  # Time in 100 ms
+
+
+def decode_grid(msg: bytes) -> Tuple[GridArrays, float]:
+    scene = base_pb2.TrafficScene()
+    scene.ParseFromString(msg)
+    cells = scene.occupancyGrid.cells
+    n: int = len(cells)
+
+    arrays: GridArrays = GridArrays(
+        hashes=np.fromiter((c.hash for c in cells), dtype=np.uint64, count=n),
+        states=np.fromiter((c.state.object for c in cells), dtype=np.uint8, count=n),
+        confidences=np.fromiter((c.state.confidence for c in cells), dtype=np.float32, count=n),
+        occupant_confidences=np.fromiter((c.occupant.confidence for c in cells), dtype=np.float32, count=n)
+    )
+    # Scenes are made up of observations taken anywhere between min and max timestamp
+    return arrays, scene.minTimestamp + (scene.maxTimestamp - scene.minTimestamp) / 2
+
+
+class CooperativeWorldModel:
+    def __init__(
+            self,
+            tile_level: int = REMOTE_GRID_TILE_LEVEL,
+            cell_level: int = OCCUPANCY_TILE_LEVEL,
+            decay_lambda: float = FUSION_DECAY_LAMBDA,
+            cache_ttl: float = GRID_TTL_SEC
+    ):
+        self.tile_level: int = tile_level
+        self.cell_level: int = cell_level
+        self.decay_lambda: float = decay_lambda
+        self.cache_ttl: float = cache_ttl
+        self.cache: Dict[str, _CachedTile] = {}  # Remote tiles left behind
+        self.n_cache_hits: int = 0
+        self.parent: Optional[QuadKey] = None
+        self.lock: Lock = Lock()
+
+        self.hashes: np.ndarray = np.empty(0, dtype=np.uint64)
+        self._allocate(0)
+
+    def move_to(self, parent: QuadKey) -> bool:
+        if parent.level != self.tile_level:
+            parent = quadkey.from_str(parent.key[:self.tile_level])
+        if parent == self.parent:
+            return False
+
+        tiles: Set[str] = set(parent.nearby(1))
+        old_tiles: Set[str] = set(self.parent.nearby(1)) if self.parent else set()
+        hashes: np.ndarray = np.sort(np.concatenate([tile_quadints(quadkey.from_str(k), self.cell_level) for k in tiles]))
+
+        with self.lock:
+            for key in old_tiles.difference(tiles):
+                self._retire(key)
+
+            # Keep what is known about cells covered before and after
+            old_hashes, old_states, old_confidences, old_timestamps = self.hashes, self.states, self.confidences, self.timestamps
+            self.hashes = hashes
+            self._allocate(len(hashes))
+
+            idx, found = self._lookup(old_hashes)
+            self.states[:, idx[found]] = old_states[:, found]
+            self.confidences[:, idx[found]] = old_confidences[:, found]
+            self.timestamps[:, idx[found]] = old_timestamps[:, found]
+
+            self._expire_cache()
+            for key in tiles.difference(old_tiles):
+                self._restore(key)
+            self.parent = parent
+
+        return True
+
+    # Returns the number of cells that lie within the model's area
+    def update(self, source: int, arrays: GridArrays, timestamp: float) -> int:
+        with self.lock:
+            idx, found = self._lookup(arrays.hashes)
+            idx = idx[found]
+
+            # Older observations must not override newer ones, e.g. of overlapping remote tiles
+            newer: np.ndarray = self.timestamps[source, idx] <= timestamp
+            idx = idx[newer]
+
+            self.states[source, idx] = np.asarray(arrays.states)[found][newer]
+            self.confidences[source, idx] = np.asarray(arrays.confidences)[found][newer]
+            self.timestamps[source, idx] = timestamp
+
+        return len(idx)
+
+    def fuse(self, ref_time: float = None):
+        ref_time = ref_time if ref_time else time.time()
+
+        with self.lock:
+            observed: np.ndarray = np.isfinite(self.timestamps)
+            weights: np.ndarray = np.where(observed, decay(np.where(observed, self.timestamps, ref_time), ref_time, self.decay_lambda), 0)
+            contributions: np.ndarray = self.confidences * weights
+
+            # One row per cell state, summed over sources
+            state_votes: np.ndarray = np.zeros((len(GridCellState), len(self.hashes)), dtype=np.float64)
+            for s in GridCellState:
+                state_votes[s] = np.sum(np.where(self.states == s, contributions, 0), axis=0)
+
+            # Override unknown
+            known: np.ndarray = np.sum(state_votes[:GridCellState.UNKNOWN], axis=0) > 0
+            unknown_weights: np.ndarray = np.sum(np.where(self.states == GridCellState.UNKNOWN, weights, 0), axis=0)
+            weight_sum: np.ndarray = np.sum(weights, axis=0) - np.where(known, unknown_weights, 0)
+            state_votes[GridCellState.UNKNOWN, known] = 0
+
+            state_votes /= np.where(weight_sum > 0, weight_sum, 1)
+            self.fused_states = np.where(np.any(observed, axis=0), np.argmax(state_votes, axis=0), GridCellState.UNKNOWN).astype(np.uint8)
+            self.fused_confidences = np.max(state_votes, axis=0).astype(np.float32)
+            self.fused_timestamp = ref_time
+
+    # Fused cells within the given tile (of any level up to the cell level), as of the last call to fuse()
+    def query(self, tile: QuadKey) -> GridArrays:
+        with self.lock:
+            start, end = self._slice(tile)
+            return GridArrays(
+                hashes=self.hashes[start:end],
+                states=self.fused_states[start:end].copy(),
+                confidences=self.fused_confidences[start:end].copy(),
+                occupant_confidences=np.zeros(end - start, dtype=np.float32)
+            )
+
+    # Number of remote tiles restored from the cache so far
+    def get_cache_hits(self) -> int:
+        return self.n_cache_hits
+
+    # Moves what is known about a tile from remote scenes into the cache, must hold the lock
+    def _retire(self, key: str):
+        start, end = self._slice(quadkey.from_str(key))
+        observed: np.ndarray = np.isfinite(self.timestamps[SOURCE_REMOTE, start:end])
+        if not np.any(observed):
+            return
+
+        self.cache[key] = (
+            self.hashes[start:end][observed],
+            self.states[SOURCE_REMOTE, start:end][observed],
+            self.confidences[SOURCE_REMOTE, start:end][observed],
+            self.timestamps[SOURCE_REMOTE, start:end][observed]
+        )
+
+    # Puts cached cells of a tile back into the model, unless they expired in the meantime, must hold the lock
+    def _restore(self, key: str):
+        cached: Optional[_CachedTile] = self.cache.pop(key, None)
+        if cached is None:
+            return
+
+        hashes, states, confidences, timestamps = cached
+        fresh: np.ndarray = timestamps >= time.time() - self.cache_ttl
+        idx, found = self._lookup(hashes[fresh])
+        idx = idx[found]
+
+        self.states[SOURCE_REMOTE, idx] = states[fresh][found]
+        self.confidences[SOURCE_REMOTE, idx] = confidences[fresh][found]
+        self.timestamps[SOURCE_REMOTE, idx] = timestamps[fresh][found]
+        self.n_cache_hits += len(idx) > 0
+
+    def _expire_cache(self):
+        min_timestamp: float = time.time() - self.cache_ttl
+        for key in [k for k, (_, _, _, timestamps) in self.cache.items() if np.max(timestamps) < min_timestamp]:
+            del self.cache[key]
+
+    def _slice(self, tile: QuadKey) -> Tuple[int, int]:
+        lo, hi = quadint_range(tile, self.cell_level)
+        return int(np.searchsorted(self.hashes, np.uint64(lo), side='left')), int(np.searchsorted(self.hashes, np.uint64(hi), side='right'))
+
+    def _allocate(self, n: int):
+        self.states: np.ndarray = np.full((N_SOURCES, n), GridCellState.UNKNOWN, dtype=np.uint8)
+        self.confidences: np.ndarray = np.zeros((N_SOURCES, n), dtype=np.float32)
+        self.timestamps: np.ndarray = np.full((N_SOURCES, n), -np.inf, dtype=np.float64)
+        self.fused_states: np.ndarray = np.full(n, GridCellState.UNKNOWN, dtype=np.uint8)
+        self.fused_confidences: np.ndarray = np.zeros(n, dtype=np.float32)
+        self.fused_timestamp: float = 0
+
+    # Indices of the given quadints within the model and a mask of which of them are covered at all
+    def _lookup(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        idx: np.ndarray = np.minimum(np.searchsorted(self.hashes, hashes), max(len(self.hashes) - 1, 0))
+        found: np.ndarray = self.hashes[idx] == hashes if len(self.hashes) > 0 else np.zeros(len(hashes), dtype=np.bool_)
+        return idx, found
@@ -1,11 +1,14 @@
 import logging
-from multiprocessing.pool import ThreadPool
-from threading import Thread, Lock
-from typing import Tuple, Callable, Set
+from threading import Thread
+from typing import Tuple, Callable, Set, Dict, Optional, Hashable, Union
 
 import paho.mqtt.client as mqtt
 
-from common.constants import MQTT_QOS
+from common.constants import MQTT_QOS, MQTT_MAX_IN_FLIGHT, MQTT_PUBLISH_QUEUE_SIZE, MQTT_LOOPBACK_HOST, MQTT_METRICS_INTERVAL_SEC
+from .egress import EgressPublisher
+from .ingress import IngressDispatcher
+from .loopback import LoopbackClient
+from .metrics import BridgeMetrics, MetricsReporter
 
 
 class MqttBridge:
@@ -16,15 +19,32 @@ class MqttBridge:
             client_id: str = '',
             discard_when_busy: bool = False,
             on_connect: Callable = None,
-            on_disconnect: Callable = None
+            on_disconnect: Callable = None,
+            n_workers: int = 1,
+            async_publish: bool = False,
+            max_in_flight: int = MQTT_MAX_IN_FLIGHT,
+            downgrade_superseded: bool = True,
+            metrics_interval: float = MQTT_METRICS_INTERVAL_SEC,
+            on_metrics: Callable = None
     ):
         self.broker_config: Tuple[str, int] = (broker_host, broker_port,)
-        self.client: mqtt.Client = mqtt.Client(client_id=client_id)
+        # Connecting to MQTT_LOOPBACK_HOST uses the in-process broker at the given port instead of the network
+        self.client: Union[mqtt.Client, LoopbackClient] = LoopbackClient(client_id) if broker_host == MQTT_LOOPBACK_HOST else mqtt.Client(client_id=client_id)
         self.discard_when_busy: bool = discard_when_busy
         self.subscriptions: Set[str] = set()
         self.loop_thread: Thread = None
-        self.read_pool: ThreadPool = ThreadPool(processes=1)
-        self.in_lock: Lock = Lock()
+        self.metrics: BridgeMetrics = BridgeMetrics()
+        # If discard_when_busy, only the newest pending message per topic is delivered
+        self.ingress: IngressDispatcher = IngressDispatcher(n_workers=n_workers, conflate=discard_when_busy, name=f'ingress-{client_id}', metrics=self.metrics)
+        # If async_publish, messages are published from a thread of its own and publish() never blocks
+        self.egress: Optional[EgressPublisher] = None
+        if async_publish:
+            self.egress = EgressPublisher(self.client, max_in_flight, MQTT_PUBLISH_QUEUE_SIZE, downgrade_superseded=downgrade_superseded, name=f'egress-{client_id}')
+            self.client.on_publish = self.egress._on_publish
+        # If metrics_interval, a snapshot of the metrics is passed to on_metrics (or logged) that often
+        self.reporter: Optional[MetricsReporter] = None
+        if metrics_interval:
+            self.reporter = MetricsReporter(self.metrics, metrics_interval, callback=on_metrics, name=f'metrics-{client_id or broker_host}')
 
         self.connected: bool = False
         self.cb = {
@@ -49,23 +69,37 @@ class MqttBridge:
         except:
             self.disconnect()
 
-    def subscribe(self, topic: str, callback: Callable):
+    # If pass_topic, the callback is called with the message's actual topic, e.g. in case of wildcards, and its payload
+    def subscribe(self, topic: str, callback: Callable, pass_topic: bool = False):
         if topic not in self.subscriptions:
             self.client.subscribe(topic, qos=MQTT_QOS)
             self.subscriptions.add(topic)
-            self.client.message_callback_add(topic, self.wrap_callback(callback))
+            self.ingress.register(topic, callback, pass_topic=pass_topic)
+            self.client.message_callback_add(topic, self.wrap_callback(topic))
 
     def unsubscribe(self, topic: str, callback: Callable):
         if topic not in self.subscriptions:
             return
         self.subscriptions.remove(topic)
+        self.client.unsubscribe(topic)
         self.client.message_callback_remove(topic)
+        self.ingress.unregister(topic)
 
-    def publish(self, topic: str, message: bytes):
-        self.client.publish(topic, message, qos=MQTT_QOS)
+    def publish(self, topic: str, message: bytes, key: Hashable = None):
+        self.metrics.record_out(topic, len(message))
+        if self.egress:
+            self.egress.put(topic, message, key=key)
+        else:
+            self.client.publish(topic, message, qos=MQTT_QOS)
 
     def disconnect(self):
+        # Pending messages are flushed first, acknowledgements need the connection
+        if self.egress:
+            self.egress.tear_down()
         self.client.disconnect()
+        self.ingress.tear_down()
+        if self.reporter:
+            self.reporter.tear_down()
         self.loop_thread = None
 
         self.connected = False
@@ -84,16 +118,23 @@ class MqttBridge:
         for topic in self.subscriptions:
             client.subscribe(topic, qos=MQTT_QOS)
 
-    def wrap_callback(self, callback: Callable) -> Callable:
-        def cb(client, userdata, msg):
-            with self.in_lock:
-                callback(msg.payload)
+    # Per-topic traffic, drops by reason, queue waits (time between arrival and being handed to the callback) and
+    # callback latencies, see common.bridge.metrics
+    def get_metrics(self) -> Dict[str, Dict]:
+        return self.metrics.get_topic_metrics()
 
-        def on_message(*args):
-            if self.discard_when_busy and self.in_lock.locked():
-                return
+    # Same as get_metrics(), but summed up over all topics, including ones no longer subscribed to
+    def get_totals(self) -> Dict:
+        return self.metrics.get_totals()
 
-            self.read_pool.apply_async(cb, args=args)
+    # Queue and in-flight window usage as well as acknowledgement latencies, if publishing asynchronously
+    def get_publish_metrics(self) -> Dict[str, float]:
+        return self.egress.get_metrics() if self.egress else {}
+
+    # Messages are keyed by subscription, not by their actual topic, which might be matched by a wildcard
+    def wrap_callback(self, subscription: str) -> Callable:
+        def on_message(client, userdata, msg):
+            self.ingress.put(subscription, msg.payload, actual_topic=msg.topic)
 
         return on_message
 
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from typing import Tuple, Callable, Dict, Optional
+
+import paho.mqtt.client as mqtt
+
+from common.constants import MQTT_QOS, MQTT_CONNECT_TIMEOUT, MQTT_RECONNECT_MIN_SEC, MQTT_RECONNECT_MAX_SEC
+
+'''
+    asyncio counterpart to MqttBridge. Instead of running paho's network loop on a separate thread, the client's
+    socket is registered with the event loop (add_reader / add_writer) and periodic housekeeping is scheduled
+    via call_later, following paho's external event loop interface. Message callbacks may be plain functions or
+    coroutine functions, every subscription is consumed by its own task. If the connection is lost, reconnecting is
+    attempted with exponential backoff until it succeeds or disconnect() is called, all topics are subscribed to again
+    once the broker accepted the connection.
+'''
+
+
+class _AsyncSubscription:
+    def __init__(self, callback: Callable, conflate: bool, pass_topic: bool):
+        self.callback: Callable = callback
+        self.conflate: bool = conflate
+        self.pass_topic: bool = pass_topic
+        self.queue: asyncio.Queue = asyncio.Queue()  # Topics with a pending message if conflating, else (topic, payload)
+        self.latest: Dict[str, bytes] = {}  # Pending message per topic, if conflating
+        self.task: Optional[asyncio.Task] = None
+        self.n_dropped: int = 0
+
+
+class AsyncMqttBridge:
+    def __init__(
+            self,
+            loop: asyncio.AbstractEventLoop,
+            broker_host: str = 'localhost',
+            broker_port: int = 1883,
+            client_id: str = '',
+            discard_when_busy: bool = False,
+            reconnect_delay: Tuple[float, float] = (MQTT_RECONNECT_MIN_SEC, MQTT_RECONNECT_MAX_SEC)
+    ):
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.broker_config: Tuple[str, int] = (broker_host, broker_port,)
+        self.client: mqtt.Client = mqtt.Client(client_id=client_id)
+        self.discard_when_busy: bool = discard_when_busy
+        self.subscriptions: Dict[str, _AsyncSubscription] = {}
+        self.connected: bool = False
+        self.reconnect_delay: Tuple[float, float] = reconnect_delay  # Min, max
+        self.n_reconnects: int = 0
+
+        self._closing: bool = False
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._on_connected: Optional[asyncio.Future] = None
+        self._misc_handle: Optional[asyncio.TimerHandle] = None
+        self._fd: int = -1
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # Only the TCP handshake is performed synchronously, waiting for CONNACK does not block the loop
+    async def connect(self, timeout: float = MQTT_CONNECT_TIMEOUT):
+        self._closing = False
+        self._on_connected = self.loop.create_future()
+        self.client.connect(*self.broker_config[:2])
+        await asyncio.wait_for(self._on_connected, timeout)
+
+    # If pass_topic, the callback is called with the message's actual topic, e.g. in case of wildcards, and its payload
+    def subscribe(self, topic: str, callback: Callable, pass_topic: bool = False):
+        if topic in self.subscriptions:
+            return
+
+        sub: _AsyncSubscription = _AsyncSubscription(callback, conflate=self.discard_when_busy, pass_topic=pass_topic)
+        sub.task = self.loop.create_task(self._consume(topic, sub))
+        self.subscriptions[topic] = sub
+
+        self.client.message_callback_add(topic, lambda client, userdata, msg: self._enqueue(sub, msg.topic, msg.payload))
+        if self.connected:
+            self.client.subscribe(topic, qos=MQTT_QOS)
+
+    def unsubscribe(self, topic: str, callback: Callable = None):
+        if topic not in self.subscriptions:
+            return
+
+        self.client.message_callback_remove(topic)
+        if self.connected:
+            self.client.unsubscribe(topic)
+        self.subscriptions.pop(topic).task.cancel()
+
+    def publish(self, topic: str, message: bytes):
+        self.client.publish(topic, message, qos=MQTT_QOS)
+
+    async def disconnect(self):
+        self._closing = True
+        tasks = [s.task for s in self.subscriptions.values()]
+        if self._reconnect_task:
+            tasks.append(self._reconnect_task)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.connected:
+            self.client.disconnect()
+        self.connected = False
+
+        logging.info('Disconnected from broker.')
+
+    def _enqueue(self, sub: _AsyncSubscription, topic: str, payload: bytes):
+        if not sub.conflate:
+            sub.queue.put_nowait((topic, payload))
+            return
+
+        # Drop the older pending message of the same topic in favor of the new one
+        if topic in sub.latest:
+            sub.n_dropped += 1
+        else:
+            sub.queue.put_nowait(topic)
+        sub.latest[topic] = payload
+
+    async def _consume(self, topic: str, sub: _AsyncSubscription):
+        while True:
+            item = await sub.queue.get()
+            actual_topic, payload = (item, sub.latest.pop(item)) if sub.conflate else item
+            try:
+                result = sub.callback(actual_topic, payload) if sub.pass_topic else sub.callback(payload)
+                if asyncio.iscoroutine(result):
+                    await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f'Callback for {topic} failed: {e}')
+
+    def _on_connect(self, client, userdata, flags, rc):
+        logging.info(f'Connected to {self.broker_config} with result code {str(rc)}.')
+
+        self.connected = rc == mqtt.CONNACK_ACCEPTED
+        for topic in self.subscriptions.keys():
+            client.subscribe(topic, qos=MQTT_QOS)
+
+        if self._on_connected and not self._on_connected.done():
+            if self.connected:
+                self._on_connected.set_result(rc)
+            else:
+                self._on_connected.set_exception(ConnectionRefusedError(mqtt.connack_string(rc)))
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+
+        # Non-zero if not caused by disconnect()
+        if rc != mqtt.MQTT_ERR_SUCCESS and not self._closing and not self._reconnect_task:
+            logging.warning(f'Lost connection to {self.broker_config} with result code {str(rc)}, reconnecting.')
+            self._reconnect_task = self.loop.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay, max_delay = self.reconnect_delay
+        try:
+            while not self._closing:
+                await asyncio.sleep(delay)
+                try:
+                    self.client.reconnect()  # Subscriptions are renewed by _on_connect
+                    self.n_reconnects += 1
+                    return
+                except OSError as e:
+                    logging.warning(f'Failed to reconnect to {self.broker_config}: {e}')
+                    delay = min(delay * 2, max_delay)
+        finally:
+            self._reconnect_task = None
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._fd = sock.fileno()
+        self.loop.add_reader(self._fd, client.loop_read)
+        self._misc_handle = self.loop.call_later(1, self._loop_misc)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(self._fd)
+        self.loop.remove_writer(self._fd)
+        if self._misc_handle:
+            self._misc_handle.cancel()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(self._fd, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(self._fd)
+
+    def _loop_misc(self):
+        if self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            self._misc_handle = self.loop.call_later(1, self._loop_misc)
@@ -0,0 +1,161 @@
+import logging
+import time
+from collections import deque
+from threading import Thread, Condition
+from typing import Deque, Dict, Set, Tuple, Hashable
+
+import paho.mqtt.client as mqtt
+
+from common.constants import MQTT_QOS, MQTT_DRAIN_TIMEOUT_SEC
+
+'''
+    Publishes messages from a thread of its own, so that producers never block on the network. Outgoing messages
+    are buffered in a bounded queue (the oldest one is dropped on overflow) and at most max_in_flight QoS 1
+    messages may be waiting for their acknowledgement at any time. Optionally, messages that are already
+    superseded by a newer one for the same topic (and key, if given) by the time they are sent, are sent with QoS 0
+    instead and do not count towards that window. On tear down, queued messages are still sent and their
+    acknowledgements awaited for a limited time, whatever is left after that is counted as dropped.
+'''
+
+_Outgoing = Tuple[str, bytes, float, Hashable]  # Topic, payload, time of enqueueing, key
+
+
+class EgressPublisher:
+    def __init__(self, client: mqtt.Client, max_in_flight: int, max_queued: int, downgrade_superseded: bool = True, ack_timeout: float = 5., name: str = 'egress'):
+        self.client: mqtt.Client = client
+        self.max_in_flight: int = max_in_flight
+        self.downgrade_superseded: bool = downgrade_superseded
+        self.ack_timeout: float = ack_timeout
+        self.queue: Deque[_Outgoing] = deque(maxlen=max_queued)
+
+        # Message ids of sent messages, see _on_publish
+        self.in_flight: Dict[int, float] = {}  # QoS 1, mid -> time of sending
+        self.fire_and_forget: Set[int] = set()  # QoS 0
+        self.early_acks: Set[int] = set()  # Acknowledged before publish() even returned
+
+        self.n_published: int = 0
+        self.n_acked: int = 0
+        self.n_dropped: int = 0
+        self.n_downgraded: int = 0
+        self.n_expired: int = 0
+        self.n_failed: int = 0
+        self.ack_latencies: Deque[float] = deque(maxlen=1000)
+
+        self.alive: bool = True
+        self.cond: Condition = Condition()
+        self.thread: Thread = Thread(target=self._loop, daemon=True, name=name)
+        self.thread.start()
+
+    # Messages only supersede others of the same topic and key, e.g. when multiple senders share a topic
+    def put(self, topic: str, payload: bytes, key: Hashable = None):
+        with self.cond:
+            if len(self.queue) == self.queue.maxlen:
+                self.n_dropped += 1
+            self.queue.append((topic, payload, time.monotonic(), key))
+            self.cond.notify_all()
+
+    # E.g. as the number of producers sharing the publisher changes. If shrinking, the oldest messages are dropped.
+    def resize(self, max_in_flight: int, max_queued: int):
+        with self.cond:
+            self.n_dropped += max(0, len(self.queue) - max_queued)
+            self.queue = deque(self.queue, maxlen=max_queued)
+            self.max_in_flight = max_in_flight
+            self.cond.notify_all()
+
+    # Blocks until the queue is drained and all sent messages are acknowledged, but no longer than timeout
+    def tear_down(self, timeout: float = MQTT_DRAIN_TIMEOUT_SEC):
+        with self.cond:
+            if not self.alive:
+                return
+            deadline: float = time.monotonic() + timeout
+            while (self.queue or self.in_flight) and self.thread.is_alive() and time.monotonic() < deadline:
+                self.cond.wait(timeout=deadline - time.monotonic())
+
+            if self.queue:
+                logging.warning(f'Discarding {len(self.queue)} queued messages after {timeout} seconds.')
+            self.n_dropped += len(self.queue)
+            self.queue.clear()
+            self.alive = False
+            self.cond.notify_all()
+
+    def get_metrics(self) -> Dict[str, float]:
+        with self.cond:
+            latencies = list(self.ack_latencies)
+            return {
+                'published': self.n_published,
+                'acked': self.n_acked,
+                'dropped': self.n_dropped,
+                'downgraded': self.n_downgraded,
+                'expired': self.n_expired,
+                'failed': self.n_failed,
+                'queued': len(self.queue),
+                'in_flight': len(self.in_flight),
+                'ack_latency_mean': sum(latencies) / len(latencies) if latencies else 0,
+                'ack_latency_max': max(latencies) if latencies else 0,
+            }
+
+    # Called on paho's network thread
+    def _on_publish(self, client, userdata, mid: int):
+        with self.cond:
+            if mid in self.in_flight:
+                self.ack_latencies.append(time.monotonic() - self.in_flight.pop(mid))
+                self.n_acked += 1
+                self.cond.notify_all()
+            elif mid in self.fire_and_forget:
+                self.fire_and_forget.remove(mid)
+            else:
+                self.early_acks.add(mid)
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while self.alive and not self._can_send():
+                    self.cond.wait(timeout=self.ack_timeout)
+                    self._expire()
+                if not self.alive:
+                    return
+
+                topic, payload, _, key = self.queue.popleft()
+                qos: int = 0 if self.downgrade_superseded and self._superseded(topic, key) else MQTT_QOS
+
+            # Not holding the lock, because paho might invoke _on_publish on this very thread
+            sent_at: float = time.monotonic()
+            info: mqtt.MQTTMessageInfo = self.client.publish(topic, payload, qos=qos)
+
+            with self.cond:
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    logging.debug(f'Failed to publish to {topic}: {mqtt.error_string(info.rc)}')
+                    self.n_failed += 1
+                    self.cond.notify_all()
+                    continue
+
+                self.n_published += 1
+                self.n_downgraded += qos < MQTT_QOS
+
+                if info.mid in self.early_acks:
+                    self.early_acks.remove(info.mid)
+                    if qos > 0:
+                        self.ack_latencies.append(time.monotonic() - sent_at)
+                        self.n_acked += 1
+                elif qos > 0:
+                    self.in_flight[info.mid] = sent_at
+                else:
+                    self.fire_and_forget.add(info.mid)
+                self.cond.notify_all()
+
+    def _can_send(self) -> bool:
+        if len(self.queue) == 0:
+            return False
+        return len(self.in_flight) < self.max_in_flight or (self.downgrade_superseded and self._superseded(self.queue[0][0], self.queue[0][3], skip=1))
+
+    # Whether there is a queued (i.e. newer) message for the given topic and key
+    def _superseded(self, topic: str, key: Hashable = None, skip: int = 0) -> bool:
+        return any(t == topic and k == key for i, (t, _, _, k) in enumerate(self.queue) if i >= skip)
+
+    # Frees up the window in case acknowledgements got lost, e.g. due to a reconnect
+    def _expire(self):
+        now: float = time.monotonic()
+        for mid, sent_at in list(self.in_flight.items()):
+            if now - sent_at > self.ack_timeout:
+                del self.in_flight[mid]
+                self.n_expired += 1
@@ -0,0 +1,120 @@
+import logging
+import time
+from collections import deque
+from threading import Thread, Condition
+from typing import Callable, Dict, Deque, Set, Tuple, Optional
+
+from .metrics import BridgeMetrics, Dropped, DROP_BUSY, DROP_FAILED
+
+'''
+    Dispatches incoming messages to their callbacks on a pool of worker threads. Every subscription has a slot of its
+    own, which, when conflating, only holds the newest pending message per topic, so that a burst on one topic can
+    neither starve nor drop messages of any other. Messages of the same subscription are always handled one after
+    another. Subscriptions with wildcards can have the actual topic passed to their callback.
+    Traffic, drops and timings are recorded per subscription, see common.bridge.metrics.
+'''
+
+_Pending = Tuple[str, bytes, float]  # Topic, payload, time of arrival
+
+
+class _TopicSlot:
+    def __init__(self, callback: Callable, conflate: bool, pass_topic: bool):
+        self.callback: Callable = callback
+        self.conflate: bool = conflate
+        self.pass_topic: bool = pass_topic
+        self.pending: Deque[_Pending] = deque()
+
+    # Returns whether a pending message got superseded
+    def append(self, topic: str, payload: bytes) -> bool:
+        superseded: bool = False
+        if self.conflate:
+            for i, p in enumerate(self.pending):
+                if p[0] == topic:
+                    del self.pending[i]
+                    superseded = True
+                    break
+        self.pending.append((topic, payload, time.monotonic()))
+        return superseded
+
+
+class IngressDispatcher:
+    def __init__(self, n_workers: int = 1, conflate: bool = True, name: str = 'ingress', metrics: BridgeMetrics = None):
+        self.conflate: bool = conflate
+        self.metrics: BridgeMetrics = metrics if metrics is not None else BridgeMetrics()
+        self.slots: Dict[str, _TopicSlot] = {}
+        self.ready: Deque[str] = deque()  # Topics with pending messages that no worker is handling
+        self.busy: Set[str] = set()  # Topics currently being handled by a worker
+
+        self.alive: bool = True
+        self.cond: Condition = Condition()
+        self.workers = [Thread(target=self._work, daemon=True, name=f'{name}-{i}') for i in range(n_workers)]
+        for w in self.workers:
+            w.start()
+
+    # Callbacks are called with the payload only, or with topic and payload if pass_topic
+    def register(self, topic: str, callback: Callable, pass_topic: bool = False):
+        with self.cond:
+            self.slots[topic] = _TopicSlot(callback, self.conflate, pass_topic)
+
+    def unregister(self, topic: str):
+        with self.cond:
+            self.slots.pop(topic, None)
+        self.metrics.retire(topic)
+
+    # The message's actual topic might differ from the one it is registered for, if the latter contains wildcards
+    def put(self, topic: str, payload: bytes, actual_topic: str = None):
+        with self.cond:
+            slot: Optional[_TopicSlot] = self.slots.get(topic)
+            if not slot:
+                return
+
+            self.metrics.record_in(topic, len(payload))
+            had_pending: bool = len(slot.pending) > 0
+            if slot.append(actual_topic or topic, payload):
+                self.metrics.record_drop(topic, DROP_BUSY)
+
+            if not had_pending and topic not in self.busy:
+                self.ready.append(topic)
+                self.cond.notify()
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        return self.metrics.get_topic_metrics()
+
+    def tear_down(self):
+        with self.cond:
+            self.alive = False
+            self.cond.notify_all()
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while self.alive and len(self.ready) == 0:
+                    self.cond.wait()
+                if not self.alive:
+                    return
+
+                topic: str = self.ready.popleft()
+                slot: Optional[_TopicSlot] = self.slots.get(topic)
+                if not slot or len(slot.pending) == 0:
+                    continue
+
+                actual_topic, payload, arrived = slot.pending.popleft()
+                self.busy.add(topic)
+
+            started: float = time.monotonic()
+            try:
+                result = slot.callback(actual_topic, payload) if slot.pass_topic else slot.callback(payload)
+                if isinstance(result, Dropped):
+                    self.metrics.record_drop(topic, result.reason)
+            except Exception as e:
+                logging.warning(f'Callback for {topic} failed: {e}')
+                self.metrics.record_drop(topic, DROP_FAILED)
+            self.metrics.record_delivery(topic, started - arrived, time.monotonic() - started)
+
+            with self.cond:
+                self.busy.discard(topic)
+
+                # Messages that came in meanwhile
+                if len(slot.pending) > 0 and self.slots.get(topic) is slot:
+                    self.ready.append(topic)
+                    self.cond.notify()
@@ -0,0 +1,228 @@
+import heapq
+import itertools
+import logging
+import time
+from threading import Thread, Condition, Event, Lock
+from typing import Dict, List, Tuple, Callable, Optional
+
+import paho.mqtt.client as mqtt
+
+'''
+    In-process stand-in for an MQTT broker and paho's client, for tests and benchmarks on a single machine.
+    LoopbackClient implements the part of paho's client interface MqttBridge relies on (connect / loop_forever /
+    disconnect, (un-)subscribe with topic filters, per-filter message callbacks, publish returning message info and
+    the on_connect / on_publish / on_message / on_disconnect callbacks), so it can be used as MqttBridge's transport.
+
+    Brokers are registered by port. A broker models a single shared link: every message occupies it for
+    len(payload) / bandwidth seconds and is delivered to all matching subscriptions latency seconds after having
+    passed it. QoS 1 messages are acknowledged (on_publish) upon delivery and never dropped, QoS 0 ones are
+    acknowledged right away and dropped if more than max_queued messages are in transit, in which case publish()
+    returns MQTT_ERR_QUEUE_SIZE.
+    Callbacks are invoked on the broker's delivery thread, in order of publishing.
+'''
+
+
+class LoopbackMessage:
+    def __init__(self, topic: str, payload: bytes, qos: int, mid: int):
+        self.topic: str = topic
+        self.payload: bytes = payload
+        self.qos: int = qos
+        self.mid: int = mid
+        self.retain: bool = False
+
+
+class LoopbackMessageInfo:
+    def __init__(self, mid: int, rc: int = mqtt.MQTT_ERR_SUCCESS):
+        self.mid: int = mid
+        self.rc: int = rc
+
+
+_Delivery = Tuple[float, int, 'LoopbackClient', LoopbackMessage]  # Due time, sequence number, sender, message
+
+
+class LoopbackBroker:
+    def __init__(self, latency: float = 0, bandwidth: float = None, max_queued: int = 10000):
+        self.latency: float = latency
+        self.bandwidth: Optional[float] = bandwidth  # Bytes per second, unlimited if None
+        self.max_queued: int = max_queued
+
+        self.clients: List[LoopbackClient] = []
+        self.pending: List[_Delivery] = []
+        self.n_delivering: int = 0
+        self.link_free_at: float = 0
+        self.seq = itertools.count()
+
+        self.n_published: int = 0
+        self.n_delivered: int = 0
+        self.n_dropped: int = 0
+        self.n_bytes: int = 0
+
+        self.alive: bool = True
+        self.cond: Condition = Condition()
+        self.thread: Thread = Thread(target=self._deliver_loop, daemon=True, name='loopback-broker')
+        self.thread.start()
+
+    def attach(self, client: 'LoopbackClient'):
+        with self.cond:
+            if client not in self.clients:
+                self.clients.append(client)
+
+    def detach(self, client: 'LoopbackClient'):
+        with self.cond:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    # Returns whether the message was accepted
+    def publish(self, sender: 'LoopbackClient', msg: LoopbackMessage) -> bool:
+        with self.cond:
+            if msg.qos == 0 and len(self.pending) >= self.max_queued:
+                self.n_dropped += 1
+                return False
+
+            now: float = time.monotonic()
+            transmission: float = len(msg.payload) / self.bandwidth if self.bandwidth else 0
+            self.link_free_at = max(now, self.link_free_at) + transmission
+
+            heapq.heappush(self.pending, (self.link_free_at + self.latency, next(self.seq), sender, msg))
+            self.n_published += 1
+            self.n_bytes += len(msg.payload)
+            self.cond.notify()
+            return True
+
+    # Blocks until all messages published so far are delivered, returns whether that happened within the timeout
+    def drain(self, timeout: float = None) -> bool:
+        with self.cond:
+            return self.cond.wait_for(lambda: len(self.pending) == 0 and self.n_delivering == 0, timeout=timeout)
+
+    def tear_down(self):
+        with self.cond:
+            self.alive = False
+            self.cond.notify_all()
+
+    def _deliver_loop(self):
+        while True:
+            with self.cond:
+                while self.alive and (len(self.pending) == 0 or self.pending[0][0] > time.monotonic()):
+                    self.cond.wait(timeout=max(0., self.pending[0][0] - time.monotonic()) if self.pending else None)
+                if not self.alive:
+                    return
+
+                _, _, sender, msg = heapq.heappop(self.pending)
+                receivers: List[LoopbackClient] = list(self.clients)
+                self.n_delivering += 1
+
+            for client in receivers:
+                client._deliver(msg)
+            if msg.qos > 0:
+                sender._acknowledge(msg.mid)
+
+            with self.cond:
+                self.n_delivering -= 1
+                self.n_delivered += 1
+                self.cond.notify_all()
+
+
+_brokers: Dict[int, LoopbackBroker] = {}
+_brokers_lock: Lock = Lock()
+
+
+# Broker listening on the given (pseudo-)port, created on first use
+def get_broker(port: int = 1883) -> LoopbackBroker:
+    with _brokers_lock:
+        if port not in _brokers:
+            _brokers[port] = LoopbackBroker()
+        return _brokers[port]
+
+
+def set_broker(port: int, broker: LoopbackBroker):
+    with _brokers_lock:
+        _brokers[port] = broker
+
+
+class LoopbackClient:
+    def __init__(self, client_id: str = '', broker: LoopbackBroker = None):
+        self.client_id: str = client_id
+        self.broker: Optional[LoopbackBroker] = broker
+        self.subscriptions: Dict[str, int] = {}  # Topic filter -> QoS
+        self.callbacks: Dict[str, Callable] = {}  # Topic filter -> message callback
+        self.mids = itertools.count(1)
+        self.lock: Lock = Lock()
+        self.disconnected: Event = Event()
+        self.userdata = None
+
+        self.on_connect: Optional[Callable] = None
+        self.on_disconnect: Optional[Callable] = None
+        self.on_message: Optional[Callable] = None
+        self.on_publish: Optional[Callable] = None
+
+    def connect(self, host: str = None, port: int = 1883, keepalive: int = 60) -> int:
+        if not self.broker:
+            self.broker = get_broker(port)
+        self.disconnected.clear()
+        self.broker.attach(self)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    # Unlike paho's, there is no network loop to run, so this only reports the connection and waits for its end
+    def loop_forever(self, *args, **kwargs) -> int:
+        if self.on_connect:
+            self.on_connect(self, self.userdata, {'session present': 0}, mqtt.CONNACK_ACCEPTED)
+        self.disconnected.wait()
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def disconnect(self) -> int:
+        if self.broker:
+            self.broker.detach(self)
+        self.disconnected.set()
+        if self.on_disconnect:
+            self.on_disconnect(self, self.userdata, mqtt.MQTT_ERR_SUCCESS)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic: str, qos: int = 0) -> Tuple[int, int]:
+        with self.lock:
+            self.subscriptions[topic] = qos
+        return mqtt.MQTT_ERR_SUCCESS, next(self.mids)
+
+    def unsubscribe(self, topic: str) -> Tuple[int, int]:
+        with self.lock:
+            self.subscriptions.pop(topic, None)
+        return mqtt.MQTT_ERR_SUCCESS, next(self.mids)
+
+    def message_callback_add(self, sub: str, callback: Callable):
+        with self.lock:
+            self.callbacks[sub] = callback
+
+    def message_callback_remove(self, sub: str):
+        with self.lock:
+            self.callbacks.pop(sub, None)
+
+    def publish(self, topic: str, payload: bytes = None, qos: int = 0, retain: bool = False) -> LoopbackMessageInfo:
+        mid: int = next(self.mids)
+        if not self.broker or self.disconnected.is_set():
+            return LoopbackMessageInfo(mid, mqtt.MQTT_ERR_NO_CONN)
+
+        # Same as paho's client with a full outgoing queue, a dropped message is reported as such and never acknowledged
+        if not self.broker.publish(self, LoopbackMessage(topic, payload if payload is not None else b'', qos, mid)):
+            return LoopbackMessageInfo(mid, mqtt.MQTT_ERR_QUEUE_SIZE)
+        if qos == 0:
+            self._acknowledge(mid)
+        return LoopbackMessageInfo(mid)
+
+    # Same as paho, a message is passed to the callbacks of all matching filters, or to on_message if there are none
+    def _deliver(self, msg: LoopbackMessage):
+        with self.lock:
+            if not any(mqtt.topic_matches_sub(sub, msg.topic) for sub in self.subscriptions):
+                return
+            callbacks: List[Callable] = [cb for sub, cb in self.callbacks.items() if mqtt.topic_matches_sub(sub, msg.topic)]
+
+        if not callbacks and self.on_message:
+            callbacks = [self.on_message]
+
+        for cb in callbacks:
+            try:
+                cb(self, self.userdata, msg)
+            except Exception as e:
+                logging.warning(f'Loopback callback for {msg.topic} failed: {e}')
+
+    def _acknowledge(self, mid: int):
+        if self.on_publish:
+            self.on_publish(self, self.userdata, mid)
@@ -0,0 +1,173 @@
+import logging
+import time
+from threading import Lock, Thread, Event
+from typing import Dict, Callable, Optional
+
+from common.timing.histogram import LogHistogram
+
+'''
+    Traffic counters of a bridge, per topic and in total: messages and bytes in and out, drops by reason as well as
+    histograms of the time messages wait for a worker and of the time their callbacks take. Recording is a handful of
+    increments under a lock, so it happens for every message. Metrics of topics that are unsubscribed from are folded
+    into a common remainder, so totals survive (un-)subscribing and memory stays bounded.
+    Subscriber callbacks can have a message counted as dropped, e.g. if it turns out to be outdated, by returning
+    Dropped(reason).
+'''
+
+DROP_BUSY = 'busy'  # Superseded by a newer message before any worker got to it
+DROP_DECODE = 'decode_error'
+DROP_STALE = 'stale'  # Not newer than what the subscriber already has
+DROP_UNWANTED = 'unwanted'  # Matched by a wildcard, but of no interest to the subscriber
+DROP_FAILED = 'failed'  # The callback raised
+
+
+class Dropped:
+    def __init__(self, reason: str):
+        self.reason: str = reason
+
+
+class TopicMetrics:
+    def __init__(self):
+        self.n_in: int = 0
+        self.bytes_in: int = 0
+        self.n_delivered: int = 0
+        self.n_out: int = 0
+        self.bytes_out: int = 0
+        self.drops: Dict[str, int] = {}
+        self.queue_wait: LogHistogram = LogHistogram()
+        self.callback_latency: LogHistogram = LogHistogram()
+
+    @property
+    def n_dropped(self) -> int:
+        return sum(self.drops.values())
+
+    def merge(self, other: 'TopicMetrics'):
+        self.n_in += other.n_in
+        self.bytes_in += other.bytes_in
+        self.n_delivered += other.n_delivered
+        self.n_out += other.n_out
+        self.bytes_out += other.bytes_out
+        for reason, n in other.drops.items():
+            self.drops[reason] = self.drops.get(reason, 0) + n
+        self.queue_wait.merge(other.queue_wait)
+        self.callback_latency.merge(other.callback_latency)
+
+    def to_dict(self) -> Dict:
+        return {
+            'received': self.n_in,
+            'bytes_in': self.bytes_in,
+            'delivered': self.n_delivered,
+            'published': self.n_out,
+            'bytes_out': self.bytes_out,
+            'dropped': self.n_dropped,
+            'drops': dict(self.drops),
+            'queue_wait': self.queue_wait.to_dict(),
+            'callback_latency': self.callback_latency.to_dict(),
+        }
+
+
+class BridgeMetrics:
+    def __init__(self):
+        self.topics: Dict[str, TopicMetrics] = {}
+        self.retired: TopicMetrics = TopicMetrics()
+        self.since: float = time.time()
+        self.lock: Lock = Lock()
+
+    def record_in(self, topic: str, n_bytes: int):
+        with self.lock:
+            m: TopicMetrics = self._get(topic)
+            m.n_in += 1
+            m.bytes_in += n_bytes
+
+    def record_out(self, topic: str, n_bytes: int):
+        with self.lock:
+            m: TopicMetrics = self._get(topic)
+            m.n_out += 1
+            m.bytes_out += n_bytes
+
+    def record_drop(self, topic: str, reason: str):
+        with self.lock:
+            drops: Dict[str, int] = self._get(topic).drops
+            drops[reason] = drops.get(reason, 0) + 1
+
+    def record_delivery(self, topic: str, queue_wait: float, callback_latency: float):
+        with self.lock:
+            m: TopicMetrics = self._get(topic)
+            m.n_delivered += 1
+            m.queue_wait.record(queue_wait)
+            m.callback_latency.record(callback_latency)
+
+    # Keeps the topic's counts in the totals only
+    def retire(self, topic: str):
+        with self.lock:
+            m: Optional[TopicMetrics] = self.topics.pop(topic, None)
+            if m:
+                self.retired.merge(m)
+
+    def get_topic_metrics(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {topic: m.to_dict() for topic, m in self.topics.items()}
+
+    def get_totals(self) -> Dict:
+        with self.lock:
+            totals: TopicMetrics = TopicMetrics()
+            totals.merge(self.retired)
+            for m in self.topics.values():
+                totals.merge(m)
+
+        d: Dict = totals.to_dict()
+        elapsed: float = max(time.time() - self.since, 1e-9)
+        d['rate_in'] = totals.n_in / elapsed
+        d['rate_out'] = totals.n_out / elapsed
+        return d
+
+    # Totals and per-topic metrics, optionally starting over afterwards, e.g. for metrics per reporting interval
+    def snapshot(self, reset: bool = False) -> Dict:
+        snapshot: Dict = {'timestamp': time.time(), 'total': self.get_totals(), 'topics': self.get_topic_metrics()}
+        if reset:
+            with self.lock:
+                self.topics.clear()
+                self.retired = TopicMetrics()
+                self.since = time.time()
+        return snapshot
+
+    def _get(self, topic: str) -> TopicMetrics:
+        if topic not in self.topics:
+            self.topics[topic] = TopicMetrics()
+        return self.topics[topic]
+
+
+# Periodically passes a snapshot (see BridgeMetrics.snapshot) to a callback, or logs the totals if none is given
+class MetricsReporter:
+    def __init__(self, metrics: BridgeMetrics, interval: float, callback: Callable = None, reset: bool = False, name: str = 'metrics'):
+        self.metrics: BridgeMetrics = metrics
+        self.interval: float = interval
+        self.callback: Optional[Callable] = callback
+        self.reset: bool = reset
+        self.name: str = name
+        self.stopped: Event = Event()
+        self.thread: Thread = Thread(target=self._loop, daemon=True, name=name)
+        self.thread.start()
+
+    def tear_down(self):
+        self.stopped.set()
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            snapshot: Dict = self.metrics.snapshot(reset=self.reset)
+            try:
+                if self.callback:
+                    self.callback(snapshot)
+                else:
+                    self._log(snapshot['total'])
+            except Exception as e:
+                logging.warning(f'Failed to report metrics of {self.name}: {e}')
+
+    def _log(self, totals: Dict):
+        wait: Dict[str, float] = totals['queue_wait']
+        logging.info(
+            f'[{self.name}] in: {totals["received"]} msgs / {totals["bytes_in"]} bytes ({totals["rate_in"]:.1f} / sec), '
+            f'out: {totals["published"]} msgs / {totals["bytes_out"]} bytes ({totals["rate_out"]:.1f} / sec), '
+            f'dropped: {totals["drops"]}, queue wait p50 / p99 / max: '
+            f'{wait["p50"] * 1000:.2f} / {wait["p99"] * 1000:.2f} / {wait["max"] * 1000:.2f} ms'
+        )
@@ -0,0 +1,180 @@
+import logging
+from threading import Lock
+from typing import Tuple, Callable, Dict, Optional
+
+from common.constants import MQTT_INGRESS_WORKERS, MQTT_MAX_IN_FLIGHT, MQTT_PUBLISH_QUEUE_SIZE
+from . import MqttBridge
+from .metrics import Dropped
+
+'''
+    Process-wide pool of broker connections. All leases for the same broker address share a single MqttBridge, i.e.
+    one socket, network loop, ingress pool and egress thread, no matter how many clients (e.g. egos hosted by the same
+    process) or node tiles resolve to it. Subscriptions are reference counted per topic and incoming messages are
+    fanned out to the callbacks of all leases subscribed to the topic. A message only counts as dropped if all of them
+    dropped it. The connection is closed once its last lease is released. The publish queue and window grow and shrink
+    with the number of leases, so that every lease has as much room for bursts as an exclusive bridge would have.
+    A lease offers the same interface as an MqttBridge, so it can be used as a drop-in replacement.
+'''
+
+_Address = Tuple[str, int]
+
+
+class _SharedBridge:
+    def __init__(self, bridge: MqttBridge):
+        self.bridge: MqttBridge = bridge
+        self.n_leases: int = 0
+        self.listening: bool = False
+        self.connect_lock: Lock = Lock()  # Connecting blocks, only leases of the same connection wait for it
+        self.callbacks: Dict[str, Dict[int, Tuple[Callable, bool]]] = {}  # Topic -> lease id -> callback, pass_topic
+        self.lock: Lock = Lock()
+
+    def subscribe(self, lease_id: int, topic: str, callback: Callable, pass_topic: bool = False):
+        with self.lock:
+            if topic not in self.callbacks:
+                self.callbacks[topic] = {}
+                self.bridge.subscribe(topic, lambda actual_topic, msg: self._fan_out(topic, actual_topic, msg), pass_topic=True)
+            self.callbacks[topic][lease_id] = (callback, pass_topic)
+
+    def unsubscribe(self, lease_id: int, topic: str):
+        with self.lock:
+            subscribers: Optional[Dict[int, Tuple[Callable, bool]]] = self.callbacks.get(topic)
+            if subscribers is None or subscribers.pop(lease_id, None) is None:
+                return
+            if len(subscribers) == 0:
+                del self.callbacks[topic]
+                self.bridge.unsubscribe(topic, None)
+
+    def resize_egress(self):
+        if self.bridge.egress and self.n_leases > 0:
+            self.bridge.egress.resize(MQTT_MAX_IN_FLIGHT * self.n_leases, MQTT_PUBLISH_QUEUE_SIZE * self.n_leases)
+
+    def _fan_out(self, topic: str, actual_topic: str, msg: bytes) -> Optional[Dropped]:
+        with self.lock:
+            callbacks = list(self.callbacks.get(topic, {}).values())
+
+        dropped: Optional[Dropped] = None
+        n_dropped: int = 0
+        for cb, pass_topic in callbacks:
+            try:
+                result = cb(actual_topic, msg) if pass_topic else cb(msg)
+            except Exception as e:
+                logging.warning(f'Callback for {topic} failed: {e}')
+                continue
+            if isinstance(result, Dropped):
+                dropped = dropped or result
+                n_dropped += 1
+
+        return dropped if callbacks and n_dropped == len(callbacks) else None
+
+
+class BridgeLease:
+    def __init__(self, pool: 'BridgePool', address: _Address, shared: _SharedBridge, lease_id: int):
+        self.pool: BridgePool = pool
+        self.address: _Address = address
+        self.shared: _SharedBridge = shared
+        self.lease_id: int = lease_id
+        self.topics: Dict[str, Callable] = {}
+        self.released: bool = False
+
+    @property
+    def broker_config(self) -> _Address:
+        return self.address
+
+    @property
+    def connected(self) -> bool:
+        return self.shared.bridge.connected
+
+    # Connects the shared bridge, unless another lease did so before
+    def listen(self, block=False):
+        try:
+            self.pool._listen(self.shared)
+        except:
+            self.disconnect()
+            raise
+
+    def subscribe(self, topic: str, callback: Callable, pass_topic: bool = False):
+        if topic not in self.topics:
+            self.topics[topic] = callback
+            self.shared.subscribe(self.lease_id, topic, callback, pass_topic=pass_topic)
+
+    def unsubscribe(self, topic: str, callback: Callable = None):
+        if self.topics.pop(topic, None) is not None:
+            self.shared.unsubscribe(self.lease_id, topic)
+
+    # Leases publishing to the same topic do not supersede each other's messages
+    def publish(self, topic: str, message: bytes):
+        self.shared.bridge.publish(topic, message, key=self.lease_id)
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        return {topic: m for topic, m in self.shared.bridge.get_metrics().items() if topic in self.topics}
+
+    # Totals of the shared connection, i.e. including other leases' traffic
+    def get_totals(self) -> Dict:
+        return self.shared.bridge.get_totals()
+
+    def get_publish_metrics(self) -> Dict[str, float]:
+        return self.shared.bridge.get_publish_metrics()
+
+    # Releases the lease, the shared connection is only closed along with the last one
+    def disconnect(self):
+        if self.released:
+            return
+        for topic in list(self.topics.keys()):
+            self.unsubscribe(topic)
+        self.released = True
+        self.pool._release(self)
+
+
+class BridgePool:
+    def __init__(self, n_workers: int = MQTT_INGRESS_WORKERS, async_publish: bool = True):
+        self.n_workers: int = n_workers
+        self.async_publish: bool = async_publish
+        self.bridges: Dict[_Address, _SharedBridge] = {}
+        self.next_lease_id: int = 0
+        self.lock: Lock = Lock()
+
+    def acquire(self, broker_host: str = 'localhost', broker_port: int = 1883) -> BridgeLease:
+        address: _Address = (broker_host, broker_port)
+
+        with self.lock:
+            if address not in self.bridges:
+                logging.debug(f'Opening pooled connection to {address}')
+                self.bridges[address] = _SharedBridge(MqttBridge(
+                    broker_host,
+                    broker_port,
+                    discard_when_busy=True,
+                    n_workers=self.n_workers,
+                    async_publish=self.async_publish
+                ))
+
+            shared: _SharedBridge = self.bridges[address]
+            shared.n_leases += 1
+            shared.resize_egress()
+            self.next_lease_id += 1
+            return BridgeLease(self, address, shared, self.next_lease_id)
+
+    # Number of leases per open connection
+    def get_usage(self) -> Dict[_Address, int]:
+        with self.lock:
+            return {address: shared.n_leases for address, shared in self.bridges.items()}
+
+    def _listen(self, shared: _SharedBridge):
+        with shared.connect_lock:
+            if not shared.listening:
+                shared.bridge.listen(block=False)
+                shared.listening = True
+
+    def _release(self, lease: BridgeLease):
+        with self.lock:
+            lease.shared.n_leases -= 1
+            if lease.shared.n_leases > 0:
+                lease.shared.resize_egress()
+                return
+            if self.bridges.get(lease.address) is lease.shared:
+                del self.bridges[lease.address]
+
+        logging.debug(f'Closing pooled connection to {lease.address}')
+        lease.shared.bridge.disconnect()
+
+
+shared_pool: BridgePool = BridgePool()
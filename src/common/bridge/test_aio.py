@@ -0,0 +1,67 @@
+import asyncio
+from typing import List
+
+import paho.mqtt.client as mqtt
+
+from common.bridge.aio import AsyncMqttBridge
+
+
+class _FlakyClient:
+    # Stands in for paho's client, refusing the first n_failures attempts to reconnect
+    def __init__(self, n_failures: int):
+        self.n_failures: int = n_failures
+        self.n_attempts: int = 0
+        self.subscribed: List[str] = []
+        self.bridge: AsyncMqttBridge = None
+
+    def reconnect(self):
+        self.n_attempts += 1
+        if self.n_attempts <= self.n_failures:
+            raise ConnectionRefusedError('broker unavailable')
+        self.bridge._on_connect(self, None, {}, mqtt.CONNACK_ACCEPTED)
+
+    def subscribe(self, topic: str, qos: int = 0):
+        self.subscribed.append(topic)
+
+    def message_callback_add(self, topic: str, callback):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+def test_reconnect():
+    async def run():
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        bridge: AsyncMqttBridge = AsyncMqttBridge(loop, reconnect_delay=(.01, .02))
+        client: _FlakyClient = _FlakyClient(n_failures=2)
+        client.bridge = bridge
+        bridge.client = client
+
+        bridge._on_connect(client, None, {}, mqtt.CONNACK_ACCEPTED)
+        bridge.subscribe('/graph_fused_out/+', lambda msg: None)
+        assert bridge.connected and client.subscribed == ['/graph_fused_out/+']
+
+        # Connection lost unexpectedly
+        bridge._on_disconnect(client, None, mqtt.MQTT_ERR_CONN_LOST)
+        assert not bridge.connected
+        for _ in range(100):
+            if bridge.connected:
+                break
+            await asyncio.sleep(.01)
+
+        assert bridge.connected
+        assert client.n_attempts == 3 and bridge.n_reconnects == 1
+        assert client.subscribed == ['/graph_fused_out/+'] * 2
+
+        # No attempts to reconnect after disconnecting on purpose
+        await bridge.disconnect()
+        bridge._on_disconnect(client, None, mqtt.MQTT_ERR_SUCCESS)
+        await asyncio.sleep(.05)
+        assert client.n_attempts == 3 and not bridge.connected
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_reconnect()
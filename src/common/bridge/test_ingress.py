@@ -0,0 +1,94 @@
+import time
+from threading import Event
+from typing import List, Tuple
+
+from common.bridge.ingress import IngressDispatcher
+from common.bridge.metrics import DROP_BUSY
+
+
+def _wait_for(condition, timeout: float = 2.) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.005)
+    return True
+
+
+def test_burst_does_not_starve():
+    dispatcher: IngressDispatcher = IngressDispatcher(n_workers=2)
+    started, release = Event(), Event()
+    burst: List[bytes] = []
+    other: List[bytes] = []
+
+    def slow(msg: bytes):
+        started.set()
+        release.wait()
+        burst.append(msg)
+
+    dispatcher.register('/burst', slow)
+    dispatcher.register('/other', other.append)
+
+    # While the first message of the burst is being handled, all but the newest of the following are superseded ...
+    dispatcher.put('/burst', bytes([0]))
+    assert started.wait(timeout=2.)
+    for i in range(1, 101):
+        dispatcher.put('/burst', bytes([i]))
+
+    # ... and other topics are delivered meanwhile
+    dispatcher.put('/other', b'x')
+    assert _wait_for(lambda: other == [b'x'])
+    assert burst == []
+
+    release.set()
+    assert _wait_for(lambda: len(burst) == 2)
+    assert burst == [bytes([0]), bytes([100])]
+
+    metrics = dispatcher.get_metrics()
+    assert metrics['/burst']['received'] == 101 and metrics['/burst']['drops'] == {DROP_BUSY: 99}
+    assert metrics['/other']['received'] == 1 and metrics['/other']['drops'] == {}
+
+    dispatcher.tear_down()
+
+
+def test_conflate_per_topic():
+    dispatcher: IngressDispatcher = IngressDispatcher(n_workers=1)
+    started, release = Event(), Event()
+    received: List[Tuple[str, bytes]] = []
+
+    def slow(topic: str, msg: bytes):
+        started.set()
+        release.wait()
+        received.append((topic, msg))
+
+    # Topics matched by the same wildcard only supersede their own messages
+    dispatcher.register('/w/+', slow, pass_topic=True)
+    dispatcher.put('/w/+', b'a0', actual_topic='/w/a')
+    assert started.wait(timeout=2.)
+    for msg, topic in [(b'a1', '/w/a'), (b'b1', '/w/b'), (b'a2', '/w/a')]:
+        dispatcher.put('/w/+', msg, actual_topic=topic)
+
+    release.set()
+    assert _wait_for(lambda: len(received) == 3)
+    assert received == [('/w/a', b'a0'), ('/w/b', b'b1'), ('/w/a', b'a2')]
+    assert dispatcher.get_metrics()['/w/+']['drops'] == {DROP_BUSY: 1}
+    dispatcher.tear_down()
+
+    # Nothing is superseded without conflation
+    dispatcher = IngressDispatcher(n_workers=1, conflate=False)
+    received.clear()
+    started.clear()
+    release.clear()
+    dispatcher.register('/w/+', slow, pass_topic=True)
+    dispatcher.put('/w/+', b'a0', actual_topic='/w/a')
+    assert started.wait(timeout=2.)
+    dispatcher.put('/w/+', b'a1', actual_topic='/w/a')
+    release.set()
+    assert _wait_for(lambda: len(received) == 2)
+    assert dispatcher.get_metrics()['/w/+']['drops'] == {}
+    dispatcher.tear_down()
+
+
+if __name__ == '__main__':
+    test_burst_does_not_starve()
+    test_conflate_per_topic()
@@ -0,0 +1,157 @@
+import time
+from threading import Event
+from typing import List, Tuple
+
+import paho.mqtt.client as mqtt
+
+from common.bridge import MqttBridge
+from common.bridge.loopback import LoopbackBroker, LoopbackClient, set_broker
+from common.bridge.metrics import Dropped, DROP_STALE
+from common.constants import MQTT_LOOPBACK_HOST
+
+
+def _wait_for(condition, timeout: float = 2.) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.005)
+    return True
+
+
+def test_bridge_over_loopback():
+    broker: LoopbackBroker = LoopbackBroker(latency=.01)
+    set_broker(50001, broker)
+
+    received: List[Tuple[str, bytes]] = []
+    done: Event = Event()
+
+    sub: MqttBridge = MqttBridge(MQTT_LOOPBACK_HOST, 50001, client_id='sub')
+    pub: MqttBridge = MqttBridge(MQTT_LOOPBACK_HOST, 50001, client_id='pub', async_publish=True)
+    sub.listen(block=False)
+    pub.listen(block=False)
+    assert _wait_for(lambda: sub.connected and pub.connected)
+
+    sub.subscribe('/graph_fused_out/+', lambda msg: (received.append(('wildcard', msg)), done.set()))
+    sub.subscribe('/other', lambda msg: received.append(('other', msg)))
+
+    pub.publish('/graph_fused_out/1202', b'scene')
+    pub.publish('/unrelated', b'nothing')
+
+    assert done.wait(timeout=2.)
+    assert broker.drain(timeout=2.)
+    assert received == [('wildcard', b'scene')]
+    assert _wait_for(lambda: pub.get_publish_metrics()['acked'] >= 1)
+    assert pub.get_publish_metrics()['ack_latency_max'] >= .01
+
+    pub.disconnect()
+    sub.disconnect()
+    broker.tear_down()
+
+
+def test_bandwidth_limit():
+    broker: LoopbackBroker = LoopbackBroker(bandwidth=1000)
+    arrivals: List[float] = []
+
+    receiver: LoopbackClient = LoopbackClient('receiver', broker=broker)
+    receiver.connect()
+    receiver.subscribe('/t')
+    receiver.on_message = lambda client, userdata, msg: arrivals.append(time.monotonic())
+
+    sender: LoopbackClient = LoopbackClient('sender', broker=broker)
+    sender.connect()
+
+    start: float = time.monotonic()
+    for _ in range(2):
+        assert sender.publish('/t', bytes(100), qos=1).rc == 0
+
+    assert broker.drain(timeout=2.)
+    assert len(arrivals) == 2
+    assert arrivals[1] - start >= .2 - 1e-3  # 200 bytes at 1000 bytes / s
+
+    # Nothing is delivered after disconnecting
+    receiver.disconnect()
+    sender.publish('/t', b'x')
+    assert broker.drain(timeout=2.)
+    assert len(arrivals) == 2
+
+    broker.tear_down()
+
+
+def test_bridge_metrics():
+    broker: LoopbackBroker = LoopbackBroker()
+    set_broker(50002, broker)
+
+    sub: MqttBridge = MqttBridge(MQTT_LOOPBACK_HOST, 50002, client_id='sub')
+    pub: MqttBridge = MqttBridge(MQTT_LOOPBACK_HOST, 50002, client_id='pub')
+    sub.listen(block=False)
+    pub.listen(block=False)
+    assert _wait_for(lambda: sub.connected and pub.connected)
+
+    # Every other message is outdated according to the subscriber
+    n: List[int] = [0]
+    sub.subscribe('/t', lambda msg: (n.__setitem__(0, n[0] + 1), Dropped(DROP_STALE) if n[0] % 2 == 0 else None)[1])
+    for _ in range(4):
+        pub.publish('/t', bytes(10))
+
+    assert broker.drain(timeout=2.)
+    assert _wait_for(lambda: sub.get_metrics()['/t']['delivered'] == 4)
+
+    metrics = sub.get_metrics()['/t']
+    assert metrics['received'] == 4 and metrics['bytes_in'] == 40
+    assert metrics['drops'] == {DROP_STALE: 2}
+    assert metrics['queue_wait']['count'] == 4
+    assert pub.get_totals()['published'] == 4 and pub.get_totals()['bytes_out'] == 40
+
+    # Totals outlive subscriptions
+    sub.unsubscribe('/t', None)
+    assert '/t' not in sub.get_metrics()
+    assert sub.get_totals()['received'] == 4
+
+    pub.disconnect()
+    sub.disconnect()
+    broker.tear_down()
+
+
+def test_egress_drain():
+    broker: LoopbackBroker = LoopbackBroker(latency=.01)
+    set_broker(50003, broker)
+
+    pub: MqttBridge = MqttBridge(MQTT_LOOPBACK_HOST, 50003, client_id='pub', async_publish=True, max_in_flight=1, downgrade_superseded=False)
+    pub.listen(block=False)
+    assert _wait_for(lambda: pub.connected)
+
+    # Only one message is in flight at a time, so most are still queued when disconnecting
+    for i in range(5):
+        pub.publish(f'/t/{i}', bytes(10))
+    pub.disconnect()
+
+    metrics = pub.get_publish_metrics()
+    assert metrics['published'] == 5 and metrics['acked'] == 5
+    assert metrics['queued'] == 0 and metrics['dropped'] == 0
+
+    broker.tear_down()
+
+
+def test_qos0_overflow():
+    broker: LoopbackBroker = LoopbackBroker(latency=.05, max_queued=1)
+    acked: List[int] = []
+
+    sender: LoopbackClient = LoopbackClient('sender', broker=broker)
+    sender.on_publish = lambda client, userdata, mid: acked.append(mid)
+    sender.connect()
+
+    first = sender.publish('/t', b'1', qos=0)
+    second = sender.publish('/t', b'2', qos=0)  # First one still in transit
+    assert first.rc == mqtt.MQTT_ERR_SUCCESS and second.rc == mqtt.MQTT_ERR_QUEUE_SIZE
+    assert acked == [first.mid] and broker.n_dropped == 1
+
+    broker.tear_down()
+
+
+if __name__ == '__main__':
+    test_bridge_over_loopback()
+    test_bandwidth_limit()
+    test_bridge_metrics()
+    test_egress_drain()
+    test_qos0_overflow()
@@ -0,0 +1,87 @@
+import time
+from typing import List
+
+from common.bridge.loopback import LoopbackBroker, set_broker
+from common.bridge.metrics import Dropped, DROP_STALE
+from common.bridge.pool import BridgePool, BridgeLease
+from common.constants import MQTT_LOOPBACK_HOST, MQTT_PUBLISH_QUEUE_SIZE, MQTT_MAX_IN_FLIGHT
+
+
+def _wait_for(condition, timeout: float = 2.) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.005)
+    return True
+
+
+def test_lease_refcounting():
+    broker: LoopbackBroker = LoopbackBroker()
+    set_broker(50011, broker)
+    pool: BridgePool = BridgePool()
+
+    a: BridgeLease = pool.acquire(MQTT_LOOPBACK_HOST, 50011)
+    b: BridgeLease = pool.acquire(MQTT_LOOPBACK_HOST, 50011)
+    a.listen()
+    b.listen()
+    assert a.shared is b.shared and pool.get_usage() == {(MQTT_LOOPBACK_HOST, 50011): 2}
+    assert _wait_for(lambda: a.connected)
+
+    # Publishing capacity grows with the number of leases
+    egress = a.shared.bridge.egress
+    assert egress.queue.maxlen == 2 * MQTT_PUBLISH_QUEUE_SIZE and egress.max_in_flight == 2 * MQTT_MAX_IN_FLIGHT
+
+    # Topics stay subscribed as long as any lease is subscribed
+    a.subscribe('/t', lambda msg: None)
+    b.subscribe('/t', lambda msg: None)
+    a.unsubscribe('/t')
+    assert '/t' in a.shared.bridge.subscriptions
+    b.unsubscribe('/t')
+    assert '/t' not in a.shared.bridge.subscriptions
+
+    # Connection is closed along with the last lease only, releasing twice has no effect
+    a.disconnect()
+    a.disconnect()
+    assert pool.get_usage() == {(MQTT_LOOPBACK_HOST, 50011): 1}
+    assert egress.queue.maxlen == MQTT_PUBLISH_QUEUE_SIZE and egress.alive
+    b.disconnect()
+    assert pool.get_usage() == {} and not egress.alive
+
+    broker.tear_down()
+
+
+def test_fan_out_drops():
+    broker: LoopbackBroker = LoopbackBroker()
+    set_broker(50012, broker)
+    pool: BridgePool = BridgePool()
+
+    a: BridgeLease = pool.acquire(MQTT_LOOPBACK_HOST, 50012)
+    b: BridgeLease = pool.acquire(MQTT_LOOPBACK_HOST, 50012)
+    a.listen()
+    b.listen()
+    assert _wait_for(lambda: a.connected)
+
+    # a drops everything as outdated, b only the message 'old'
+    received: List[bytes] = []
+    a.subscribe('/t', lambda msg: Dropped(DROP_STALE))
+    b.subscribe('/t', lambda msg: (received.append(msg), Dropped(DROP_STALE) if msg == b'old' else None)[1])
+
+    for msg in [b'new', b'old']:
+        a.publish('/t', msg)
+        assert broker.drain(timeout=2.)
+        assert _wait_for(lambda: len(received) == 1 + (msg == b'old'))
+
+    # Only dropped by both counts as dropped
+    assert _wait_for(lambda: b.get_metrics()['/t']['delivered'] == 2)
+    metrics = b.get_metrics()['/t']
+    assert metrics['received'] == 2 and metrics['drops'] == {DROP_STALE: 1}
+
+    a.disconnect()
+    b.disconnect()
+    broker.tear_down()
+
+
+if __name__ == '__main__':
+    test_lease_refcounting()
+    test_fan_out_drops()
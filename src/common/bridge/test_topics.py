@@ -0,0 +1,34 @@
+import paho.mqtt.client as mqtt
+
+from common.bridge.topics import tile_topic, tile_filter, tile_from_topic
+
+PREFIX: str = '/graph_fused_out'
+TILE: str = '1202032332303131012'
+
+
+def test_flat_layout():
+    assert tile_topic(PREFIX, TILE, hierarchical=False) == f'{PREFIX}/{TILE}'
+    assert tile_filter(PREFIX, TILE, hierarchical=False) == f'{PREFIX}/{TILE}'
+    assert tile_from_topic(PREFIX, tile_topic(PREFIX, TILE, hierarchical=False)) == TILE
+
+
+def test_hierarchical_layout():
+    topic: str = tile_topic(PREFIX, TILE, hierarchical=True, root_level=15)
+    assert topic == f'{PREFIX}/120203233230313/1/0/1/2'
+    assert tile_from_topic(PREFIX, topic) == TILE
+
+    # Ancestors' filters match, siblings' ones do not
+    for level in range(15, 20):
+        assert mqtt.topic_matches_sub(tile_filter(PREFIX, TILE[:level], hierarchical=True, root_level=15), topic)
+    assert not mqtt.topic_matches_sub(tile_filter(PREFIX, TILE[:17] + '3', hierarchical=True, root_level=15), topic)
+
+    try:
+        tile_filter(PREFIX, TILE[:14], hierarchical=True, root_level=15)
+        assert False
+    except ValueError:
+        pass
+
+
+if __name__ == '__main__':
+    test_flat_layout()
+    test_hierarchical_layout()
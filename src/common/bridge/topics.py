@@ -0,0 +1,28 @@
+from common.constants import TOPIC_HIERARCHICAL, TOPIC_ROOT_LEVEL
+
+'''
+    Layouts of per-tile topics. In the flat layout, a tile's topic is <prefix>/<quadkey>. In the hierarchical one,
+    the first root_level digits of the quadkey form one segment and every further digit a segment of its own, e.g.
+    /graph_fused_out/120203233231202/3/1/0/2 for a level 19 tile. Thus, a single wildcard filter, e.g.
+    /graph_fused_out/120203233231202/3/1/#, covers all tiles within an ancestor tile.
+    Must be kept in sync with the edge node's tileTopic().
+'''
+
+
+def tile_topic(prefix: str, key: str, hierarchical: bool = TOPIC_HIERARCHICAL, root_level: int = TOPIC_ROOT_LEVEL) -> str:
+    if not hierarchical or len(key) <= root_level:
+        return f'{prefix}/{key}'
+    return '/'.join([prefix, key[:root_level]] + list(key[root_level:]))
+
+
+# Filter matching the topics of all tiles within the given one (including itself), or only its own in the flat layout
+def tile_filter(prefix: str, key: str, hierarchical: bool = TOPIC_HIERARCHICAL, root_level: int = TOPIC_ROOT_LEVEL) -> str:
+    if not hierarchical:
+        return tile_topic(prefix, key, hierarchical=False)
+    if len(key) < root_level:
+        raise ValueError(f'tiles above level {root_level} can not be covered by a filter')
+    return f'{tile_topic(prefix, key, hierarchical=True, root_level=root_level)}/#'
+
+
+def tile_from_topic(prefix: str, topic: str) -> str:
+    return topic[len(prefix) + 1:].replace('/', '')
@@ -30,19 +30,40 @@ GNSS_Z_OFFSET = 2.8
 RES_X, RES_Y = 1024, 768
 
 MQTT_QOS = 1
+MQTT_CONNECT_TIMEOUT = 4.0
+MQTT_RECONNECT_MIN_SEC, MQTT_RECONNECT_MAX_SEC = 1., 32.  # Backoff between attempts to reconnect after the connection was lost
+MQTT_INGRESS_WORKERS = 2  # Threads per bridge handling incoming messages
+MQTT_MAX_IN_FLIGHT = 4  # Unacknowledged QoS 1 messages per bridge, when publishing asynchronously
+MQTT_PUBLISH_QUEUE_SIZE = 16
+MQTT_DRAIN_TIMEOUT_SEC = 2.  # How long queued and unacknowledged messages may delay disconnecting
+MQTT_METRICS_INTERVAL_SEC = float(os.getenv('MQTT_METRICS_INTERVAL', 0))  # Bridges log their metrics this often, never if 0
 TOPIC_GRAPH_RAW_IN = '/graph_raw_in'
+TOPIC_GRAPH_RAW_IN_BATCH = '/graph_raw_in_batch'  # Framed multi-scene containers
 TOPIC_PREFIX_GRAPH_FUSED_OUT = '/graph_fused_out'
+TOPIC_HIERARCHICAL = os.getenv('TOPIC_LAYOUT', 'flat') == 'hierarchical'  # Per-tile topics as one segment per quadkey digit, see common.bridge.topics
+TOPIC_ROOT_LEVEL = 15  # ... below the first segment, which holds the first TOPIC_ROOT_LEVEL digits
+SUBSCRIPTION_WILDCARD_LEVEL = 18  # In the hierarchical layout, remote tiles are subscribed to by wildcards for their ancestors of this level
 
 EDGE_DISTRIBUTION_TILE_LEVEL = 15
 REMOTE_GRID_TILE_LEVEL = 19
 OCCUPANCY_TILE_LEVEL = 24
+SUBSCRIPTION_HORIZON_SEC = 3.  # Remote tiles the ego is predicted to enter within this time are subscribed to ahead
+SUBSCRIPTION_RELEASE_SEC = 5.  # Remote tiles that are no longer needed are only released after this time
+SUBSCRIPTION_HYSTERESIS_M = 5.  # The ego has to be this far inside a new remote tile ...
+SUBSCRIPTION_MIN_DWELL_SEC = 1.  # ... for at least this time before subscriptions follow
 
 FUSION_DECAY_LAMBDA = .14
 
 REMOTE_PSEUDO_ID = -1
 
+SYNC_TOLERANCE_SEC = .1  # Max. time difference between a point cloud and the actor observations it is matched with
+PIPELINE_PUBLISH_QUEUE_SIZE = 4  # Encoded local scenes waiting to be published, oldest ones are dropped first
+
 RECORDING_RATE = 15  # Hz
 RECORDING_FILE_TPL = 'recordings/<id>_%Y-%m-%d_%H-%M-%S.csv'
+RECORDING_ROTATE_BYTES = 256 * 1024 * 1024  # Recorded scenes are split into files of at most this size ...
+RECORDING_ROTATE_SEC = 10 * 60  # ... or covering at most this time span
+RECORDING_QUEUE_SIZE = 256  # Scenes buffered in memory per sink, oldest ones are dropped first
 
 NPC_TARGET_SPEED = 25  # km/h
 EGO_TARGET_SPEED = 25  # km/h
@@ -60,6 +81,9 @@ SCENE2_CENTER_DIST = 85.
 SCENE2_MIN_REMAINING_EGOS = SCENE2_N_EGOS // 2
 
 MQTT_BASE_HOSTNAME = os.getenv('MQTT_BASE_HOSTNAME', 'localhost')
+MQTT_LOOPBACK_HOST = 'loopback'  # Pseudo host name of the in-process broker, see common.bridge.loopback
+MQTT_ROUTING_TABLE = os.getenv('MQTT_ROUTING_TABLE')  # Path to a JSON file mapping quadkey prefixes to brokers, see common.routing
+MQTT_ROUTING_TTL_SEC = 10.  # Resolved brokers are cached for this long, the table file is checked for changes as often
 
 EVAL2_BASE_KEY = '120203233231202'  # Town01
 EVAL2_DATA_DIR = 'evaluation/perception'
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+from typing import Dict, Tuple, Optional, List
+
+from common.constants import MQTT_BASE_HOSTNAME, MQTT_ROUTING_TABLE, MQTT_ROUTING_TTL_SEC, EDGE_DISTRIBUTION_TILE_LEVEL
+
+'''
+    Resolves tiles to the brokers of the edge nodes responsible for them. The routing table maps quadkey prefixes of
+    any length to broker endpoints, a tile is routed by the longest prefix of its key that is in the table. Thus,
+    edge nodes can be sharded unevenly, e.g. one broker for a large, sparsely populated area and several ones within
+    it for busy parts. The empty prefix serves as a catch-all.
+
+    Tables are either given as a dict or loaded from a JSON file, which is reloaded once it changed:
+    { "": "localhost:1883", "1202032": "edge-a:1883", "12020323": "edge-b:1884" }
+
+    Prefixes are stored in a trie with one level per quadkey digit. Resolved keys are cached for ttl seconds.
+
+    Clients resolve the keys of node tiles (EDGE_DISTRIBUTION_TILE_LEVEL digits), so longer prefixes never match and
+    are warned about. Tables that fail to load, e.g. for digits other than 0-3, are rejected and the previous one kept.
+'''
+
+Endpoint = Tuple[str, int]
+
+DEFAULT_PORT: int = 1883
+
+
+def parse_endpoint(value: str) -> Endpoint:
+    host, _, port = value.rpartition(':')
+    return (host, int(port)) if host else (value, DEFAULT_PORT)
+
+
+class _TrieNode:
+    __slots__ = ['children', 'endpoint']
+
+    def __init__(self):
+        self.children: List[Optional[_TrieNode]] = [None] * 4
+        self.endpoint: Optional[Endpoint] = None
+
+
+class RoutingTable:
+    def __init__(self, routes: Dict[str, str] = None, path: str = None, ttl: float = MQTT_ROUTING_TTL_SEC, default: Endpoint = (MQTT_BASE_HOSTNAME, DEFAULT_PORT)):
+        self.path: Optional[str] = path
+        self.ttl: float = ttl
+        self.default: Endpoint = default
+        self.root: _TrieNode = _TrieNode()
+        self.cache: Dict[str, Tuple[Endpoint, float]] = {}
+        self.lock: Lock = Lock()
+
+        self.mtime: float = 0
+        self.next_check: float = 0
+        self.n_lookups: int = 0
+        self.n_hits: int = 0
+
+        if routes is not None:
+            self.load(routes)
+        elif path:
+            self.reload()
+
+    @classmethod
+    def from_env(cls) -> 'RoutingTable':
+        return cls(path=MQTT_ROUTING_TABLE)
+
+    # Replaces the table, raises ValueError and keeps the previous one if any route is malformed
+    def load(self, routes: Dict[str, str]):
+        if not isinstance(routes, dict):
+            raise ValueError(f'expected an object mapping prefixes to endpoints, got {type(routes).__name__}')
+
+        root: _TrieNode = _TrieNode()
+        for prefix, endpoint in routes.items():
+            if not isinstance(prefix, str) or any(d not in '0123' for d in prefix):
+                raise ValueError(f'invalid quadkey prefix {prefix!r}')
+            if not isinstance(endpoint, str):
+                raise ValueError(f'invalid endpoint {endpoint!r} for prefix {prefix!r}')
+            if len(prefix) > EDGE_DISTRIBUTION_TILE_LEVEL:
+                logging.warning(f'Route for {prefix} is longer than node tile keys ({EDGE_DISTRIBUTION_TILE_LEVEL} digits) and will never match.')
+
+            node: _TrieNode = root
+            for digit in prefix:
+                i: int = int(digit)
+                if node.children[i] is None:
+                    node.children[i] = _TrieNode()
+                node = node.children[i]
+            node.endpoint = parse_endpoint(endpoint)
+
+        with self.lock:
+            self.root = root
+            self.cache.clear()
+
+    # Loads the table file again, if it changed since, returns whether it did
+    def reload(self) -> bool:
+        try:
+            mtime: float = os.path.getmtime(self.path)
+            if mtime == self.mtime:
+                return False
+            self.mtime = mtime  # A broken file is reported once, not on every check until it changes
+            with open(self.path, 'r') as f:
+                self.load(json.load(f))
+            logging.info(f'Loaded routing table from {self.path}.')
+            return True
+        except Exception as e:  # Keep the previous table, a broken file must not break importing clients
+            logging.warning(f'Failed to load routing table from {self.path}: {e}')
+            return False
+
+    def resolve(self, key: str) -> Endpoint:
+        now: float = time.monotonic()
+
+        if self.path and now >= self.next_check:
+            self.next_check = now + self.ttl
+            self.reload()
+
+        self.n_lookups += 1
+        cached: Optional[Tuple[Endpoint, float]] = self.cache.get(key)
+        if cached and cached[1] > now:
+            self.n_hits += 1
+            return cached[0]
+
+        with self.lock:
+            endpoint: Endpoint = self._longest_match(key)
+            self.cache[key] = (endpoint, now + self.ttl)
+        return endpoint
+
+    def _longest_match(self, key: str) -> Endpoint:
+        node: Optional[_TrieNode] = self.root
+        endpoint: Endpoint = self.root.endpoint or self.default
+
+        for digit in key:
+            node = node.children[int(digit)]
+            if node is None:
+                break
+            if node.endpoint:
+                endpoint = node.endpoint
+
+        return endpoint
+
+
+default_table: RoutingTable = RoutingTable.from_env()
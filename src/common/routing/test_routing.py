@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import tempfile
+from typing import List
+
+from common.constants import EDGE_DISTRIBUTION_TILE_LEVEL
+from common.routing import RoutingTable, parse_endpoint
+
+
+def test_parse_endpoint():
+    assert parse_endpoint('edge-a:1884') == ('edge-a', 1884)
+    assert parse_endpoint('edge-a') == ('edge-a', 1883)
+
+
+def test_longest_prefix_match():
+    table: RoutingTable = RoutingTable({
+        '1202': 'coarse:1883',
+        '120203': 'fine:1883',
+        '1202032': 'finer:1884',
+    }, default=('fallback', 1883))
+
+    assert table.resolve('120203233231202') == ('finer', 1884)
+    assert table.resolve('120203133231202') == ('fine', 1883)
+    assert table.resolve('120201') == ('coarse', 1883)
+    assert table.resolve('120') == ('fallback', 1883)
+    assert table.resolve('3') == ('fallback', 1883)
+
+    # Catch-all overrides the default
+    assert RoutingTable({'': 'all:1883'}).resolve('0123') == ('all', 1883)
+
+
+def test_cache_and_reload():
+    with tempfile.TemporaryDirectory() as d:
+        path: str = os.path.join(d, 'routes.json')
+        with open(path, 'w') as f:
+            json.dump({'12': 'a:1883'}, f)
+
+        table: RoutingTable = RoutingTable(path=path, ttl=0)
+        assert table.resolve('1203') == ('a', 1883)
+
+        with open(path, 'w') as f:
+            json.dump({'12': 'b:1883'}, f)
+        os.utime(path, (0, os.path.getmtime(path) + 1))
+
+        assert table.resolve('1203') == ('b', 1883)
+
+    cached: RoutingTable = RoutingTable({'12': 'a:1883'}, ttl=60)
+    cached.resolve('1203')
+    cached.resolve('1203')
+    assert cached.n_hits == 1
+
+
+def test_reject_malformed():
+    with tempfile.TemporaryDirectory() as d:
+        path: str = os.path.join(d, 'routes.json')
+        with open(path, 'w') as f:
+            json.dump({'12': 'a:1883'}, f)
+        table: RoutingTable = RoutingTable(path=path, ttl=0)
+
+        # Each one is rejected, keeping the previous table
+        for i, routes in enumerate([{'1204': 'b:1883'}, ['12', 'b:1883'], {'12': 'b:port'}, {'12': 1883}]):
+            with open(path, 'w') as f:
+                json.dump(routes, f)
+            os.utime(path, (0, os.path.getmtime(path) + i + 1))
+            assert not table.reload()
+            assert table.resolve('1203') == ('a', 1883)
+
+    # Not loaded from a file at all, nothing to fall back to but the default
+    assert RoutingTable(path='/nonexistent/routes.json').resolve('1203') == RoutingTable().default
+
+    # Routes deeper than node tiles are kept, but can never be resolved by clients
+    warnings: List[str] = []
+    handler: logging.Handler = logging.Handler(logging.WARNING)
+    handler.emit = lambda record: warnings.append(record.getMessage())
+    logging.getLogger().addHandler(handler)
+    try:
+        deep: RoutingTable = RoutingTable({'1' * (EDGE_DISTRIBUTION_TILE_LEVEL + 1): 'deep:1883'}, default=('fallback', 1883))
+    finally:
+        logging.getLogger().removeHandler(handler)
+    assert any('will never match' in w for w in warnings)
+    assert deep.resolve('1' * EDGE_DISTRIBUTION_TILE_LEVEL) == ('fallback', 1883)
+
+
+if __name__ == '__main__':
+    test_parse_endpoint()
+    test_longest_prefix_match()
+    test_cache_and_reload()
+    test_reject_malformed()
@@ -0,0 +1,213 @@
+import os
+from typing import BinaryIO, Dict, Tuple, Union
+
+import numpy as np
+
+from common.constants import REMOTE_PSEUDO_ID
+from common.observation import PEMTrafficSceneObservation
+from common.occupancy import GridCellState as Gss
+from common.serialization.schema import GridCellState
+from common.serialization.schema.base import PEMTrafficScene
+from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
+from common.serialization.schema.proto import base_pb2
+from common.serialization.schema.relation import PEMRelation
+
+'''
+    Columnar store for grid observations (and ground truth). A store is a directory of flat little-endian arrays,
+    one file per column, which readers memory-map instead of loading them:
+
+    frames.bin:     one FRAME_DTYPE record per frame (timestamps, sender, parent tile, range of its cells)
+    quadint.bin:    uint64 per cell
+    state.bin:      uint8 per cell
+    confidence.bin: float32 per cell
+    frame.bin:      uint32 per cell, index of the frame it belongs to
+
+    Files are only ever appended to. A frame's record is only written once its cells are flushed, so a crash can at
+    worst leave a frame's cells without its record, or (as the files are not synced) a record without all of its cells.
+    Writers opening an existing store cut off both, readers refuse frames whose cells lie beyond any column's end.
+'''
+
+FRAME_DTYPE: np.dtype = np.dtype([
+    ('timestamp', '<f8'),  # Time of recording
+    ('scene_timestamp', '<f8'),
+    ('min_timestamp', '<f8'),
+    ('max_timestamp', '<f8'),
+    ('sender', '<i8'),
+    ('tile', '<u8'),  # Quadint of the parent tile, if the frame covers a single one, 0 otherwise
+    ('offset', '<u8'),
+    ('count', '<u4'),
+])
+
+CELL_COLUMNS: Dict[str, np.dtype] = {
+    'quadint': np.dtype('<u8'),
+    'state': np.dtype('u1'),
+    'confidence': np.dtype('<f4'),
+    'frame': np.dtype('<u4'),
+}
+
+_FRAMES_FILE: str = 'frames.bin'
+
+_Columns = Tuple[np.ndarray, np.ndarray, np.ndarray]  # quadints, states, confidences
+
+
+def scene_columns(payload: Union[bytes, memoryview]) -> Tuple[Tuple[float, float, float], _Columns]:
+    scene = base_pb2.TrafficScene()
+    scene.ParseFromString(bytes(payload))
+    cells = scene.occupancyGrid.cells
+    n: int = len(cells)
+
+    return (scene.timestamp, scene.minTimestamp, scene.maxTimestamp), (
+        np.fromiter((c.hash for c in cells), dtype=np.uint64, count=n),
+        np.fromiter((c.state.object for c in cells), dtype=np.uint8, count=n),
+        np.fromiter((c.state.confidence for c in cells), dtype=np.float32, count=n),
+    )
+
+
+class ColumnarWriter:
+    def __init__(self, outdir: str):
+        self.outdir: str = outdir
+        os.makedirs(outdir, exist_ok=True)
+
+        # Continue after the last complete frame, in case a previous writer crashed
+        self.n_frames, self.n_cells = self._truncate_torn()
+
+        self.filehandles: Dict[str, BinaryIO] = {k: open(os.path.join(outdir, f'{k}.bin'), 'ab') for k in CELL_COLUMNS}
+        self.frames_handle: BinaryIO = open(os.path.join(outdir, _FRAMES_FILE), 'ab')
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.frames_handle.closed
+
+    # Returns the number of bytes written
+    def append(self,
+               timestamp: float,
+               quadints: np.ndarray,
+               states: np.ndarray,
+               confidences: np.ndarray,
+               sender: int = REMOTE_PSEUDO_ID,
+               tile: int = 0,
+               scene_timestamps: Tuple[float, float, float] = None
+               ) -> int:
+        n: int = len(quadints)
+        columns: Dict[str, np.ndarray] = {
+            'quadint': quadints,
+            'state': states,
+            'confidence': confidences,
+            'frame': np.full(n, self.n_frames),
+        }
+
+        n_bytes: int = 0
+        for k, dtype in CELL_COLUMNS.items():
+            data: bytes = np.ascontiguousarray(columns[k], dtype=dtype).tobytes()
+            self.filehandles[k].write(data)
+            n_bytes += len(data)
+
+        # Cells first, see above
+        for f in self.filehandles.values():
+            f.flush()
+
+        scene_timestamp, min_timestamp, max_timestamp = scene_timestamps if scene_timestamps else (timestamp,) * 3
+        record: np.ndarray = np.array([(timestamp, scene_timestamp, min_timestamp, max_timestamp, sender, tile, self.n_cells, n)], dtype=FRAME_DTYPE)
+        self.frames_handle.write(record.tobytes())
+
+        self.n_cells += n
+        self.n_frames += 1
+        return n_bytes + FRAME_DTYPE.itemsize
+
+    def flush(self, sync: bool = False):
+        if self.closed:
+            return
+
+        # Cells first, see above
+        for f in list(self.filehandles.values()) + [self.frames_handle]:
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        for f in list(self.filehandles.values()) + [self.frames_handle]:
+            f.close()
+
+    # Cuts all files off after the last frame whose record and cells are both complete, returns the numbers of
+    # frames and cells kept
+    def _truncate_torn(self) -> Tuple[int, int]:
+        def size(filename: str) -> int:
+            path: str = os.path.join(self.outdir, filename)
+            return os.path.getsize(path) if os.path.exists(path) else 0
+
+        n_frames: int = size(_FRAMES_FILE) // FRAME_DTYPE.itemsize
+        n_column_cells: int = min(size(f'{k}.bin') // dtype.itemsize for k, dtype in CELL_COLUMNS.items())
+
+        n_cells: int = 0
+        if n_frames > 0:
+            frames: np.ndarray = np.memmap(os.path.join(self.outdir, _FRAMES_FILE), dtype=FRAME_DTYPE, mode='r', shape=(n_frames,))
+            ends: np.ndarray = (frames['offset'] + frames['count']).astype(np.int64)
+            while n_frames > 0 and ends[n_frames - 1] > n_column_cells:
+                n_frames -= 1
+            n_cells = int(ends[n_frames - 1]) if n_frames > 0 else 0
+            del frames
+
+        for filename, n_bytes in [(_FRAMES_FILE, n_frames * FRAME_DTYPE.itemsize)] + [(f'{k}.bin', n_cells * dtype.itemsize) for k, dtype in CELL_COLUMNS.items()]:
+            if size(filename) > n_bytes:
+                os.truncate(os.path.join(self.outdir, filename), n_bytes)
+
+        return n_frames, n_cells
+
+
+class ColumnarReader:
+    def __init__(self, indir: str):
+        self.indir: str = indir
+        self.frames: np.ndarray = self._map(_FRAMES_FILE, FRAME_DTYPE)
+        self.columns: Dict[str, np.ndarray] = {k: self._map(f'{k}.bin', dtype) for k, dtype in CELL_COLUMNS.items()}
+
+        # Timestamp index, frames are not necessarily recorded in order
+        self.order: np.ndarray = np.argsort(self.frames['timestamp'], kind='stable')
+        self.sorted_timestamps: np.ndarray = self.frames['timestamp'][self.order]
+
+    def __len__(self):
+        return len(self.frames)
+
+    # Indices of all frames recorded within [t0, t1], in order of time
+    def find(self, t0: float = -np.inf, t1: float = np.inf) -> np.ndarray:
+        start: int = int(np.searchsorted(self.sorted_timestamps, t0, side='left'))
+        end: int = int(np.searchsorted(self.sorted_timestamps, t1, side='right'))
+        return self.order[start:end]
+
+    # Views into the mapped files, nothing is copied. Frames whose cells were not completely written are refused.
+    def cells(self, i: int) -> _Columns:
+        offset, count = int(self.frames['offset'][i]), int(self.frames['count'][i])
+        if any(offset + count > len(c) for c in self.columns.values()):
+            raise ValueError(f'cells of frame {i} are incomplete')
+        return tuple(self.columns[k][offset:offset + count] for k in ['quadint', 'state', 'confidence'])
+
+    def to_observation(self, i: int) -> PEMTrafficSceneObservation:
+        frame: np.void = self.frames[i]
+        quadints, states, confidences = self.cells(i)
+
+        return PEMTrafficSceneObservation(
+            timestamp=float(frame['timestamp']),
+            scene=PEMTrafficScene(
+                timestamp=float(frame['scene_timestamp']),
+                min_timestamp=float(frame['min_timestamp']),
+                max_timestamp=float(frame['max_timestamp']),
+                last_timestamp=float(frame['max_timestamp']),
+                occupancy_grid=PEMOccupancyGrid(cells=[
+                    PEMGridCell(hash=h, state=PEMRelation(c, GridCellState(Gss(s))))
+                    for h, s, c in zip(quadints.tolist(), states.tolist(), confidences.tolist())
+                ])
+            ),
+            meta={'sender': int(frame['sender'])}
+        )
+
+    def _map(self, filename: str, dtype: np.dtype) -> np.ndarray:
+        path: str = os.path.join(self.indir, filename)
+        n: int = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(n,))
@@ -0,0 +1,189 @@
+import logging
+import mmap
+import os
+import struct
+from enum import IntEnum
+from typing import Iterator, Iterable, Union, BinaryIO, Dict, Any
+
+from common.constants import REMOTE_PSEUDO_ID
+from common.observation import PEMTrafficSceneObservation, RawBytesObservation, Observation
+from common.serialization.schema.base import PEMTrafficScene
+
+'''
+    Framed container for encoded traffic scenes. The same layout is used as a multi-scene MQTT payload
+    (bursts to the edge node) and as an append-only recording log, which can be read either sequentially
+    or through mmap.
+
+    container:  MAGIC frame*
+    frame:      header payload
+    header:     payload length (uint32) | sender (int64) | receive timestamp (float64) | codec (uint8)
+
+    All numbers are little endian.
+'''
+
+MAGIC: bytes = b'TKC1'
+FRAME_HEADER: struct.Struct = struct.Struct('<IqdB')
+
+_Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+class FrameCodec(IntEnum):
+    PROTOBUF = 0  # Serialized TrafficScene message
+
+
+class SceneFrame:
+    def __init__(self, payload: _Buffer, sender: int = REMOTE_PSEUDO_ID, timestamp: float = 0., codec: FrameCodec = FrameCodec.PROTOBUF):
+        self.payload: _Buffer = payload
+        self.sender: int = sender
+        self.timestamp: float = timestamp
+        self.codec: FrameCodec = codec
+
+    def decode(self) -> PEMTrafficScene:
+        if self.codec != FrameCodec.PROTOBUF:
+            raise ValueError(f'unsupported codec "{self.codec}"')
+        return PEMTrafficScene.from_bytes(bytes(self.payload))
+
+    def to_observation(self) -> PEMTrafficSceneObservation:
+        return PEMTrafficSceneObservation(self.timestamp, self.decode(), meta={'sender': self.sender})
+
+    @classmethod
+    def from_observation(cls, obs: Observation) -> 'SceneFrame':
+        meta: Dict[str, Any] = obs.meta if obs.meta else {}
+        sender: int = int(meta.get('sender', REMOTE_PSEUDO_ID))
+
+        if isinstance(obs, RawBytesObservation):
+            return cls(obs.value, sender=sender, timestamp=obs.timestamp)
+        elif isinstance(obs, PEMTrafficSceneObservation):
+            return cls(obs.value.to_bytes(), sender=sender, timestamp=obs.timestamp)
+        raise TypeError(f'can not frame observation of type "{type(obs)}"')
+
+    def to_bytes(self) -> bytes:
+        return FRAME_HEADER.pack(len(self.payload), self.sender, self.timestamp, self.codec) + bytes(self.payload)
+
+    def __len__(self):
+        return FRAME_HEADER.size + len(self.payload)
+
+    def __str__(self):
+        return f'[{self.timestamp}] Scene frame from {self.sender} of length {len(self.payload)}'
+
+
+def is_container(data: _Buffer) -> bool:
+    return len(data) >= len(MAGIC) and data[:len(MAGIC)] == MAGIC
+
+
+def pack(frames: Iterable[SceneFrame]) -> bytes:
+    return MAGIC + b''.join([f.to_bytes() for f in frames])
+
+
+def unpack(data: _Buffer) -> Iterator[SceneFrame]:
+    if not is_container(data):
+        raise ValueError('not a scene container')
+
+    view: memoryview = memoryview(data)
+    offset: int = len(MAGIC)
+
+    while offset + FRAME_HEADER.size <= len(view):
+        length, sender, timestamp, codec = FRAME_HEADER.unpack_from(view, offset)
+        offset += FRAME_HEADER.size
+
+        if offset + length > len(view):
+            logging.warning(f'Skipping truncated frame at offset {offset - FRAME_HEADER.size}.')
+            return
+
+        yield SceneFrame(view[offset:offset + length], sender=sender, timestamp=timestamp, codec=FrameCodec(codec))
+        offset += length
+
+
+# Appends to an existing container, after cutting off a frame that was only partially written, e.g. due to a crash
+class FrameWriter:
+    def __init__(self, outpath: str):
+        self.outpath: str = outpath
+        size: int = os.path.getsize(outpath) if os.path.exists(outpath) else 0
+        end: int = self._find_end(size)
+        self.filehandle: BinaryIO = open(outpath, 'ab')
+        self.n_written: int = 0
+
+        if end < size:
+            logging.warning(f'Truncating {size - end} bytes of a torn frame at the end of {outpath}.')
+            self.filehandle.truncate(end)
+        if end == 0:
+            self.filehandle.write(MAGIC)
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.filehandle.closed
+
+    def append(self, frame: SceneFrame):
+        self.filehandle.write(FRAME_HEADER.pack(len(frame.payload), frame.sender, frame.timestamp, frame.codec))
+        self.filehandle.write(frame.payload)
+        self.n_written += 1
+
+    def flush(self, sync: bool = False):
+        if self.filehandle.closed:
+            return
+        self.filehandle.flush()
+        if sync:
+            os.fsync(self.filehandle.fileno())
+
+    def close(self):
+        if self.filehandle.closed:
+            return
+        self.flush()
+        self.filehandle.close()
+
+    # Offset right behind the last complete frame, 0 if the file does not even contain the magic bytes
+    def _find_end(self, size: int) -> int:
+        if size < len(MAGIC):
+            return 0
+
+        with open(self.outpath, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{self.outpath} is not a scene container')
+
+            end: int = len(MAGIC)
+            while True:
+                header: bytes = f.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    return end
+                length: int = FRAME_HEADER.unpack(header)[0]
+                if end + FRAME_HEADER.size + length > size:
+                    return end
+                end += FRAME_HEADER.size + length
+                f.seek(end)
+
+
+class FrameReader:
+    def __init__(self, inpath: str):
+        self.inpath: str = inpath
+
+    # Sequential streaming read. Payloads are copied.
+    def read_stream(self) -> Iterator[SceneFrame]:
+        with open(self.inpath, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{self.inpath} is not a scene container')
+
+            while True:
+                header: bytes = f.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    return
+
+                length, sender, timestamp, codec = FRAME_HEADER.unpack(header)
+                payload: bytes = f.read(length)
+                if len(payload) < length:
+                    logging.warning(f'Skipping truncated frame at end of {self.inpath}.')
+                    return
+
+                yield SceneFrame(payload, sender=sender, timestamp=timestamp, codec=FrameCodec(codec))
+
+    # Zero-copy read. Payloads are memoryviews into the mapped file, which is unmapped once no frame references it anymore.
+    def read_mmap(self) -> Iterator[SceneFrame]:
+        if os.path.getsize(self.inpath) == 0:
+            return
+
+        with open(self.inpath, 'rb') as f:
+            m: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        yield from unpack(memoryview(m))
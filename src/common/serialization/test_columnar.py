@@ -0,0 +1,104 @@
+import os
+import tempfile
+
+import numpy as np
+
+from common.serialization.columnar import ColumnarWriter, ColumnarReader, scene_columns, FRAME_DTYPE
+from common.serialization.schema import GridCellState
+from common.serialization.schema.actor import PEMDynamicActor
+from common.serialization.schema.base import PEMTrafficScene
+from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
+from common.serialization.schema.relation import PEMRelation
+
+REF_TIME_1: float = 1573220495.8997931
+
+
+def test_write_read():
+    with tempfile.TemporaryDirectory() as d:
+        outdir: str = os.path.join(d, 'test.tkcol')
+
+        writer: ColumnarWriter = ColumnarWriter(outdir)
+        for i, ts in enumerate([REF_TIME_1 + 2, REF_TIME_1, REF_TIME_1 + 1]):
+            n: int = i + 1
+            writer.append(ts, np.arange(n, dtype=np.uint64) + 10 * i, np.full(n, i, dtype=np.uint8), np.full(n, .5, dtype=np.float32), sender=i)
+        writer.close()
+
+        # Appending to an existing store
+        writer = ColumnarWriter(outdir)
+        writer.append(REF_TIME_1 + 3, np.array([99], dtype=np.uint64), np.array([1], dtype=np.uint8), np.array([.9], dtype=np.float32))
+        writer.close()
+
+        reader: ColumnarReader = ColumnarReader(outdir)
+        assert len(reader) == 4
+        assert reader.find().tolist() == [1, 2, 0, 3]
+        assert reader.find(REF_TIME_1 + .5, REF_TIME_1 + 2).tolist() == [2, 0]
+
+        quadints, states, confidences = reader.cells(2)
+        assert quadints.tolist() == [20, 21, 22]
+        assert states.tolist() == [2, 2, 2]
+        assert reader.cells(3)[0].tolist() == [99]
+
+        obs = reader.to_observation(1)
+        assert obs.timestamp == REF_TIME_1
+        assert obs.meta['sender'] == 1
+        assert [c.hash for c in obs.value.occupancy_grid.cells] == [10, 11]
+
+
+def test_torn_write():
+    with tempfile.TemporaryDirectory() as d:
+        outdir: str = os.path.join(d, 'test.tkcol')
+
+        writer: ColumnarWriter = ColumnarWriter(outdir)
+        for i in range(2):
+            writer.append(REF_TIME_1 + i, np.array([10 * i], dtype=np.uint64), np.array([i], dtype=np.uint8), np.array([.5], dtype=np.float32))
+        writer.close()
+
+        # Crash while appending a frame: a complete record, but only some of its cells, plus half a record
+        with open(os.path.join(outdir, 'quadint.bin'), 'ab') as f:
+            f.write(np.array([98, 99], dtype=np.uint64).tobytes())
+        with open(os.path.join(outdir, 'frames.bin'), 'ab') as f:
+            f.write(np.array([(REF_TIME_1 + 2, 0, 0, 0, 0, 0, 2, 2)], dtype=FRAME_DTYPE).tobytes())
+            f.write(bytes(FRAME_DTYPE.itemsize // 2))
+
+        reader: ColumnarReader = ColumnarReader(outdir)
+        assert len(reader) == 3
+        try:
+            reader.cells(2)
+            assert False
+        except ValueError:
+            pass
+        del reader
+
+        writer = ColumnarWriter(outdir)
+        writer.append(REF_TIME_1 + 3, np.array([20, 21], dtype=np.uint64), np.array([2, 3], dtype=np.uint8), np.array([.9, .8], dtype=np.float32))
+        writer.close()
+
+        reader = ColumnarReader(outdir)
+        assert len(reader) == 3
+        quadints, states, _ = reader.cells(2)
+        assert quadints.tolist() == [20, 21]
+        assert states.tolist() == [2, 3]
+        assert reader.columns['frame'].tolist() == [0, 1, 2, 2]
+
+
+def test_scene_columns():
+    scene: PEMTrafficScene = PEMTrafficScene(
+        timestamp=REF_TIME_1,
+        min_timestamp=REF_TIME_1 - 1,
+        max_timestamp=REF_TIME_1,
+        last_timestamp=REF_TIME_1,
+        measured_by=PEMDynamicActor(id=1),
+        occupancy_grid=PEMOccupancyGrid(cells=[PEMGridCell(hash=i + 1, state=PEMRelation(.5, GridCellState.occupied())) for i in range(3)])
+    )
+
+    timestamps, (quadints, states, confidences) = scene_columns(scene.to_bytes())
+    assert timestamps == (REF_TIME_1, REF_TIME_1 - 1, REF_TIME_1)
+    assert quadints.tolist() == [1, 2, 3]
+    assert states.tolist() == [1, 1, 1]
+    assert np.allclose(confidences, .5)
+
+
+if __name__ == '__main__':
+    test_write_read()
+    test_torn_write()
+    test_scene_columns()
@@ -0,0 +1,95 @@
+import os
+import tempfile
+from typing import List
+
+from common.observation import RawBytesObservation
+from common.serialization import container
+from common.serialization.container import SceneFrame, FrameWriter, FrameReader
+from common.serialization.schema import GridCellState
+from common.serialization.schema.actor import PEMDynamicActor
+from common.serialization.schema.base import PEMTrafficScene
+from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
+from common.serialization.schema.relation import PEMRelation
+
+REF_TIME_1: float = 1573220495.8997931
+
+
+def make_scene(n_cells: int) -> PEMTrafficScene:
+    return PEMTrafficScene(
+        timestamp=REF_TIME_1,
+        min_timestamp=REF_TIME_1,
+        max_timestamp=REF_TIME_1,
+        last_timestamp=REF_TIME_1,
+        measured_by=PEMDynamicActor(id=1),
+        occupancy_grid=PEMOccupancyGrid(cells=[
+            PEMGridCell(hash=i + 1, state=PEMRelation(confidence=.5, object=GridCellState.occupied()))
+            for i in range(n_cells)
+        ])
+    )
+
+
+def test_pack_unpack():
+    frames: List[SceneFrame] = [SceneFrame(make_scene(i).to_bytes(), sender=i, timestamp=REF_TIME_1 + i) for i in range(1, 4)]
+    data: bytes = container.pack(frames)
+
+    assert container.is_container(data)
+
+    unpacked: List[SceneFrame] = list(container.unpack(data))
+    assert len(unpacked) == 3
+    assert [f.sender for f in unpacked] == [1, 2, 3]
+    assert unpacked[2].timestamp == REF_TIME_1 + 3
+    assert len(unpacked[2].decode().occupancy_grid.cells) == 3
+
+
+def test_unpack_truncated():
+    data: bytes = container.pack([SceneFrame(make_scene(2).to_bytes()), SceneFrame(make_scene(4).to_bytes())])
+    assert len(list(container.unpack(data[:-1]))) == 1
+
+
+def test_write_read():
+    with tempfile.TemporaryDirectory() as d:
+        outpath: str = os.path.join(d, 'test.tkc')
+
+        writer: FrameWriter = FrameWriter(outpath)
+        writer.append(SceneFrame.from_observation(RawBytesObservation(REF_TIME_1, make_scene(1).to_bytes(), meta={'sender': 7})))
+        writer.close()
+
+        # Append-only: re-opening must not write a second header
+        writer = FrameWriter(outpath)
+        writer.append(SceneFrame(make_scene(2).to_bytes(), sender=8, timestamp=REF_TIME_1))
+        writer.close()
+
+        reader: FrameReader = FrameReader(outpath)
+        streamed: List[int] = [len(f.decode().occupancy_grid.cells) for f in reader.read_stream()]
+        mapped: List[int] = [f.to_observation().meta['sender'] for f in reader.read_mmap()]
+
+        assert streamed == [1, 2]
+        assert mapped == [7, 8]
+
+
+def test_append_after_torn_write():
+    with tempfile.TemporaryDirectory() as d:
+        outpath: str = os.path.join(d, 'test.tkc')
+
+        writer: FrameWriter = FrameWriter(outpath)
+        writer.append(SceneFrame(make_scene(1).to_bytes(), sender=7, timestamp=REF_TIME_1))
+        writer.append(SceneFrame(make_scene(2).to_bytes(), sender=8, timestamp=REF_TIME_1))
+        writer.close()
+
+        # Crashed while writing the second frame's payload
+        with open(outpath, 'r+b') as f:
+            f.truncate(os.path.getsize(outpath) - 3)
+
+        writer = FrameWriter(outpath)
+        writer.append(SceneFrame(make_scene(3).to_bytes(), sender=9, timestamp=REF_TIME_1))
+        writer.close()
+
+        assert [f.sender for f in FrameReader(outpath).read_stream()] == [7, 9]
+        assert [len(f.decode().occupancy_grid.cells) for f in FrameReader(outpath).read_mmap()] == [1, 3]
+
+
+if __name__ == '__main__':
+    test_pack_unpack()
+    test_unpack_truncated()
+    test_write_read()
+    test_append_after_torn_write()
@@ -0,0 +1,108 @@
+from typing import List, Dict
+
+import numpy as np
+
+from common.serialization import wire
+from common.serialization.schema import GridCellState
+from common.serialization.schema.actor import PEMDynamicActor
+from common.serialization.schema.base import PEMTrafficScene
+from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
+from common.serialization.schema.relation import PEMRelation
+
+REF_TIME_1: float = 1573220495.8997931
+REF_TIME_2: float = 1573220496.3281042
+
+
+def test_encode_varints():
+    values: np.ndarray = np.array([0, 1, 127, 128, 300, 2 ** 63 + 5], dtype=np.uint64)
+    groups, lengths = wire.encode_varints(values)
+
+    for i, v in enumerate(values):
+        assert groups[i, :lengths[i]].tobytes() == wire.encode_varint(int(v))
+
+
+def test_encode_scene():
+    hashes: np.ndarray = np.array([1, 300, 1524115467014316311, 2 ** 62], dtype=np.uint64)
+    states: np.ndarray = np.array([0, 1, 2, 1], dtype=np.uint8)
+    confidences: np.ndarray = np.array([.8, 0., .35, 1.], dtype=np.float32)
+    occupant_confidences: np.ndarray = np.array([.8, 0., 0., .2], dtype=np.float32)
+    ego: PEMDynamicActor = PEMDynamicActor(id=1)
+
+    expected: PEMTrafficScene = PEMTrafficScene(
+        timestamp=REF_TIME_1,
+        min_timestamp=REF_TIME_2,
+        max_timestamp=REF_TIME_2,
+        last_timestamp=REF_TIME_2,
+        measured_by=ego,
+        occupancy_grid=PEMOccupancyGrid(cells=[
+            PEMGridCell(
+                hash=int(hashes[i]),
+                state=PEMRelation(float(confidences[i]), GridCellState(int(states[i]))),
+                occupant=PEMRelation(float(occupant_confidences[i]), None)
+            ) for i in range(len(hashes))
+        ])
+    )
+
+    encoded: bytes = wire.encode_scene(
+        timestamp=REF_TIME_1,
+        min_timestamp=REF_TIME_2,
+        max_timestamp=REF_TIME_2,
+        last_timestamp=REF_TIME_2,
+        measured_by=ego.to_bytes(),
+        grid=wire.encode_grid_cells(hashes, states, confidences, occupant_confidences)
+    )
+
+    assert encoded == expected.to_bytes()
+    assert PEMTrafficScene.from_bytes(encoded).occupancy_grid.cells[2].state.object.value == 2
+
+
+def test_peek_timestamps():
+    scene: PEMTrafficScene = PEMTrafficScene(
+        timestamp=REF_TIME_1,
+        min_timestamp=REF_TIME_1,
+        max_timestamp=REF_TIME_2,
+        last_timestamp=REF_TIME_2,
+        measured_by=PEMDynamicActor(id=1),
+        occupancy_grid=PEMOccupancyGrid(cells=[PEMGridCell(hash=i, state=PEMRelation(.5, GridCellState(1))) for i in range(1, 5)])
+    )
+    encoded: bytes = scene.to_bytes()
+
+    assert wire.peek_timestamps(encoded) == (REF_TIME_1, REF_TIME_1, REF_TIME_2)
+    assert wire.peek_timestamps(b'') == (0., 0., 0.)
+
+    try:
+        wire.peek_timestamps(encoded[:-1])
+        assert False
+    except ValueError:
+        pass
+
+
+def test_split_scene():
+    # Two cells in each of the level 1 tiles 0 and 3, one of them without hash (i.e. hash 0)
+    hashes: List[int] = [0, 5, 3 << 62 | 7, 3 << 62 | 8]
+    scene: PEMTrafficScene = PEMTrafficScene(
+        timestamp=REF_TIME_1,
+        min_timestamp=REF_TIME_2,
+        measured_by=PEMDynamicActor(id=1),
+        occupancy_grid=PEMOccupancyGrid(cells=[PEMGridCell(hash=h, state=PEMRelation(.5, GridCellState(1))) for h in hashes])
+    )
+    encoded: bytes = scene.to_bytes()
+
+    parts: Dict[int, bytes] = wire.split_scene(encoded, level=1)
+    assert sorted(parts.keys()) == [0, 3]
+
+    for prefix, expected_hashes in [(0, hashes[:2]), (3, hashes[2:])]:
+        part: PEMTrafficScene = PEMTrafficScene.from_bytes(parts[prefix])
+        assert [c.hash for c in part.occupancy_grid.cells] == expected_hashes
+        assert part.measured_by.id == 1
+        assert wire.peek_timestamps(parts[prefix]) == wire.peek_timestamps(encoded)
+
+    # Scenes within a single tile are passed through
+    assert wire.split_scene(encoded, level=0) == {0: encoded}
+
+
+if __name__ == '__main__':
+    test_encode_varints()
+    test_encode_scene()
+    test_peek_timestamps()
+    test_split_scene()
@@ -0,0 +1,221 @@
+import struct
+from typing import List, Tuple, Dict
+
+import numpy as np
+
+'''
+    Hand-written protobuf wire encoding for the hot path. Instead of creating one PEMGridCell and two PEMRelation
+    objects per cell and serializing the resulting object tree, cells are encoded column-wise from flat arrays.
+    Output is byte-compatible with TrafficScene / OccupancyGrid / GridCell in schema/proto.
+    Conversely, peek_timestamps() reads a scene's timestamps without decoding (and allocating) the grid and
+    split_scene() partitions a scene's cells by tile by only reading their hashes.
+    See https://developers.google.com/protocol-buffers/docs/encoding
+'''
+
+_MAX_VARINT_LEN: int = 10
+_VARINT_SHIFTS: np.ndarray = np.arange(_MAX_VARINT_LEN, dtype=np.uint64) * np.uint64(7)
+
+# Tags (field number << 3 | wire type)
+_TAG_SCENE_TIMESTAMP, _TAG_SCENE_MIN_TIMESTAMP, _TAG_SCENE_MAX_TIMESTAMP, _TAG_SCENE_LAST_TIMESTAMP = 0x09, 0x11, 0x19, 0x21
+_TAG_SCENE_MEASURED_BY, _TAG_SCENE_GRID = 0x2A, 0x32
+_TAG_GRID_CELLS = 0x0A
+_TAG_CELL_HASH, _TAG_CELL_STATE, _TAG_CELL_OCCUPANT = 0x08, 0x12, 0x1A
+_TAG_RELATION_CONFIDENCE, _TAG_RELATION_ENUM = 0x0D, 0x10
+
+# Wire types
+_WT_VARINT, _WT_FIXED64, _WT_LENGTH_DELIMITED, _WT_FIXED32 = 0, 1, 2, 5
+
+_Column = Tuple[np.ndarray, np.ndarray]  # (n x w) byte matrix, (n,) number of valid bytes per row
+
+
+def encode_varint(value: int) -> bytes:
+    out: bytearray = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(buf: bytes, pos: int = 0) -> Tuple[int, int]:
+    value: int = 0
+    shift: int = 0
+    while True:
+        if pos >= len(buf):
+            raise ValueError('truncated varint')
+        b: int = buf[pos]
+        value |= (b & 0x7f) << shift
+        pos += 1
+        if not b & 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_varints(values: np.ndarray) -> _Column:
+    values = values.astype(np.uint64)
+    shifted: np.ndarray = values[:, None] >> _VARINT_SHIFTS[None, :]
+
+    lengths: np.ndarray = np.maximum(1, np.count_nonzero(shifted, axis=1))
+    groups: np.ndarray = (shifted & np.uint64(0x7f)).astype(np.uint8)
+    groups[np.arange(_MAX_VARINT_LEN)[None, :] < (lengths[:, None] - 1)] |= 0x80
+
+    return groups, lengths
+
+
+# Encodes cells without occupant object as a sequence of (repeated) OccupancyGrid.cells fields.
+# Every cell has a state relation and an occupant relation that only carries a confidence.
+def encode_grid_cells(hashes: np.ndarray, states: np.ndarray, confidences: np.ndarray, occupant_confidences: np.ndarray) -> bytes:
+    n: int = len(hashes)
+    if n == 0:
+        return b''
+
+    confidences = np.asarray(confidences, dtype=np.float32)
+    occupant_confidences = np.asarray(occupant_confidences, dtype=np.float32)
+
+    has_conf: np.ndarray = confidences != 0
+    has_state: np.ndarray = states != 0
+    has_occ_conf: np.ndarray = occupant_confidences != 0
+
+    hash_tag: _Column = _const(n, _TAG_CELL_HASH)
+    hash_value: _Column = encode_varints(hashes)
+
+    state_len: np.ndarray = has_conf * 5 + has_state * 2
+    state_columns: List[_Column] = [
+        _const(n, _TAG_CELL_STATE),
+        (state_len.astype(np.uint8)[:, None], np.ones(n, dtype=np.int64)),
+        _const(n, _TAG_RELATION_CONFIDENCE, has_conf),
+        _floats(confidences, has_conf),
+        _const(n, _TAG_RELATION_ENUM, has_state),
+        (states.astype(np.uint8)[:, None], has_state.astype(np.int64)),
+    ]
+
+    occ_len: np.ndarray = has_occ_conf * 5
+    occupant_columns: List[_Column] = [
+        _const(n, _TAG_CELL_OCCUPANT),
+        (occ_len.astype(np.uint8)[:, None], np.ones(n, dtype=np.int64)),
+        _const(n, _TAG_RELATION_CONFIDENCE, has_occ_conf),
+        _floats(occupant_confidences, has_occ_conf),
+    ]
+
+    body_columns: List[_Column] = [hash_tag, hash_value] + state_columns + occupant_columns
+    body_len: np.ndarray = np.sum([c[1] for c in body_columns], axis=0)
+
+    return _join([_const(n, _TAG_GRID_CELLS), encode_varints(body_len)] + body_columns)
+
+
+def encode_grid_cell_message(cell: bytes) -> bytes:
+    return bytes([_TAG_GRID_CELLS]) + encode_varint(len(cell)) + cell
+
+
+def encode_scene(timestamp: float, min_timestamp: float, max_timestamp: float, last_timestamp: float, measured_by: bytes, grid: bytes) -> bytes:
+    out: List[bytes] = []
+
+    for tag, value in [(_TAG_SCENE_TIMESTAMP, timestamp), (_TAG_SCENE_MIN_TIMESTAMP, min_timestamp), (_TAG_SCENE_MAX_TIMESTAMP, max_timestamp), (_TAG_SCENE_LAST_TIMESTAMP, last_timestamp)]:
+        if value != 0:
+            out.append(struct.pack('<Bd', tag, value))
+
+    out += [bytes([_TAG_SCENE_MEASURED_BY]), encode_varint(len(measured_by)), measured_by]
+    out += [bytes([_TAG_SCENE_GRID]), encode_varint(len(grid)), grid]
+
+    return b''.join(out)
+
+
+# Returns (timestamp, min timestamp, last timestamp) of a serialized TrafficScene, 0 for absent fields (proto3 defaults)
+def peek_timestamps(msg: bytes) -> Tuple[float, float, float]:
+    found: Dict[int, float] = {}
+    pos: int = 0
+
+    # Top-level fields are skipped over without looking into nested messages
+    while pos < len(msg):
+        tag, pos = decode_varint(msg, pos)
+        wire_type: int = tag & 0x07
+
+        if wire_type == _WT_FIXED64:
+            if pos + 8 > len(msg):
+                raise ValueError('truncated fixed64')
+            found[tag] = struct.unpack_from('<d', msg, pos)[0]
+        pos = _skip_field(msg, pos, wire_type)
+
+    if pos > len(msg):
+        raise ValueError('truncated message')
+
+    return found.get(_TAG_SCENE_TIMESTAMP, 0.), found.get(_TAG_SCENE_MIN_TIMESTAMP, 0.), found.get(_TAG_SCENE_LAST_TIMESTAMP, 0.)
+
+
+# Splits a serialized TrafficScene into one scene per tile of the given level, each of which only carries the grid cells
+# within that tile. Keys are the tiles' quadint prefixes (2 bits per level), all other fields are copied as they are.
+# Cells are not decoded, only their hash is read.
+def split_scene(msg: bytes, level: int) -> Dict[int, bytes]:
+    head: List[bytes] = []
+    grid_start, grid_end = 0, 0
+    pos: int = 0
+
+    while pos < len(msg):
+        start: int = pos
+        tag, pos = decode_varint(msg, pos)
+        if tag == _TAG_SCENE_GRID:
+            length, pos = decode_varint(msg, pos)
+            grid_start, grid_end = pos, pos + length
+            pos = grid_end
+            continue
+        pos = _skip_field(msg, pos, tag & 0x07)
+        head.append(msg[start:pos])
+
+    if pos > len(msg) or grid_end > len(msg):
+        raise ValueError('truncated message')
+
+    shift: int = 64 - 2 * level
+    cells: Dict[int, List[bytes]] = {}
+    pos = grid_start
+
+    while pos < grid_end:
+        start: int = pos
+        tag, pos = decode_varint(msg, pos)
+        if tag != _TAG_GRID_CELLS:
+            raise ValueError(f'unexpected grid field {tag >> 3}')
+        length, pos = decode_varint(msg, pos)
+        if pos + length > grid_end:
+            raise ValueError('truncated cell')
+
+        # Hash is the cell's first field, unless it is 0 and therefore omitted
+        cell_hash: int = decode_varint(msg, pos + 1)[0] if length > 0 and msg[pos] == _TAG_CELL_HASH else 0
+        pos += length
+        cells.setdefault(cell_hash >> shift, []).append(msg[start:pos])
+
+    if len(cells) <= 1:
+        return {prefix: msg for prefix in cells}
+
+    head_bytes: bytes = b''.join(head)
+    parts: Dict[int, bytes] = {}
+    for prefix, grid in cells.items():
+        grid_bytes: bytes = b''.join(grid)
+        parts[prefix] = b''.join([head_bytes, bytes([_TAG_SCENE_GRID]), encode_varint(len(grid_bytes)), grid_bytes])
+    return parts
+
+
+def _skip_field(msg: bytes, pos: int, wire_type: int) -> int:
+    if wire_type == _WT_FIXED64:
+        return pos + 8
+    elif wire_type == _WT_LENGTH_DELIMITED:
+        length, pos = decode_varint(msg, pos)
+        return pos + length
+    elif wire_type == _WT_VARINT:
+        return decode_varint(msg, pos)[1]
+    elif wire_type == _WT_FIXED32:
+        return pos + 4
+    raise ValueError(f'unsupported wire type {wire_type}')
+
+
+def _const(n: int, value: int, mask: np.ndarray = None) -> _Column:
+    return np.full((n, 1), value, dtype=np.uint8), (mask.astype(np.int64) if mask is not None else np.ones(n, dtype=np.int64))
+
+
+def _floats(values: np.ndarray, mask: np.ndarray) -> _Column:
+    return np.ascontiguousarray(values, dtype='<f4').view(np.uint8).reshape(-1, 4), mask.astype(np.int64) * 4
+
+
+# Concatenates variable-length columns row by row and rows one after another
+def _join(columns: List[_Column]) -> bytes:
+    matrix: np.ndarray = np.hstack([c[0] for c in columns])
+    valid: np.ndarray = np.hstack([np.arange(c[0].shape[1])[None, :] < c[1][:, None] for c in columns])
+    return matrix[valid].tobytes()
@@ -1,65 +1,89 @@
 import logging
 import time
-from collections import deque
-from threading import Thread
-from typing import Dict, Deque
+from threading import Thread, Lock, get_ident
+from typing import Dict, Tuple
 
 from common.model import Singleton
+from .histogram import LogHistogram
+
+'''
+    Durations are recorded into log-bucketed histograms, one covering everything since the key was first used and one
+    covering the current reporting window, which info() starts over. Thus, memory per key is fixed, recording is O(1)
+    and reporting only looks at bucket counts. Starts and stops are paired per thread, so the same key can be timed
+    from multiple threads at once.
+'''
 
 
 class TimingService(metaclass=Singleton):
-    def __init__(self, max_keep: int = 10000):
+    # Without a logging thread, info() is expected to be called by the owner, e.g. scheduled on an event loop
+    def __init__(self, threaded: bool = True, interval: float = 5.):
         self.active: bool = True
-        self.max_keep: int = max_keep
-        self.start_timestamps: Dict[str, Deque[float]] = {}
-        self.stop_timestamps: Dict[str, Deque[float]] = {}
-        self.call_count: Dict[str, float] = {}
+        self.interval: float = interval
+        self.pending: Dict[Tuple[str, int], float] = {}  # Key, thread -> start time
+        self.totals: Dict[str, LogHistogram] = {}
+        self.windows: Dict[str, LogHistogram] = {}
         self.start_times: Dict[str, float] = {}
+        self.window_start: float = time.time()
+        self.lock: Lock = Lock()
         self.logging_thread: Thread = Thread(target=self._info_loop, daemon=True)
 
-        self.logging_thread.start()
+        if threaded:
+            self.logging_thread.start()
 
     def start(self, key: str, custom_time: float = None):
-        assert (key not in self.start_timestamps or key not in self.stop_timestamps) or (len(self.start_timestamps[key]) == len(self.stop_timestamps[key]))
-
-        if key not in self.start_timestamps:
-            self.start_timestamps[key] = deque(maxlen=self.max_keep)
-        if key not in self.stop_timestamps:
-            self.stop_timestamps[key] = deque(maxlen=self.max_keep)
-        if key not in self.call_count:
-            self.call_count[key] = 0
-        if key not in self.start_times:
-            self.start_times[key] = time.time()
-
-        if len(self.start_timestamps[key]) == self.max_keep:
-            self.stop_timestamps[key].popleft()
-        self.start_timestamps[key].append(time.time() if not custom_time else custom_time)
+        self.pending[(key, get_ident())] = time.time() if not custom_time else custom_time
 
     def stop(self, key: str, custom_time: float = None):
-        assert key in self.stop_timestamps
+        started: float = self.pending.pop((key, get_ident()))
+        duration: float = (time.time() if not custom_time else custom_time) - started
 
-        self.stop_timestamps[key].append(time.time() if not custom_time else custom_time)
-        self.call_count[key] += 1
+        with self.lock:
+            if key not in self.totals:
+                self.totals[key] = LogHistogram(sub_buckets=16)
+                self.windows[key] = LogHistogram(sub_buckets=16)
+                self.start_times[key] = time.time()
+            self.totals[key].record(duration)
+            self.windows[key].record(duration)
 
     def tear_down(self):
         self.active = False
 
     def get_mean(self, key: str) -> float:
-        assert key in self.start_timestamps and key in self.stop_timestamps and len(self.stop_timestamps[key]) > 0
-        return sum(map(lambda t: t[0] - t[1], zip(self.stop_timestamps[key], self.start_timestamps[key]))) / len(self.stop_timestamps[key])
+        assert key in self.totals and self.totals[key].count > 0
+        return self.totals[key].mean
+
+    def get_percentile(self, key: str, q: float) -> float:
+        assert key in self.totals
+        return self.totals[key].percentile(q)
 
     def get_call_rate(self, key: str) -> float:
-        assert key in self.call_count and key in self.start_times
-        return round(self.call_count[key] / (time.time() - self.start_times[key]), 2)
+        assert key in self.totals and key in self.start_times
+        return round(self.totals[key].count / (time.time() - self.start_times[key]), 2)
+
+    # Percentiles, maximum and rate per key within the current window, optionally starting a new one
+    def get_window(self, reset: bool = True) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            now: float = time.time()
+            elapsed: float = max(now - self.window_start, 1e-9)
+            stats: Dict[str, Dict[str, float]] = {}
+            for key, h in self.windows.items():
+                stats[key] = h.to_dict()
+                stats[key]['rate'] = h.count / elapsed
+                if reset:
+                    h.reset()
+            if reset:
+                self.window_start = now
+            return stats
 
     def info(self):
         txt: str = '\n-------\nTIMINGS\n'
-        for key in sorted(list(self.start_timestamps.keys())):
-            txt += f'[{key}]: {self.get_mean(key) * 1000} ms (Rate: {self.get_call_rate(key)} / sec)\n'
+        for key, s in sorted(self.get_window().items()):
+            txt += f'[{key}]: p50 {s["p50"] * 1000:.2f} ms, p95 {s["p95"] * 1000:.2f} ms, p99 {s["p99"] * 1000:.2f} ms, ' \
+                   f'max {s["max"] * 1000:.2f} ms (Rate: {round(s["rate"], 2)} / sec)\n'
         txt += '-------'
         logging.info(txt)
 
     def _info_loop(self):
         while self.active:
-            time.sleep(5.0)
+            time.sleep(self.interval)
             self.info()
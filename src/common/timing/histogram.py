@@ -0,0 +1,86 @@
+import math
+from typing import List, Dict
+
+'''
+    Fixed-memory histogram of positive values (e.g. durations in seconds) with logarithmically sized buckets, similar
+    to HdrHistogram. Every power of two between min_value and max_value is split into sub_buckets buckets of equal
+    width, so percentiles are accurate to within 1 / sub_buckets relative to the value. Values below min_value are
+    counted in a bucket of their own, values above max_value in the last one. Recording is O(1), percentiles are
+    computed from the bucket counts, without storing any of the values themselves.
+'''
+
+
+class LogHistogram:
+    def __init__(self, min_value: float = 1e-6, max_value: float = 1e3, sub_buckets: int = 8):
+        self.min_value: float = min_value
+        self.max_value: float = max_value
+        self.sub_buckets: int = sub_buckets
+        self.n_octaves: int = max(1, math.ceil(math.log2(max_value / min_value)))
+        self.counts: List[int] = [0] * (self.n_octaves * sub_buckets + 1)
+        self.count: int = 0
+        self.sum: float = 0
+        self.max: float = 0
+
+    def record(self, value: float):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # Smallest bucket bound that at least q percent of all values are less than or equal to, capped at the maximum
+    def percentile(self, q: float) -> float:
+        if self.count == 0:
+            return 0
+        rank: int = max(1, math.ceil(q / 100 * self.count))
+        seen: int = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                # The last bucket is unbounded
+                return self.max if i == len(self.counts) - 1 else min(self._upper_bound(i), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count > 0 else 0
+
+    # Adds up the counts of another histogram of the same layout
+    def merge(self, other: 'LogHistogram'):
+        assert len(self.counts) == len(other.counts)
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def copy(self) -> 'LogHistogram':
+        h: LogHistogram = LogHistogram(self.min_value, self.max_value, self.sub_buckets)
+        h.merge(self)
+        return h
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count, self.sum, self.max = 0, 0, 0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def _index(self, value: float) -> int:
+        if value < self.min_value:
+            return 0
+        mantissa, exponent = math.frexp(value / self.min_value)  # mantissa within [.5, 1), exponent >= 1
+        return min(1 + (exponent - 1) * self.sub_buckets + int((2 * mantissa - 1) * self.sub_buckets), len(self.counts) - 1)
+
+    def _upper_bound(self, index: int) -> float:
+        if index == 0:
+            return self.min_value
+        octave, sub = divmod(index - 1, self.sub_buckets)
+        return self.min_value * 2 ** octave * (1 + (sub + 1) / self.sub_buckets)
@@ -0,0 +1,38 @@
+import random
+
+from common.timing.histogram import LogHistogram
+
+
+def test_percentiles():
+    h: LogHistogram = LogHistogram(min_value=1e-6, max_value=10, sub_buckets=16)
+    values = [random.uniform(.001, .1) for _ in range(10000)] + [1.5]
+    for v in values:
+        h.record(v)
+
+    values.sort()
+    for q in [50, 95, 99]:
+        exact: float = values[int(q / 100 * len(values)) - 1]
+        assert abs(h.percentile(q) - exact) / exact <= 1 / 16 + 1e-3
+    assert h.max == 1.5 and h.percentile(100) == 1.5
+    assert h.count == len(values)
+    assert abs(h.mean - sum(values) / len(values)) < 1e-9
+
+
+def test_bounds_and_merge():
+    h: LogHistogram = LogHistogram(min_value=1e-3, max_value=1)
+    h.record(0)
+    h.record(1e6)
+    assert h.percentile(50) == 1e-3
+    assert h.percentile(99) == 1e6  # Beyond max_value, only the maximum itself is known
+
+    other: LogHistogram = h.copy()
+    other.merge(h)
+    assert other.count == 4 and h.count == 2
+
+    h.reset()
+    assert h.count == 0 and h.percentile(99) == 0
+
+
+if __name__ == '__main__':
+    test_percentiles()
+    test_bounds_and_merge()
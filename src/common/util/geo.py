@@ -19,3 +19,11 @@ def rotate_z(coords: _Vec3, degrees: float) -> _Vec3:
         coords[0] * math.sin(degrees) + coords[1] * math.cos(degrees),
         coords[2]
     )
+
+
+# Approximate inverse of gnss_add_meters, i.e. the (north, east) offset of coords_b from coords_a
+def gnss_delta_meters(coords_a: Tuple[float, ...], coords_b: Tuple[float, ...]) -> Tuple[float, float]:
+    return (
+        (coords_b[0] - coords_a[0]) * (math.pi / 180) * EARTH_RADIUS,
+        (coords_b[1] - coords_a[1]) * (math.pi / 180) * EARTH_RADIUS * math.cos(coords_a[0] * (math.pi / 180)),
+    )
@@ -8,7 +8,9 @@ const (
 	RemoteGridTileLevel      = 19
 	FusionDecayLambda        = 0.14 // 0.05, 0.08, 0.11, 0.14
 	TopicGraphRawIn          = "/graph_raw_in"
+	TopicGraphRawInBatch     = "/graph_raw_in_batch"
 	TopicPrefixGraphFusedOut = "/graph_fused_out"
+	TopicRootLevel           = 15
 	GraphMaxAge              = time.Duration(2 * time.Second)
 	MqttQos                  = 1
 )
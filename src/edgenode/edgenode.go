@@ -36,6 +36,7 @@ var (
 	lastEval                    time.Time = time.Now()
 	kill                        uint32    // actually boolean
 	activeKeys                  sync.Map
+	hierarchicalTopics          bool
 )
 
 func listen() {
@@ -56,7 +57,7 @@ func tick() {
 	m := fusionService.Get(GraphMaxAge)
 
 	for k, msg := range m {
-		client.Publish(TopicPrefixGraphFusedOut+"/"+string(k), MqttQos, false, msg)
+		client.Publish(tileTopic(string(k)), MqttQos, false, msg)
 		activeKeys.Store(k, lastTick)
 		atomic.AddUint32(&outBytesCount, uint32(len(msg)))
 	}
@@ -121,6 +122,7 @@ func init() {
 	// Read command-line args
 	tilePtr := flag.String("tile", "1202032332303131", "QuadKey of the tile this edge node will be responsible for")
 	brokerPtr := flag.String("broker", "tcp://localhost:1883", "MQTT broker URL")
+	flag.BoolVar(&hierarchicalTopics, "hierarchical", false, "Whether to publish fused tiles to hierarchical topics, i.e. one segment per quadkey digit")
 
 	flag.Parse()
 
@@ -163,6 +165,18 @@ func main() {
 		panic(token.Error())
 	}
 
+	if token := client.Subscribe(TopicGraphRawInBatch, MqttQos, func(client MQTT.Client, msg MQTT.Message) {
+		payloads, err := unpackContainer(msg.Payload())
+		if err != nil {
+			log.Warnf("Failed to unpack container: %s", err.Error())
+		}
+		for _, p := range payloads {
+			graphInQueue <- p
+		}
+	}); token.Wait() && token.Error() != nil {
+		panic(token.Error())
+	}
+
 	timingService := timing.New()
 	go func() {
 		for info := range timingService.Infos {
@@ -2,15 +2,39 @@ package main
 
 import (
 	"bytes"
+	"encoding/binary"
+	"errors"
 	"strconv"
+	"strings"
 	"sync"
 )
 
+// See common/serialization/container.py
+const (
+	containerMagic      = "TKC1"
+	containerHeaderSize = 4 + 8 + 8 + 1 // length, sender, timestamp, codec
+)
+
 var (
 	qi2qkCache sync.Map = sync.Map{}
 	qk2qiCache sync.Map = sync.Map{}
 )
 
+// See common/bridge/topics.py
+func tileTopic(key string) string {
+	if !hierarchicalTopics || len(key) <= TopicRootLevel {
+		return TopicPrefixGraphFusedOut + "/" + key
+	}
+
+	var b strings.Builder
+	b.WriteString(TopicPrefixGraphFusedOut + "/" + key[:TopicRootLevel])
+	for _, digit := range key[TopicRootLevel:] {
+		b.WriteByte('/')
+		b.WriteRune(digit)
+	}
+	return b.String()
+}
+
 func quadInt2QuadKey(quadint uint64) string {
 	if qk, ok := qi2qkCache.Load(quadint); ok {
 		return qk.(string)
@@ -53,3 +77,27 @@ func quadKey2QuadInt(quadkey string) (uint64, error) {
 
 	return qi, nil
 }
+
+// Splits a framed multi-scene container into its (still encoded) scene payloads
+func unpackContainer(data []byte) ([][]byte, error) {
+	if len(data) < len(containerMagic) || string(data[:len(containerMagic)]) != containerMagic {
+		return nil, errors.New("not a scene container")
+	}
+
+	payloads := make([][]byte, 0)
+	offset := len(containerMagic)
+
+	for offset+containerHeaderSize <= len(data) {
+		length := int(binary.LittleEndian.Uint32(data[offset : offset+4]))
+		offset += containerHeaderSize
+
+		if offset+length > len(data) {
+			return payloads, errors.New("truncated frame")
+		}
+
+		payloads = append(payloads, data[offset:offset+length])
+		offset += length
+	}
+
+	return payloads, nil
+}
@@ -0,0 +1,309 @@
+import logging
+import math
+import os
+import random
+from typing import List, Tuple, Dict, Set, Optional
+
+import numpy as np
+from pyquadkey2 import quadkey
+from tqdm import tqdm
+
+from common.constants import *
+from common.occupancy import GridCellState as Gss
+from common.serialization.columnar import ColumnarReader
+
+'''
+    Counterpart to GridEvaluator for columnar recordings (see common.serialization.columnar), which works on the
+    memory-mapped arrays directly. Ground truth is evaluated in windows of window seconds and for every window, only
+    the observation frames recorded within it (plus GRID_TTL_SEC, the furthest a matching observation may lie ahead)
+    are looked at. No observation or ground truth objects are created, so memory is bounded by a window, not by the
+    recording. Matching, fusion and scores follow GridEvaluator.compute_matching() and GridEvaluator.fuse().
+'''
+
+_FrameRef = Tuple[int, int]  # Reader index, frame index
+_Index = Dict[Tuple[int, int], Tuple[np.ndarray, List[_FrameRef]]]  # Parent tile, sender -> frame timestamps, frames
+_Cells = Tuple[np.ndarray, np.ndarray]  # States, confidences
+
+TAG_LOCAL, TAG_FUSED = 'LOCAL', 'FUSED'
+_EMPTY: _FrameRef = (-1, -1)  # An ego was around, but did not observe the tile itself, see compute_matching()
+
+
+# Quadints of the tiles of the given level that the given cells lie within
+def parent_quadints(quadints: np.ndarray, level: int = REMOTE_GRID_TILE_LEVEL) -> np.ndarray:
+    shift: np.uint64 = np.uint64(64 - 2 * level)
+    return ((np.asarray(quadints, dtype=np.uint64) >> shift) << shift) | np.uint64(level)
+
+
+class Scores:
+    def __init__(self):
+        self.n: int = 0
+        self.squared_error: float = 0
+        self.absolute_error: float = 0
+        self.n_correct: int = 0
+        self.n_per_state: np.ndarray = np.zeros(len(Gss), dtype=np.int64)  # Before removing duplicate matches
+
+    # Every ground truth cell is occupied with a confidence of 1
+    def add(self, states: np.ndarray, confidences: np.ndarray):
+        correct: np.ndarray = states == Gss.OCCUPIED
+        self.n += len(states)
+        self.squared_error += float(np.sum(np.where(correct, (1 - confidences) ** 2, 1)))
+        self.absolute_error += float(np.sum(np.where(correct, np.abs(1 - confidences), 1)))
+        self.n_correct += int(np.sum(correct))
+
+    @property
+    def mse(self) -> float:
+        return self.squared_error / self.n if self.n > 0 else 1
+
+    @property
+    def mae(self) -> float:
+        return self.absolute_error / self.n if self.n > 0 else 1
+
+    @property
+    def accuracy(self) -> float:
+        return self.n_correct / self.n if self.n > 0 else 0
+
+
+class ColumnarGridEvaluator:
+    def __init__(
+            self,
+            ground_truth: List[ColumnarReader],
+            local: List[ColumnarReader],
+            remote: List[ColumnarReader],
+            consider_neighborhood: bool = True,
+            window: float = 10.
+    ):
+        self.ground_truth: List[ColumnarReader] = ground_truth
+        self.local: List[ColumnarReader] = local
+        self.remote: List[ColumnarReader] = remote
+        self.consider_neighborhood: bool = consider_neighborhood
+        self.window: float = window
+        self.neighbors: Dict[int, List[int]] = {}
+
+    # Columnar stores of the given recording, remote observations are told apart by their name
+    @classmethod
+    def open(cls, dir_actual: str, dir_observed: str, file_prefix: str, **kwargs) -> 'ColumnarGridEvaluator':
+        def stores(d: str) -> List[str]:
+            return sorted(f for f in os.listdir(d) if f.startswith(file_prefix) and f.endswith('.tkcol')) if os.path.isdir(d) else []
+
+        observed: List[str] = stores(dir_observed)
+        return cls(
+            ground_truth=[ColumnarReader(os.path.join(dir_actual, f)) for f in stores(dir_actual)],
+            local=[ColumnarReader(os.path.join(dir_observed, f)) for f in observed if 'remote' not in f],
+            remote=[ColumnarReader(os.path.join(dir_observed, f)) for f in observed if 'remote' in f],
+            **kwargs
+        )
+
+    @property
+    def empty(self) -> bool:
+        return len(self.ground_truth) == 0 or len(self.local) == 0
+
+    def run(self, downsample_ground_truth: float = 1., downsample_observations: float = 1.) -> Dict[str, Scores]:
+        d1, d2 = self.eval_mean_delays()
+        logging.info(f'Ø local delay: {d1} sec; Ø remote delay: {d2} sec')
+
+        scores: Dict[str, Scores] = self.compute_scores(downsample_ground_truth, downsample_observations)
+        for tag, s in scores.items():
+            if s.n < 1:
+                logging.warning('Did not find any match.')
+                continue
+            total: int = int(np.sum(s.n_per_state)) + 1
+            logging.info(f'[{tag}] Free: {round(s.n_per_state[Gss.FREE] / total * 100, 2)} %, '
+                         f'Occupied: {round(s.n_per_state[Gss.OCCUPIED] / total * 100, 2)} %, '
+                         f'Unknown: {round(s.n_per_state[Gss.UNKNOWN] / total * 100, 2)} %')
+            logging.info(f'[{tag}] MSE: {s.mse}, MAE: {s.mae}, ACC: {s.accuracy}')
+        return scores
+
+    def eval_mean_delays(self) -> Tuple[float, float]:
+        def mean_lag(readers: List[ColumnarReader], column: str) -> float:
+            n: int = sum(len(r) for r in readers)
+            lag: float = sum(float(np.sum(np.abs(r.frames[column] - r.frames['timestamp']))) for r in readers if len(r) > 0)
+            return lag / n if n > 0 else 0
+
+        return mean_lag(self.local, 'scene_timestamp'), (mean_lag(self.remote, 'min_timestamp') + mean_lag(self.remote, 'max_timestamp')) / 2
+
+    def compute_scores(self, downsample_ground_truth: float = 1., downsample_observations: float = 1.) -> Dict[str, Scores]:
+        assert downsample_ground_truth <= 1 and downsample_observations <= 1
+
+        scores: Dict[str, Scores] = {TAG_LOCAL: Scores(), TAG_FUSED: Scores()}
+        if self.empty:
+            return scores
+
+        observed_parents: Set[int] = self._observed_parents(self.local + self.remote)
+        keep_local: List[np.ndarray] = [self._sample(len(r), downsample_observations) for r in self.local]
+        keep_remote: List[np.ndarray] = [self._sample(len(r), downsample_observations) for r in self.remote]
+
+        # Ground truth frames, ordered by time, within the time span covered by observations
+        gt: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        for i, r in enumerate(self.ground_truth):
+            idx: np.ndarray = np.flatnonzero(self._sample(len(r), downsample_ground_truth))
+            gt.append((r.frames['timestamp'][idx], np.full(len(idx), i), idx))
+        gt_ts, gt_reader, gt_idx = (np.concatenate(c) for c in zip(*gt))
+        min_obs_ts, max_obs_ts = self._observed_span()
+        in_span: np.ndarray = (gt_ts >= min_obs_ts) & (gt_ts <= max_obs_ts)
+        order: np.ndarray = np.argsort(gt_ts[in_span], kind='stable')
+        gt_ts, gt_reader, gt_idx = gt_ts[in_span][order], gt_reader[in_span][order], gt_idx[in_span][order]
+
+        n_windows: int = math.ceil((gt_ts[-1] - gt_ts[0]) / self.window) + 1 if len(gt_ts) > 0 else 0
+        start: int = 0
+        for _ in tqdm(range(n_windows)):
+            if start >= len(gt_ts):
+                break
+            t0: float = float(gt_ts[start])
+            end: int = int(np.searchsorted(gt_ts, t0 + self.window, side='left'))
+
+            local: _Index = self._index(self.local, keep_local, t0, t0 + self.window + GRID_TTL_SEC)
+            remote: _Index = self._index(self.remote, keep_remote, t0, t0 + self.window + GRID_TTL_SEC)
+            senders: Set[int] = set(sender for _, sender in local.keys())
+            seen: Set[Tuple[int, int, float]] = set()  # Matches are only counted once, same as in compute_matching()
+
+            for k in range(start, end):
+                reader: ColumnarReader = self.ground_truth[gt_reader[k]]
+                tile: int = int(reader.frames['tile'][gt_idx[k]])
+                if tile not in observed_parents:
+                    continue
+                try:
+                    quadints: np.ndarray = reader.cells(int(gt_idx[k]))[0]
+                except ValueError:
+                    continue
+                quadints = quadints[parent_quadints(quadints) == np.uint64(tile)]
+                self._evaluate(tile, float(gt_ts[k]), quadints, senders, local, remote, seen, scores)
+
+            start = end
+
+        return scores
+
+    def _evaluate(self, tile: int, ts: float, quadints: np.ndarray, senders: Set[int], local: _Index, remote: _Index, seen: Set, scores: Dict[str, Scores]):
+        for sid in senders:
+            item_local: Optional[_FrameRef] = self._find(local, tile, sid, ts)
+            item_remote: Optional[_FrameRef] = self._find(remote, tile, sid, ts)
+
+            if self.consider_neighborhood and not item_local:
+                if any(self._find(local, n, sid, ts) for n in self._neighbors(tile)):
+                    item_local = _EMPTY
+            if not item_local:
+                continue
+
+            fresh: np.ndarray = np.array([(q, sid, ts) not in seen for q in quadints.tolist()], dtype=np.bool_)
+            seen.update((q, sid, ts) for q in quadints.tolist())
+
+            for tag, with_remote in [(TAG_LOCAL, False), (TAG_FUSED, True)]:
+                states, confidences = self._cell_states(item_local, item_remote if with_remote else None, quadints, ts)
+                scores[tag].n_per_state += np.bincount(states, minlength=len(Gss))
+                scores[tag].add(states[fresh], confidences[fresh])
+
+    # States of the given cells according to an ego's local observation, fused with the remote one, if any
+    def _cell_states(self, item_local: _FrameRef, item_remote: Optional[_FrameRef], quadints: np.ndarray, ts: float) -> _Cells:
+        unknown: _Cells = np.full(len(quadints), Gss.UNKNOWN, dtype=np.int64), np.ones(len(quadints), dtype=np.float64)
+
+        if item_local == _EMPTY:
+            return self._lookup(self.remote, item_remote, quadints, unknown) if item_remote else unknown
+        if not item_remote:
+            return self._lookup(self.local, item_local, quadints, unknown)
+
+        s1, c1 = self._lookup(self.local, item_local, quadints, (np.full(len(quadints), -1), np.zeros(len(quadints))))
+        s2, c2 = self._lookup(self.remote, item_remote, quadints, (np.full(len(quadints), -1), np.zeros(len(quadints))))
+        local_frame: np.void = self.local[item_local[0]].frames[item_local[1]]
+        remote_frame: np.void = self.remote[item_remote[0]].frames[item_remote[1]]
+        w1: float = self._decay(float(local_frame['scene_timestamp']), ts)
+        w2: float = self._decay(float(remote_frame['min_timestamp']) + (float(remote_frame['max_timestamp']) - float(remote_frame['min_timestamp'])) / 2, ts)
+
+        v1, v2 = c1 * w1, c2 * w2
+        known: np.ndarray = (np.where((s1 >= 0) & (s1 != Gss.UNKNOWN), v1, 0) + np.where((s2 >= 0) & (s2 != Gss.UNKNOWN), v2, 0)) > 0
+        zero1: np.ndarray = known & (s1 == Gss.UNKNOWN) & (v1 > 0)
+        zero2: np.ndarray = known & ~zero1 & (s2 == Gss.UNKNOWN) & (v2 > 0)
+        weight_sum: np.ndarray = w1 + w2 - np.where(zero1, w1, 0) - np.where(zero2, w2, 0)
+
+        votes: np.ndarray = np.zeros((len(Gss), len(quadints)), dtype=np.float64)
+        for s in Gss:
+            votes[s] = np.where((s1 == s) & ~zero1, v1, 0) + np.where((s2 == s) & ~zero2, v2, 0)
+        votes /= np.where(weight_sum > 0, weight_sum, 1)
+        fused: _Cells = np.argmax(votes, axis=0), np.max(votes, axis=0)
+
+        # Cells observed by only one side are taken as they are, cells observed by neither are unknown
+        states: np.ndarray = np.where((s1 >= 0) & (s2 >= 0), fused[0], np.where(s1 >= 0, s1, np.where(s2 >= 0, s2, Gss.UNKNOWN)))
+        confidences: np.ndarray = np.where((s1 >= 0) & (s2 >= 0), fused[1], np.where(s1 >= 0, c1, np.where(s2 >= 0, c2, 1)))
+        return states.astype(np.int64), confidences
+
+    @staticmethod
+    def _lookup(readers: List[ColumnarReader], ref: _FrameRef, quadints: np.ndarray, default: _Cells) -> _Cells:
+        cell_quadints, cell_states, cell_confidences = readers[ref[0]].cells(ref[1])
+        states, confidences = default[0].copy(), default[1].copy()
+        if len(cell_quadints) == 0:
+            return states, confidences
+
+        order: np.ndarray = np.argsort(cell_quadints, kind='stable')
+        pos: np.ndarray = np.minimum(np.searchsorted(cell_quadints[order], quadints), len(order) - 1)
+        found: np.ndarray = cell_quadints[order][pos] == quadints
+        states[found] = cell_states[order][pos][found]
+        confidences[found] = cell_confidences[order][pos][found]
+        return states, confidences
+
+    # Earliest observation of the tile by the sender that is not older than ts and at most GRID_TTL_SEC younger
+    @staticmethod
+    def _find(index: _Index, tile: int, sender: int, ts: float) -> Optional[_FrameRef]:
+        entry = index.get((tile, sender))
+        if entry is None:
+            return None
+        timestamps, refs = entry
+        i: int = int(np.searchsorted(timestamps, ts, side='left'))
+        if i == len(timestamps) or timestamps[i] - ts > GRID_TTL_SEC:
+            return None
+        return refs[i]
+
+    # Observation frames recorded within [t0, t1], by the tiles they cover (see GridEvaluator.split_by_level())
+    @staticmethod
+    def _index(readers: List[ColumnarReader], keep: List[np.ndarray], t0: float, t1: float) -> _Index:
+        entries: Dict[Tuple[int, int], List[Tuple[float, _FrameRef]]] = {}
+        for r, reader in enumerate(readers):
+            for i in reader.find(t0, t1):
+                if not keep[r][i]:
+                    continue
+                try:
+                    quadints: np.ndarray = reader.cells(int(i))[0]
+                except ValueError:
+                    continue
+                sender: int = int(reader.frames['sender'][i])
+                for parent in np.unique(parent_quadints(quadints)).tolist():
+                    entries.setdefault((parent, sender), []).append((float(reader.frames['timestamp'][i]), (r, int(i))))
+
+        index: _Index = {}
+        for key, frames in entries.items():
+            frames.sort(key=lambda f: f[0])
+            index[key] = (np.array([f[0] for f in frames]), [f[1] for f in frames])
+        return index
+
+    # Tiles covered by any observation, read in chunks
+    @staticmethod
+    def _observed_parents(readers: List[ColumnarReader], chunk_size: int = 1 << 20) -> Set[int]:
+        parents: Set[int] = set()
+        for reader in readers:
+            quadints: np.ndarray = reader.columns['quadint']
+            for i in range(0, len(quadints), chunk_size):
+                parents.update(np.unique(parent_quadints(quadints[i:i + chunk_size])).tolist())
+        return parents
+
+    def _observed_span(self) -> Tuple[float, float]:
+        def span(readers: List[ColumnarReader]) -> Optional[Tuple[float, float]]:
+            readers = [r for r in readers if len(r) > 0]
+            if not readers:
+                return None
+            return min(float(np.min(r.frames['min_timestamp'])) for r in readers), max(float(np.max(r.frames['max_timestamp'])) for r in readers)
+
+        local, remote = span(self.local), span(self.remote)
+        spans: List[Tuple[float, float]] = [s for s in [local, remote] if s]
+        return min(s[0] for s in spans), max(s[1] for s in spans)
+
+    def _neighbors(self, tile: int) -> List[int]:
+        if tile not in self.neighbors:
+            self.neighbors[tile] = [quadkey.from_str(k).to_quadint() for k in quadkey.from_int(tile).nearby(1)]
+        return self.neighbors[tile]
+
+    @staticmethod
+    def _sample(n: int, fraction: float) -> np.ndarray:
+        keep: np.ndarray = np.zeros(n, dtype=np.bool_)
+        keep[random.sample(range(n), k=math.floor(n * fraction))] = True
+        return keep
+
+    @staticmethod
+    def _decay(timestamp: float, ref_time: float) -> float:
+        return math.exp(-(ref_time - timestamp) * 10 * FUSION_DECAY_LAMBDA)
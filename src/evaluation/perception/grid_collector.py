@@ -1,12 +1,11 @@
 import argparse
 import logging
-import pickle
 import sys
 import time
 from datetime import datetime
-from threading import Thread
 from typing import List, Iterator, FrozenSet, Iterable, Dict, Set
 
+import numpy as np
 from pyquadkey2.quadkey import QuadKey
 
 import carla
@@ -15,9 +14,10 @@ from common.constants import *
 from common.constants import EVAL2_BASE_KEY, EVAL2_DATA_DIR
 from common.model import DynamicActor
 from common.util.process import GracefulKiller
-from evaluation.perception import OccupancyGroundTruthContainer
+from common.occupancy import GridCellState
+from common.serialization.columnar import ColumnarWriter
 
-FLUSH_AFTER = 1e4
+FLUSH_EVERY = 10  # ticks
 
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
 
@@ -50,15 +50,16 @@ class GridCollector:
         self.start_time: datetime = datetime.now()
         self.last_tick: float = 0
         self.tick_count: int = 0
-        self.flush_count: int = 0
-
-        self.ground_truth_buffer: List[OccupancyGroundTruthContainer] = []
-        self.occupancy_ground_truth: List[OccupancyGroundTruthContainer] = []
+        self.n_frames: int = 0
 
         for d in [self.data_dir, self.data_dir_actual]:
             if not os.path.exists(d):
                 os.makedirs(d)
 
+        # Ground truth is appended to a columnar store right away instead of being kept in memory
+        tpl: str = f'{self.base_tile.key}_{FUSION_DECAY_LAMBDA}-decay_%Y-%m-%d_%H-%M-%S.tkcol'
+        self.writer: ColumnarWriter = ColumnarWriter(os.path.join(self.data_dir_actual, self.start_time.strftime(tpl)))
+
     def start(self):
         self.run_loop()
 
@@ -67,7 +68,7 @@ class GridCollector:
             # Generate ground truth
             self.push_ground_truth()
 
-            # Sync ground truth and latest observations
+            # Write ground truth to disk
             self.sync()
 
             # Sleep
@@ -75,39 +76,16 @@ class GridCollector:
             self.last_tick = time.monotonic()
 
             if self.killer.kill_now:
-                self.sync()
-
-                if len(self.occupancy_ground_truth) > 0:
-                    self.flush()
-
+                self.writer.close()
                 return
 
     def sync(self):
-        # Flush actor buffer
-        self.occupancy_ground_truth += self.ground_truth_buffer
-        self.ground_truth_buffer.clear()
-
-        if self.tick_count % 10 == 0:
-            k_ground_truth = len(self.occupancy_ground_truth)
-            n_ground_truth = k_ground_truth + (FLUSH_AFTER * self.flush_count)
-
-            logging.debug(f'Ground Truth: {k_ground_truth} (~ {n_ground_truth})')
-
-            if k_ground_truth > FLUSH_AFTER and k_ground_truth % (FLUSH_AFTER * (self.flush_count + 1)):
-                Thread(target=self.flush).start()
+        if self.tick_count % FLUSH_EVERY == 0:
+            logging.debug(f'Ground Truth: {self.n_frames}')
+            self.writer.flush()
 
         self.tick_count += 1
 
-    def flush(self):
-        tpl = f'{self.base_tile.key}_{FUSION_DECAY_LAMBDA}-decay_%Y-%m-%d_%H-%M-%S_part-{self.flush_count + 1}.pkl'
-
-        logging.info('Flushing ground truth ...')
-        with open(os.path.join(self.data_dir_actual, self.start_time.strftime(tpl)), 'wb') as f:
-            pickle.dump(self.occupancy_ground_truth, f)
-        self.occupancy_ground_truth.clear()
-
-        self.flush_count += 1
-
     def push_ground_truth(self):
         occupied_cells: Dict[str, Set[QuadKey]] = self.split_by_level(
             self.fetch_occupied_cells(),
@@ -117,11 +95,15 @@ class GridCollector:
         now: float = time.time()
 
         for tile, cells in occupied_cells.items():
-            self.ground_truth_buffer.append(OccupancyGroundTruthContainer(
-                occupied_cells=frozenset(cells),
-                tile=QuadKey(tile),
-                ts=now
-            ))
+            n: int = len(cells)
+            self.writer.append(
+                timestamp=now,
+                quadints=np.fromiter((c.to_quadint() for c in cells), dtype=np.uint64, count=n),
+                states=np.full(n, GridCellState.OCCUPIED, dtype=np.uint8),
+                confidences=np.ones(n, dtype=np.float32),
+                tile=QuadKey(tile).to_quadint()
+            )
+            self.n_frames += 1
 
     def fetch_occupied_cells(self) -> FrozenSet[QuadKey]:
         carla_actors: List[carla.Actor] = []
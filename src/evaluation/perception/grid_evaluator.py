@@ -11,6 +11,7 @@ import time
 from operator import attrgetter
 from typing import List, Tuple, Dict, Set, Any, Union, cast
 
+from google.protobuf.message import DecodeError
 from pyquadkey2 import quadkey
 from pyquadkey2.quadkey import QuadKey
 from tqdm import tqdm
@@ -25,6 +26,7 @@ from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
 from common.serialization.schema.relation import PEMRelation
 from common.util.misc import multi_getattr
 from evaluation.perception import OccupancyGroundTruthContainer as Ogtc
+from evaluation.perception.columnar_evaluator import ColumnarGridEvaluator
 
 
 def data_dir():
@@ -91,6 +93,13 @@ class GridEvaluator:
 
     def run(self):
         logging.info(f'{datetime.datetime.now()}\n============')
+
+        # Columnar recordings are evaluated straight from disk, in windows of time
+        columnar: ColumnarGridEvaluator = ColumnarGridEvaluator.open(self.data_dir_actual, self.data_dir_observed, self.file_prefix, consider_neighborhood=self.consider_neighborhood)
+        if not columnar.empty:
+            columnar.run(downsample_ground_truth=.25, downsample_observations=1)
+            return
+
         # empirically found that down-sampling by factor of 4 makes effectively no difference in output
         occupancy_observations_local, occupancy_observations_remote, occupancy_ground_truth = self.read_data(
             downsample_ground_truth=.25, downsample_observations=1
@@ -230,6 +239,10 @@ class GridEvaluator:
         logging.debug('Reading ground truth.')
 
         for file_name in files_actual:
+            # Columnar stores are evaluated by ColumnarGridEvaluator
+            if file_name.endswith('.tkcol'):
+                continue
+
             with open(os.path.join(self.data_dir_actual, file_name), 'rb') as f:
                 try:
                     occupancy_ground_truth += pickle.load(f)
@@ -240,6 +253,9 @@ class GridEvaluator:
         logging.debug(f'Reading and decoding observations.')
 
         for file_name in files_observed:
+            if file_name.endswith('.tkcol'):
+                continue
+
             with open(os.path.join(self.data_dir_observed, file_name), 'rb') as f:
                 try:
                     if 'remote' not in file_name:
@@ -259,7 +275,7 @@ class GridEvaluator:
                                         scene=PEMTrafficScene.from_bytes(obs.value),
                                         meta=obs.meta
                                     ))
-                                except KeyError:
+                                except (KeyError, DecodeError):
                                     continue
                         elif isinstance(data[0], PEMTrafficSceneObservation):
                             occupancy_observations_remote.extend(data)
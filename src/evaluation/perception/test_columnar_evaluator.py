@@ -0,0 +1,112 @@
+import os
+import random
+import tempfile
+from typing import List, Tuple, Dict
+
+import numpy as np
+from pyquadkey2 import quadkey
+from pyquadkey2.quadkey import QuadKey
+
+from common.constants import EVAL2_BASE_KEY
+from common.observation import PEMTrafficSceneObservation
+from common.occupancy import GridCellState as Gss
+from common.serialization.columnar import ColumnarWriter, ColumnarReader
+from common.serialization.schema import GridCellState
+from common.serialization.schema.base import PEMTrafficScene
+from common.serialization.schema.occupancy import PEMOccupancyGrid, PEMGridCell
+from common.serialization.schema.relation import PEMRelation
+from evaluation.perception import OccupancyGroundTruthContainer as Ogtc
+from evaluation.perception.columnar_evaluator import ColumnarGridEvaluator, Scores, TAG_LOCAL, TAG_FUSED
+from evaluation.perception.grid_evaluator import GridEvaluator
+
+REF_TIME_1: float = 1573220495.8997931
+TILES: List[str] = [EVAL2_BASE_KEY + '0123', EVAL2_BASE_KEY + '0122', EVAL2_BASE_KEY + '0130']
+
+_Frame = Tuple[float, Tuple[float, float, float], int, np.ndarray, np.ndarray, np.ndarray]  # Timestamp, scene timestamps, sender, cells
+
+
+def _cells(tile: str, n: int) -> np.ndarray:
+    keys = {tile + '000' + ''.join(random.choice('0123') for _ in range(2)) for _ in range(n)}  # Drawn from 16 cells, so that they overlap
+    return np.array(sorted(quadkey.from_str(k).to_quadint() for k in keys), dtype=np.uint64)
+
+
+def _observations(senders: List[int], tiles: List[str], n: int, lag: float) -> List[_Frame]:
+    frames: List[_Frame] = []
+    for _ in range(n):
+        ts: float = REF_TIME_1 + random.uniform(0, 10)
+        quadints: np.ndarray = np.concatenate([_cells(t, 20) for t in random.sample(tiles, k=random.randint(1, len(tiles)))])
+        states: np.ndarray = np.random.randint(0, 3, len(quadints)).astype(np.uint8)
+        confidences: np.ndarray = np.random.uniform(.1, 1, len(quadints)).astype(np.float32)
+        frames.append((ts, (ts - lag, ts - lag - .1, ts - lag + .1), random.choice(senders), quadints, states, confidences))
+    return frames
+
+
+def _write(path: str, frames: List[_Frame], tiles: List[int] = None):
+    writer: ColumnarWriter = ColumnarWriter(path)
+    for i, (ts, scene_timestamps, sender, quadints, states, confidences) in enumerate(frames):
+        writer.append(ts, quadints, states, confidences, sender=sender, tile=tiles[i] if tiles else 0, scene_timestamps=scene_timestamps)
+    writer.close()
+
+
+def _to_observations(frames: List[_Frame]) -> List[PEMTrafficSceneObservation]:
+    return [PEMTrafficSceneObservation(
+        timestamp=ts,
+        scene=PEMTrafficScene(
+            timestamp=scene_timestamps[0],
+            min_timestamp=scene_timestamps[1],
+            max_timestamp=scene_timestamps[2],
+            occupancy_grid=PEMOccupancyGrid(cells=[
+                PEMGridCell(hash=q, state=PEMRelation(c, GridCellState(Gss(s))))
+                for q, s, c in zip(quadints.tolist(), states.tolist(), confidences.tolist())
+            ])
+        ),
+        meta={'sender': sender}
+    ) for ts, scene_timestamps, sender, quadints, states, confidences in frames]
+
+
+def test_parity_with_grid_evaluator():
+    random.seed(1)
+    np.random.seed(1)
+
+    # Sender 3 only ever observes the third tile, i.e. only counts for the others through its neighborhood
+    local: List[_Frame] = _observations([1, 2], TILES[:2], 40, lag=.05) + _observations([3], TILES[2:], 10, lag=.05)
+    remote: List[_Frame] = _observations([1, 2, 3], TILES, 40, lag=.5)
+    ground_truth: List[Tuple[float, int, np.ndarray]] = [(REF_TIME_1 + i * .25, t, _cells(TILES[t], 10)) for i in range(40) for t in range(len(TILES))]
+
+    # Ground truth cells also contain one that lies outside of the frame's tile
+    gt_frames: List[_Frame] = [(ts, (ts,) * 3, 0, np.append(cells, _cells(TILES[(t + 1) % 3], 1)), np.ones(len(cells) + 1, dtype=np.uint8), np.ones(len(cells) + 1, dtype=np.float32)) for ts, t, cells in ground_truth]
+    gt_tiles: List[int] = [QuadKey(TILES[t]).to_quadint() for _, t, _ in ground_truth]
+
+    with tempfile.TemporaryDirectory() as d:
+        _write(os.path.join(d, 'actual.tkcol'), gt_frames, gt_tiles)
+        _write(os.path.join(d, 'local.tkcol'), local)
+        _write(os.path.join(d, 'remote.tkcol'), remote)
+
+        sut: ColumnarGridEvaluator = ColumnarGridEvaluator(
+            ground_truth=[ColumnarReader(os.path.join(d, 'actual.tkcol'))],
+            local=[ColumnarReader(os.path.join(d, 'local.tkcol'))],
+            remote=[ColumnarReader(os.path.join(d, 'remote.tkcol'))],
+            window=2.
+        )
+        scores: Dict[str, Scores] = sut.compute_scores()
+
+        delays: Tuple[float, float] = sut.eval_mean_delays()
+
+    observations_local, observations_remote = _to_observations(local), _to_observations(remote)
+    actual: List[Ogtc] = [Ogtc(occupied_cells=frozenset(QuadKey(quadkey.from_int(q).key) for q in f[3].tolist()), tile=QuadKey(TILES[t]), ts=ts) for f, (ts, t, _) in zip(gt_frames, ground_truth)]
+    expected_delays: Tuple[float, float] = GridEvaluator.eval_mean_delays(observations_local, observations_remote)
+    observations_local, observations_remote, actual = GridEvaluator.preprocess_data(observations_local, observations_remote, actual)
+
+    assert np.allclose(delays, expected_delays)
+
+    for tag, exclude_remote in [(TAG_LOCAL, True), (TAG_FUSED, False)]:
+        matching = GridEvaluator.compute_matching(observations_local, observations_remote, actual, exclude_remote, True)
+        assert len(matching) > 100
+        assert scores[tag].n == len(matching)
+        assert np.isclose(scores[tag].mse, GridEvaluator.compute_mse(matching))
+        assert np.isclose(scores[tag].mae, GridEvaluator.compute_mae(matching))
+        assert np.isclose(scores[tag].accuracy, GridEvaluator.compute_accuracy(matching))
+
+
+if __name__ == '__main__':
+    test_parity_with_grid_evaluator()
@@ -16,6 +16,7 @@ from pyquadkey2 import quadkey
 from pyquadkey2.quadkey import QuadKey
 
 from client import TileSubscriptionService
+from common.bridge.pool import BridgePool
 from common.constants import *
 from common.serialization.schema import Vector3D, RelativeBBox, GridCellState, ActorType
 from common.serialization.schema.actor import PEMDynamicActor
@@ -38,7 +39,9 @@ class MessageGenerator:
             rate: float = 10,  # msgs / ego / sec (total)
             n_sample_egos: int = 100,
             n_sample_scenes: int = 512,
+            n_sample_others: int = 2,
             with_occupant: bool = True,
+            batch_size: int = 1,  # > 1 to publish bursts of messages as framed containers
     ):
         # Parameters
         self.grid_tile_level = grid_tile_level
@@ -46,7 +49,9 @@ class MessageGenerator:
         self.rate: float = rate
         self.n_sample_scenes: int = n_sample_scenes
         self.n_sample_egos: int = n_sample_egos
+        self.n_sample_others: int = n_sample_others
         self.with_occupant: bool = with_occupant
+        self.batch_size: int = batch_size
         self.parallel: bool = True
 
         # Derived parameters
@@ -62,7 +67,8 @@ class MessageGenerator:
         self.gen_others: List[PEMDynamicActor] = None
 
         # Services
-        self.tss: TileSubscriptionService = TileSubscriptionService(on_graph_cb=lambda a: a)
+        # Publishing synchronously, otherwise messages dropped from the publish queue would be counted as sent
+        self.tss: TileSubscriptionService = TileSubscriptionService(on_graph_cb=lambda a: a, pool=BridgePool(async_publish=False))
 
         # Misc
         self.rate_count_thread: Thread = Thread(target=self._eval_rate, daemon=True)
@@ -84,9 +90,18 @@ class MessageGenerator:
         time.sleep(1)
         self.start_time = time.time()
 
+        batch: List[bytes] = []
+
         while True:
             msg = random.choice(self.gen_msgs)
-            self.tss.publish_graph(msg)
+
+            if self.batch_size > 1:
+                batch.append(msg)
+                if len(batch) >= self.batch_size:
+                    self.tss.publish_graphs(batch)
+                    batch = []
+            else:
+                self.tss.publish_graph(msg)
 
             with self.lock:
                 self.msg_count += 1
@@ -125,7 +140,7 @@ class MessageGenerator:
     def init_others(self):
         self.gen_others = []
 
-        for i in range(2):
+        for i in range(self.n_sample_others):
             extent = random.uniform(1.5, 3.5), random.uniform(1, 2), random.uniform(.5, 1.5)
             pos: Tuple[float, float, float] = geo.gnss_add_meters(self.start_location, (
                 random.uniform(-10, 10), random.uniform(-10, 10), 0))
@@ -166,7 +181,7 @@ class MessageGenerator:
             self.gen_msgs = [self.generate_message(self.gen_quads_pool, self.gen_others, self.gen_ego_pool, self.with_occupant) for _ in range(self.n_sample_scenes)]
 
     @classmethod
-    def generate_scene(cls, quads: List[List[QuadKey]], others: List[PEMDynamicActor], egos: List[PEMDynamicActor], with_occupant: bool) -> PEMTrafficScene:
+    def generate_scene(cls, quads: List[List[QuadKey]], others: List[PEMDynamicActor], egos: List[PEMDynamicActor], with_occupant: bool, occupied_ratio: float = None) -> PEMTrafficScene:
         grid: PEMOccupancyGrid = PEMOccupancyGrid(cells=[])
 
         idx: int = random.randint(0, len(egos) - 1)
@@ -174,7 +189,7 @@ class MessageGenerator:
         quadkeys: List[QuadKey] = quads[idx]
 
         for qk in quadkeys:
-            state: GridCellState = random.choice(STATES)
+            state: GridCellState = random.choice(STATES) if occupied_ratio is None else cls.rand_state(occupied_ratio)
             occupant: Union[PEMDynamicActor, None] = random.choice(others) if with_occupant and state == GridCellState.occupied() else None
 
             grid.cells.append(PEMGridCell(
@@ -200,6 +215,13 @@ class MessageGenerator:
     def rand_prob() -> float:
         return max(0, min(1, random.gauss(.5, .25)))
 
+    # Occupied with given probability, otherwise uniformly free or unknown
+    @staticmethod
+    def rand_state(occupied_ratio: float) -> GridCellState:
+        if random.random() < occupied_ratio:
+            return GridCellState.occupied()
+        return random.choice([GridCellState.free(), GridCellState.unknown()])
+
     def _eval_rate(self):
         while True:
             with self.lock:
@@ -215,13 +237,14 @@ def run(args=sys.argv[1:]):
     argparser.add_argument('--level', '-l', default=OCCUPANCY_TILE_LEVEL, type=int, help='Occupancy Grid Tile Level')
     argparser.add_argument('--radius', '-R', default=OCCUPANCY_RADIUS_DEFAULT, type=int, help='Occupancy Grid Radius')
     argparser.add_argument('--egos', '-e', default=1, type=int, help='Number of different ego vehicles to simulate sending data from')
+    argparser.add_argument('--batch', '-b', default=1, type=int, help='Number of messages to publish at once as a framed container')
     argparser.add_argument('--no-occupant', dest='no_occupant', default='false', type=str, help='Whether or not to include a dummy occupant relation for occupied cells or otherwise None.')
 
     args, _ = argparser.parse_known_args(args)
     logging.info(f'Rate: {args.rate}, Level: {args.level}, Radius: {args.radius}, Egos: {args.egos}')
 
     no_occupant: bool = args.no_occupant.lower() == 'true'
-    gen = MessageGenerator(grid_radius=args.radius, grid_tile_level=args.level, rate=args.rate, n_sample_egos=args.egos, with_occupant=not no_occupant)
+    gen = MessageGenerator(grid_radius=args.radius, grid_tile_level=args.level, rate=args.rate, n_sample_egos=args.egos, with_occupant=not no_occupant, batch_size=args.batch)
     gen.run()
 
 
@@ -0,0 +1,216 @@
+'''
+Python counterpart to the Go serialization benchmark in this directory. Instead of a hand-written schema, it measures
+the ProtobufObject (PEM) classes that egos actually run, using synthetic scenes from MessageGenerator.generate_scene.
+'''
+
+import argparse
+import csv
+import gc
+import itertools
+import logging
+import pickle
+import sys
+import time
+import tracemalloc
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, List, Any
+
+import numpy as np
+
+from common.constants import *
+from common.serialization import wire
+from common.serialization.schema.base import PEMTrafficScene
+from common.serialization.schema.proto import base_pb2
+from evaluation.performance.message_generator import MessageGenerator
+
+CSV_FIELDS: List[str] = [
+    'codec', 'grid_radius', 'n_cells', 'occupied_ratio', 'n_actors', 'n_samples',
+    'bytes_mean', 'encode_ms_mean', 'encode_ms_p95', 'decode_ms_mean', 'decode_ms_p95', 'encode_alloc_kb', 'decode_alloc_kb'
+]
+
+
+def data_dir():
+    return os.path.normpath(os.path.join(os.path.dirname(__file__), '../../../data'))
+
+
+class Codec:
+    def __init__(self, name: str, encode: Callable[[Any], bytes], decode: Callable[[bytes], Any], prepare: Callable[[PEMTrafficScene], Any] = None):
+        self.name: str = name
+        self.encode: Callable[[Any], bytes] = encode
+        self.decode: Callable[[bytes], Any] = decode
+        # Converts a scene into the codec's input representation. Not part of the measurement.
+        self.prepare: Callable[[PEMTrafficScene], Any] = prepare if prepare else lambda s: s
+
+
+CODECS: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    CODECS[codec.name] = codec
+
+
+def _prepare_columns(scene: PEMTrafficScene) -> Dict[str, Any]:
+    plain = [c for c in scene.occupancy_grid.cells if not c.occupant or not c.occupant.object]
+    return {
+        'scene': scene,
+        'hashes': np.array([c.hash for c in plain], dtype=np.uint64),
+        'states': np.array([c.state.object.value for c in plain], dtype=np.uint8),
+        'confidences': np.array([c.state.confidence for c in plain], dtype=np.float32),
+        'occupant_confidences': np.array([c.occupant.confidence if c.occupant else 0 for c in plain], dtype=np.float32),
+        'occupied': [c for c in scene.occupancy_grid.cells if c.occupant and c.occupant.object],
+    }
+
+
+# What TalkyClient does: cells without occupant are encoded column-wise, only occupied cells go through PEM objects
+def _encode_columns(columns: Dict[str, Any]) -> bytes:
+    scene: PEMTrafficScene = columns['scene']
+    grid: bytes = wire.encode_grid_cells(columns['hashes'], columns['states'], columns['confidences'], columns['occupant_confidences'])
+    grid += b''.join([wire.encode_grid_cell_message(c.to_bytes()) for c in columns['occupied']])
+    return wire.encode_scene(scene.timestamp, scene.min_timestamp, scene.max_timestamp, scene.last_timestamp, scene.measured_by.to_bytes(), grid)
+
+
+register_codec(Codec('pem', lambda s: s.to_bytes(), PEMTrafficScene.from_bytes))
+register_codec(Codec('protobuf', lambda s: s.to_bytes(), base_pb2.TrafficScene.FromString))  # no mapping back to PEM objects
+register_codec(Codec('pem_zlib', lambda s: zlib.compress(s.to_bytes()), lambda b: PEMTrafficScene.from_bytes(zlib.decompress(b))))
+register_codec(Codec('wire', _encode_columns, PEMTrafficScene.from_bytes, prepare=_prepare_columns))
+register_codec(Codec('pickle', lambda s: pickle.dumps(s, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads))  # what recording sinks do
+
+
+class SerializationBenchmark:
+    def __init__(
+            self,
+            grid_radii: List[int],
+            occupied_ratios: List[float],
+            actor_counts: List[int],
+            codecs: List[str],
+            n_samples: int = 100,
+            n_warmup: int = 5
+    ):
+        self.grid_radii: List[int] = grid_radii
+        self.occupied_ratios: List[float] = occupied_ratios
+        self.actor_counts: List[int] = actor_counts
+        self.codecs: List[Codec] = [CODECS[c] for c in codecs]
+        self.n_samples: int = n_samples
+        self.n_warmup: int = n_warmup
+
+    def run(self) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+
+        for radius, ratio, n_actors in itertools.product(self.grid_radii, self.occupied_ratios, self.actor_counts):
+            scenes: List[PEMTrafficScene] = self.generate_scenes(radius, ratio, n_actors)
+
+            for codec in self.codecs:
+                result: Dict[str, Any] = {
+                    'codec': codec.name,
+                    'grid_radius': radius,
+                    'n_cells': (radius * 2 + 1) ** 2,
+                    'occupied_ratio': ratio,
+                    'n_actors': n_actors,
+                    'n_samples': len(scenes),
+                    **self.measure(codec, scenes)
+                }
+                logging.info(', '.join([f'{k}: {v}' for k, v in result.items()]))
+                results.append(result)
+
+        return results
+
+    def generate_scenes(self, grid_radius: int, occupied_ratio: float, n_actors: int) -> List[PEMTrafficScene]:
+        gen: MessageGenerator = MessageGenerator(grid_radius=grid_radius, n_sample_egos=10, n_sample_others=n_actors)
+        gen.init_egos()
+        gen.init_others()
+        gen.init_quad_keys()
+
+        return [
+            MessageGenerator.generate_scene(gen.gen_quads_pool, gen.gen_others, gen.gen_ego_pool, with_occupant=n_actors > 0, occupied_ratio=occupied_ratio)
+            for _ in range(self.n_samples)
+        ]
+
+    def measure(self, codec: Codec, scenes: List[PEMTrafficScene]) -> Dict[str, float]:
+        inputs: List[Any] = [codec.prepare(s) for s in scenes]
+
+        for i in range(min(self.n_warmup, len(inputs))):
+            codec.decode(codec.encode(inputs[i]))
+
+        encoded: List[bytes] = []
+        t_encode: List[float] = []
+        t_decode: List[float] = []
+
+        gc.disable()
+        try:
+            for item in inputs:
+                t0: float = time.perf_counter()
+                data: bytes = codec.encode(item)
+                t_encode.append(time.perf_counter() - t0)
+                encoded.append(data)
+
+            for data in encoded:
+                t0: float = time.perf_counter()
+                codec.decode(data)
+                t_decode.append(time.perf_counter() - t0)
+        finally:
+            gc.enable()
+
+        # Separate pass, because tracing allocations distorts timings
+        a_encode: List[int] = [self._peak_alloc(codec.encode, item) for item in inputs]
+        a_decode: List[int] = [self._peak_alloc(codec.decode, data) for data in encoded]
+
+        return {
+            'bytes_mean': round(float(np.mean([len(d) for d in encoded])), 1),
+            'encode_ms_mean': round(float(np.mean(t_encode)) * 1000, 4),
+            'encode_ms_p95': round(float(np.percentile(t_encode, 95)) * 1000, 4),
+            'decode_ms_mean': round(float(np.mean(t_decode)) * 1000, 4),
+            'decode_ms_p95': round(float(np.percentile(t_decode, 95)) * 1000, 4),
+            'encode_alloc_kb': round(float(np.mean(a_encode)) / 1024, 2),
+            'decode_alloc_kb': round(float(np.mean(a_decode)) / 1024, 2),
+        }
+
+    @staticmethod
+    def write_csv(results: List[Dict[str, Any]], outpath: str):
+        with open(outpath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+    @staticmethod
+    def _peak_alloc(f: Callable, arg: Any) -> int:
+        tracemalloc.start()
+        try:
+            result = f(arg)
+            peak: int = tracemalloc.get_traced_memory()[1]
+            del result
+        finally:
+            tracemalloc.stop()
+        return peak
+
+
+def run(args=sys.argv[1:]):
+    argparser = argparse.ArgumentParser(description='TalkyCars Serialization Benchmark')
+    argparser.add_argument('--radius', '-R', default=[5, OCCUPANCY_RADIUS_DEFAULT, 15], nargs='+', type=int, help='Occupancy grid radii to sweep')
+    argparser.add_argument('--occupied', '-o', default=[0., .1, .5], nargs='+', type=float, help='Ratios of occupied cells (with occupant) to sweep')
+    argparser.add_argument('--actors', '-a', default=[2, 10], nargs='+', type=int, help='Numbers of distinct occupant actors to sweep')
+    argparser.add_argument('--codecs', '-c', default=list(CODECS.keys()), nargs='+', choices=list(CODECS.keys()), help='Encodings to compare')
+    argparser.add_argument('--samples', '-n', default=100, type=int, help='Number of scenes per configuration')
+    argparser.add_argument('--out_dir', default=os.path.join(data_dir(), 'evaluation/serialization'), type=str, help='Directory to write results to')
+
+    args, _ = argparser.parse_known_args(args)
+
+    benchmark: SerializationBenchmark = SerializationBenchmark(
+        grid_radii=args.radius,
+        occupied_ratios=args.occupied,
+        actor_counts=args.actors,
+        codecs=args.codecs,
+        n_samples=args.samples
+    )
+    results: List[Dict[str, Any]] = benchmark.run()
+
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    outpath: str = os.path.join(args.out_dir, datetime.now().strftime('python_%Y-%m-%d_%H-%M-%S.csv'))
+    benchmark.write_csv(results, outpath)
+    logging.info(f'Wrote {len(results)} results to {outpath}.')
+
+
+if __name__ == '__main__':
+    run()
@@ -71,6 +71,10 @@ def run():
         from evaluation.performance import message_generator
         message_generator.run(sys.argv[2:])
 
+    elif sys.argv[1] in {'serialization'}:
+        from evaluation.serialization import benchmark
+        benchmark.run(sys.argv[2:])
+
     elif sys.argv[1] in {'web'}:
         import uvicorn
         from web.server import app
@@ -86,10 +90,13 @@ def run():
 
     elif sys.argv[1] in {'clean'}:
         import glob
+        import shutil
         list(map(os.remove, glob.glob('../data/recordings/*.csv')))
         list(map(os.remove, glob.glob('../data/evaluation/perception/eval_log.txt')))
         list(map(os.remove, glob.glob('../data/evaluation/perception/actual/*.pkl')))
         list(map(os.remove, glob.glob('../data/evaluation/perception/observed/*.pkl')))
+        list(map(shutil.rmtree, glob.glob('../data/evaluation/perception/actual/*.tkcol')))
+        list(map(shutil.rmtree, glob.glob('../data/evaluation/perception/observed/*.tkcol')))
 
 
 if __name__ == '__main__':
@@ -18,6 +18,7 @@ from util import bbox, simulation
 
 import carla
 from client import ClientDialect, TalkyClient
+from client.occupancy.engine import EngineMode
 from common.constants import *
 from common.observation import OccupancyGridObservation
 from common.occupancy import Grid
@@ -36,7 +37,8 @@ class Ego:
                  record: bool = False,
                  is_standalone: bool = False,
                  grid_radius: float = OCCUPANCY_RADIUS_DEFAULT,
-                 lidar_angle: float = LIDAR_ANGLE_DEFAULT
+                 lidar_angle: float = LIDAR_ANGLE_DEFAULT,
+                 engine_mode: EngineMode = EngineMode.IN_PROCESS
                  ):
         self.killer: GracefulKiller = GracefulKiller() if is_standalone else None
         self.sim: carla.Client = client
@@ -84,8 +86,7 @@ class Ego:
         self.player = self.vehicle
 
         # Initialize Talky Client
-        self.client = TalkyClient(for_subject_id=self.vehicle.id, dialect=ClientDialect.CARLA)
-        self.client.gm.radius = grid_radius
+        self.client = TalkyClient(for_subject_id=self.vehicle.id, dialect=ClientDialect.CARLA, grid_radius=grid_radius, engine_mode=engine_mode)
 
         # Initialize sensors
         grid_range = grid_radius * QuadKey('0' * OCCUPANCY_TILE_LEVEL).side()
@@ -212,6 +213,7 @@ def run(args=sys.argv[1:]):
     argparser.add_argument('--debug', default='true', help='whether or not to show debug information (default: true)')
     argparser.add_argument('--render', default='true', help='whether or not to render the actor\'s camera view (default: true)')
     argparser.add_argument('--record', default='false', help='whether or not to record data (default: false)')
+    argparser.add_argument('--engine', default='in_process', choices=['in_process', 'worker_process'], help='where to run lidar matching and graph building (default: in_process)')
     args, additional_args = argparser.parse_known_args(args)
 
     logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
@@ -281,7 +283,8 @@ def run(args=sys.argv[1:]):
                   debug=args.debug.lower() == 'true',
                   record=args.record.lower() == 'true',
                   strategy=strat,
-                  is_standalone=True)
+                  is_standalone=True,
+                  engine_mode=EngineMode[args.engine.upper()])
 
     finally:
         pygame.quit()
@@ -11,6 +11,7 @@ from starlette.staticfiles import StaticFiles
 from starlette.websockets import WebSocket
 
 from common.bridge import MqttBridge
+from common.bridge.topics import tile_filter
 from common.constants import *
 from common.serialization.schema.base import PEMTrafficScene
 
@@ -58,11 +59,14 @@ def connect_mqtt(for_file: str):
     if mqtt:
         mqtt.disconnect()
 
+    # With hierarchical topics, all tiles within the given one are shown
+    topic: str = tile_filter(TOPIC_PREFIX_GRAPH_FUSED_OUT, for_file)
+
     mqtt = MqttBridge()
-    mqtt.subscribe(f'{TOPIC_PREFIX_GRAPH_FUSED_OUT}/{for_file}', on_graph)
+    mqtt.subscribe(topic, on_graph)
     mqtt.listen(block=False)
 
-    logging.info(f'Subscribed to {TOPIC_PREFIX_GRAPH_FUSED_OUT}/{for_file}')
+    logging.info(f'Subscribed to {topic}')
 
 
 @app.on_event('shutdown')